@@ -0,0 +1,12 @@
+-- Rôle en lecture seule pour keycloak_session_exporter.py (EXPORTER_BACKEND=postgres)
+-- Usage : make exporter-pg-role PG_EXPORTER_PASSWORD=...
+--   (psql -v exporter_password=... -f scripts/pg-exporter-role.sql)
+SELECT format('CREATE ROLE kc_exporter LOGIN PASSWORD %L', :'exporter_password')
+WHERE NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'kc_exporter') \gexec
+ALTER ROLE kc_exporter PASSWORD :'exporter_password';
+ALTER ROLE kc_exporter SET default_transaction_read_only = on;
+ALTER ROLE kc_exporter SET statement_timeout = '5s';
+GRANT CONNECT ON DATABASE :"DBNAME" TO kc_exporter;
+GRANT USAGE ON SCHEMA public TO kc_exporter;
+-- Uniquement les tables lues par keycloak_pg_source.py
+GRANT SELECT ON realm, client, user_entity, offline_user_session, offline_client_session, event_entity TO kc_exporter;
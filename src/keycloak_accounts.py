@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Ordonnanceur de comptes partagé par les workers de keycloak_load_test_multi_user.py.
+
+Auparavant chaque thread parcourait la liste des comptes avec son propre index démarrant à 0 :
+tous les threads frappaient le même utilisateur au même instant (entrées de cache et compteurs
+brute force concentrés). L'ordonnanceur est global et propose plusieurs politiques :
+  - round-robin : compteur global, chaque requête prend le compte suivant (défaut) ;
+  - random      : tirage uniforme ;
+  - zipf        : tirage biaisé (utilisateurs « chauds »), exposant --zipf-s ;
+  - lease       : bail exclusif, un compte n'est jamais utilisé par deux threads à la fois.
+
+Les stats (comptes distincts, compte le plus sollicité, part du top 1 %, collisions, attente
+des baux) permettent de reproduire un comportement de cache réaliste ou le pire cas.
+
+AccountStore : source de comptes mappée en mémoire pour les fichiers de plusieurs millions de
+comptes (--accounts-file). Le fichier texte « username:password » est mappé (mmap) et un index
+d'offsets de lignes est mis en cache à côté (<fichier>.idx, validé par taille + mtime) : le
+chargement prend quelques millisecondes, sans liste Python de tuples, et les pages sont partagées
+entre threads et processus. Les entrées gzip (.gz) et JSONL ({"username": ..., "password": ...})
+sont converties une fois en fichier texte cache (<fichier>.accounts).
+"""
+
+import bisect
+import gzip
+import heapq
+import itertools
+import json
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections.abc import Sequence as SequenceABC
+from contextlib import contextmanager
+from typing import Iterator, Optional, Sequence, Tuple
+
+POLICIES = ("round-robin", "random", "zipf", "lease")
+
+Account = Tuple[str, str]
+
+# En-tête de l'index : magic, taille et mtime (ns) du fichier indexé, puis offsets uint64
+_INDEX_HEADER = struct.Struct("<8sQQ")
+_INDEX_MAGIC = b"KCACCT1\0"
+
+
+def _cache_path(path: str, suffix: str) -> str:
+    """Fichier cache à côté de la source, ou dans le répertoire temporaire si non inscriptible."""
+    candidate = path + suffix
+    directory = os.path.dirname(os.path.abspath(candidate))
+    if os.access(directory, os.W_OK):
+        return candidate
+    name = os.path.abspath(candidate).replace(os.sep, "_").lstrip("_")
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def _parse_line(raw: bytes) -> Optional[Account]:
+    line = raw.decode("utf-8").strip()
+    if not line or line.startswith("#") or ":" not in line:
+        return None
+    u, p = line.split(":", 1)
+    return u.strip(), p.strip()
+
+
+def _normalize_source(path: str) -> str:
+    """Convertit une source gzip et/ou JSONL en fichier texte « username:password » (cache)."""
+    base = path[:-3] if path.endswith(".gz") else path
+    is_jsonl = base.endswith((".jsonl", ".ndjson"))
+    if not path.endswith(".gz") and not is_jsonl:
+        return path
+    target = _cache_path(path, ".accounts")
+    src_mtime = os.stat(path).st_mtime_ns
+    if os.path.isfile(target) and os.stat(target).st_mtime_ns >= src_mtime:
+        return target
+    opener = gzip.open if path.endswith(".gz") else open
+    tmp = target + ".tmp"
+    with opener(path, "rb") as src, open(tmp, "wb") as dst:
+        for raw in src:
+            if is_jsonl:
+                raw = raw.strip()
+                if not raw:
+                    continue
+                entry = json.loads(raw)
+                dst.write(f"{entry['username']}:{entry['password']}\n".encode("utf-8"))
+            else:
+                dst.write(raw if raw.endswith(b"\n") else raw + b"\n")
+    os.replace(tmp, target)
+    return target
+
+
+class AccountStore(SequenceABC):
+    """Comptes d'un fichier mappé en mémoire ; accès aléatoire ou séquentiel sans copie (thread-safe)."""
+
+    def __init__(self, path: str) -> None:
+        self.source = path
+        self.path = _normalize_source(path)
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._offsets = self._load_index(size)
+
+    def _load_index(self, size: int):
+        index_path = _cache_path(self.path, ".idx")
+        mtime = os.stat(self.path).st_mtime_ns
+        try:
+            with open(index_path, "rb") as f:
+                magic, idx_size, idx_mtime = _INDEX_HEADER.unpack(f.read(_INDEX_HEADER.size))
+                if magic == _INDEX_MAGIC and idx_size == size and idx_mtime == mtime:
+                    idx_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    return memoryview(idx_mm)[_INDEX_HEADER.size:].cast("Q")
+        except (OSError, struct.error, ValueError):
+            pass
+        offsets = self._build_index(size)
+        try:
+            tmp = index_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, size, mtime))
+                offsets.tofile(f)
+            os.replace(tmp, index_path)
+        except OSError as e:
+            print(f"  ⚠ Index de comptes non enregistré ({index_path}) : {e}")
+        return offsets
+
+    def _build_index(self, size: int) -> array:
+        """Offsets des lignes « username:password » valides (commentaires et lignes vides exclus)."""
+        offsets = array("Q")
+        mm = self._mm
+        pos = 0
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            if end < 0:
+                end = size
+            if _parse_line(mm[pos:end]) is not None:
+                offsets.append(pos)
+            pos = end + 1
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, i: int) -> Account:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start = self._offsets[i]
+        end = self._mm.find(b"\n", start)
+        if end < 0:
+            end = len(self._mm)
+        return _parse_line(self._mm[start:end])
+
+    def close(self) -> None:
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        if self._mm:
+            self._mm.close()
+        self._file.close()
+
+
+class AccountScheduler:
+    """Distribue les comptes aux workers selon une politique ; thread-safe."""
+
+    def __init__(
+        self,
+        accounts: Sequence[Account],
+        policy: str = "round-robin",
+        zipf_s: float = 1.1,
+        seed: Optional[int] = None,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"politique inconnue : {policy} ({', '.join(POLICIES)})")
+        if not len(accounts):
+            raise ValueError("aucun compte")
+        self.accounts = accounts
+        self.policy = policy
+        self.zipf_s = zipf_s
+        self._n = len(accounts)
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._next = 0
+        self._uses = array("L", bytes(array("L").itemsize * self._n))
+        self._in_use = array("H", bytes(array("H").itemsize * self._n))
+        self.collisions = 0
+        self.lease_waits = 0
+        self.lease_wait_sec = 0.0
+        self._cdf = None
+        # lease : file FIFO circulaire des comptes libres (array mélangé, sans objet Python par compte)
+        self._free: Optional[array] = None
+        self._free_head = 0
+        self._free_count = 0
+        self._cond = threading.Condition(self._lock)
+        if policy == "zipf":
+            # Rang k → poids 1/(k+1)^s ; les rangs sont attribués aux comptes dans un ordre mélangé
+            weights = (1.0 / (k + 1) ** zipf_s for k in range(self._n))
+            self._cdf = array("d", itertools.accumulate(weights))
+            self._ranks = array("L", range(self._n))
+            self._rng.shuffle(self._ranks)
+        elif policy == "lease":
+            self._free = array("L", range(self._n))
+            self._rng.shuffle(self._free)
+            self._free_count = self._n
+
+    def _pick(self) -> int:
+        if self.policy == "round-robin":
+            i = self._next
+            self._next = (i + 1) % self._n
+            return i
+        if self.policy == "random":
+            return self._rng.randrange(self._n)
+        # zipf
+        rank = bisect.bisect_left(self._cdf, self._rng.random() * self._cdf[-1])
+        return self._ranks[min(rank, self._n - 1)]
+
+    def acquire(self) -> int:
+        """Index du prochain compte à utiliser (bloque en lease si tous les comptes sont pris)."""
+        if self._free is not None:
+            with self._cond:
+                if not self._free_count:
+                    start = time.perf_counter()
+                    while not self._free_count:
+                        self._cond.wait()
+                    self.lease_waits += 1
+                    self.lease_wait_sec += time.perf_counter() - start
+                i = self._free[self._free_head]
+                self._free_head = (self._free_head + 1) % self._n
+                self._free_count -= 1
+                self._uses[i] += 1
+                self._in_use[i] += 1
+            return i
+        with self._lock:
+            i = self._pick()
+            self._uses[i] += 1
+            if self._in_use[i]:
+                self.collisions += 1
+            self._in_use[i] += 1
+        return i
+
+    def release(self, i: int) -> None:
+        with self._cond:
+            self._in_use[i] -= 1
+            if self._free is not None:
+                self._free[(self._free_head + self._free_count) % self._n] = i
+                self._free_count += 1
+                self._cond.notify()
+
+    @contextmanager
+    def checkout(self) -> Iterator[Account]:
+        """with scheduler.checkout() as (username, password): ..."""
+        i = self.acquire()
+        try:
+            yield self.accounts[i]
+        finally:
+            self.release(i)
+
+    def stats(self) -> dict:
+        """Stats d'utilisation des comptes (rapport et artefact de résultats)."""
+        with self._lock:
+            collisions = self.collisions
+            lease_waits = self.lease_waits
+            lease_wait_sec = self.lease_wait_sec
+        # Hors verrou : pas de copie ni de tri de _uses (O(n log top) au lieu de O(n log n)), les
+        # workers ne sont pas bloqués pendant le calcul ; lecture approximative si le run continue
+        top = max(1, self._n // 100)
+        hottest = heapq.nlargest(top, self._uses)
+        total = sum(self._uses)
+        return {
+            "policy": self.policy,
+            "zipf_s": self.zipf_s if self.policy == "zipf" else None,
+            "accounts": self._n,
+            "requests": total,
+            "distinct_used": self._n - self._uses.count(0),
+            "max_uses": hottest[0],
+            "top1pct_share": (sum(hottest) / total) if total else 0.0,
+            "collisions": collisions,
+            "lease_waits": lease_waits,
+            "lease_wait_sec": round(lease_wait_sec, 3),
+        }
+
+
+def print_scheduler_report(stats: dict) -> None:
+    print(f"     Comptes          : politique {stats['policy']}"
+          + (f" (s={stats['zipf_s']})" if stats["zipf_s"] is not None else "")
+          + f", {stats['distinct_used']}/{stats['accounts']} utilisés, max {stats['max_uses']} req/compte, "
+          f"top 1 % = {stats['top1pct_share'] * 100:.1f} % des requêtes")
+    if stats["policy"] == "lease":
+        print(f"     Baux             : {stats['lease_waits']} attentes ({stats['lease_wait_sec']:.1f} s cumulées)")
+    else:
+        print(f"     Collisions       : {stats['collisions']} (compte déjà utilisé par un autre thread)")
@@ -5,8 +5,8 @@ supprimer uniquement les utilisateurs créés pour les tests (préfixes loadtest
 
 Usage :
   python keycloak_admin_utils.py create-superadmin --username superadmin --password secret
-  python keycloak_admin_utils.py list-users
-  python keycloak_admin_utils.py delete-test-users [--dry-run] [--realm master]
+  python keycloak_admin_utils.py list-users [--search loadtest_] [--enabled false] [--workers 8]
+  python keycloak_admin_utils.py delete-test-users [--dry-run] [--realm master] [--workers 8]
   python keycloak_admin_utils.py create-loadtest-users --count 100 --password testpass   # pour Locust (loadtest_user_1..N)
 
 Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD.
@@ -14,8 +14,12 @@ Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, K
 
 import argparse
 import os
+import random
 import sys
-from typing import List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 try:
     from dotenv import load_dotenv
@@ -26,6 +30,7 @@ except ImportError:
     pass
 
 import requests
+from requests.adapters import HTTPAdapter
 
 _DEFAULT_PORT = os.environ.get("KEYCLOAK_PORT", "8080")
 DEFAULT_URL = os.environ.get("KEYCLOAK_URL", f"http://localhost:{_DEFAULT_PORT}").rstrip("/")
@@ -40,6 +45,24 @@ TEST_USERNAME_PREFIXES = ("loadtest_", "testuser_")
 # Utilisateurs à ne jamais supprimer (bootstrap admin, etc.)
 PROTECTED_USERNAMES = frozenset({"admin", "keycloak", "service-account-keycloak", "master-realm"})
 
+PAGE_SIZE = 500
+COUNT_WORKERS = 8
+DELETE_WORKERS = 8
+DELETE_RETRIES = 3
+PROGRESS_INTERVAL = 5.0
+# Filtres acceptés par /users et /users/count → (option CLI de list-users, aide) ; booléens : true/false
+USER_FILTERS = {
+    "search": ("--search", "Recherche serveur (préfixe/sous-chaîne de username, email, nom)"),
+    "username": ("--username", "Filtre username"),
+    "email": ("--email", "Filtre email"),
+    "firstName": ("--first-name", "Filtre prénom"),
+    "lastName": ("--last-name", "Filtre nom"),
+    "enabled": ("--enabled", "Comptes actifs / désactivés seulement"),
+    "emailVerified": ("--email-verified", "Email vérifié ou non"),
+    "q": ("--q", 'Attributs "clé:valeur" (ex. "tenant:acme")'),
+}
+_BOOLEAN_FILTERS = ("enabled", "emailVerified")
+
 
 def get_admin_token(base_url: str, admin_user: str, admin_pass: str) -> str:
     r = requests.post(
@@ -56,10 +79,93 @@ def get_admin_token(base_url: str, admin_user: str, admin_pass: str) -> str:
     return r.json()["access_token"]
 
 
+def admin_token_provider(base_url: str, admin_user: str, admin_pass: str, max_age: float = 30.0) -> Callable[[], str]:
+    """Token admin partagé entre threads, renouvelé toutes les max_age secondes (créations longues)."""
+    lock = threading.Lock()
+    state = {"token": None, "at": 0.0}
+
+    def current() -> str:
+        with lock:
+            if state["token"] is None or time.monotonic() - state["at"] > max_age:
+                state["token"] = get_admin_token(base_url, admin_user, admin_pass)
+                state["at"] = time.monotonic()
+            return state["token"]
+
+    return current
+
+
 def auth_headers(token: str) -> dict:
     return {"Authorization": f"Bearer {token}", "Content-Type": "application/json", "Accept": "application/json"}
 
 
+# ── Appels instrumentés (exporteur de sessions, soak) ────────────────────────
+_api_http: Optional[requests.Session] = None
+_api_lock = threading.Lock()
+_api_pool_size = 10
+_api_observer: Optional[Callable[[str, str, float, int], None]] = None
+
+
+def configure_api(pool_size: int, observer: Optional[Callable[[str, str, float, int], None]] = None) -> None:
+    """Taille du pool de la session partagée et observateur (endpoint, statut, durée, octets) de chaque appel."""
+    global _api_http, _api_pool_size, _api_observer
+    with _api_lock:
+        _api_pool_size = max(1, pool_size)
+        _api_observer = observer
+        _api_http = None
+
+
+def api_session() -> requests.Session:
+    """Session HTTP partagée (connexions keep-alive réutilisées entre appels et threads)."""
+    global _api_http
+    with _api_lock:
+        if _api_http is None:
+            _api_http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_api_pool_size)
+            _api_http.mount("http://", adapter)
+            _api_http.mount("https://", adapter)
+        return _api_http
+
+
+def api_request(endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+    """Appel HTTP via la session partagée, transmis à l'observateur (statut "timeout" / "error" sans réponse)."""
+    start = time.perf_counter()
+    status = "error"
+    size = 0
+    try:
+        r = api_session().request(method, url, **kwargs)
+        status = str(r.status_code)
+        size = len(r.content)
+        return r
+    except requests.exceptions.Timeout:
+        status = "timeout"
+        raise
+    finally:
+        observer = _api_observer
+        if observer is not None:
+            observer(endpoint, status, time.perf_counter() - start, size)
+
+
+def fetch_client_session_stats(base_url: str, realm: str, token: str):
+    """Retourne soit un dict {client_id: count} (format Keycloak récent), soit une list de {id, clientId, active} (ancien) ; None si erreur."""
+    try:
+        r = api_request(
+            "client-session-stats",
+            "GET",
+            f"{base_url}/admin/realms/{realm}/client-session-stats",
+            headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+            timeout=15,
+        )
+        r.raise_for_status()
+        return r.json()
+    except Exception as e:
+        err = getattr(e, "response", None)
+        if err is not None:
+            print(f"fetch_client_session_stats ({realm}) : {err.status_code} {err.text[:200]}", file=sys.stderr)
+        else:
+            print(f"fetch_client_session_stats ({realm}) : error: {e}", file=sys.stderr)
+        return None
+
+
 def get_realms(base_url: str, token: str) -> List[dict]:
     r = requests.get(
         f"{base_url}/admin/realms",
@@ -70,40 +176,65 @@ def get_realms(base_url: str, token: str) -> List[dict]:
     return r.json()
 
 
-def count_users_in_realm(base_url: str, realm: str, token: str) -> int:
+def _count_users_paged(base_url: str, realm: str, token: str, filters: Dict[str, str]) -> int:
+    """Repli si /users/count est refusé : pages briefRepresentation (id et username seulement)."""
     total = 0
     first = 0
-    page_size = 500
     while True:
         r = requests.get(
             f"{base_url}/admin/realms/{realm}/users",
-            params={"first": first, "max": page_size},
+            params={**filters, "briefRepresentation": "true", "first": first, "max": PAGE_SIZE},
             headers=auth_headers(token),
-            timeout=15,
+            timeout=30,
         )
         r.raise_for_status()
         users = r.json()
         total += len(users)
-        if len(users) < page_size:
+        if len(users) < PAGE_SIZE:
             break
-        first += page_size
+        first += PAGE_SIZE
     return total
 
 
-def list_user_count_per_realm(base_url: str, token: str) -> List[Tuple[str, int]]:
-    realms = get_realms(base_url, token)
-    result = []
-    for realm_info in realms:
-        realm = realm_info.get("realm") or realm_info.get("id")
-        if not realm:
-            continue
+def count_users_in_realm(base_url: str, realm: str, token: str, filters: Optional[Dict[str, str]] = None) -> int:
+    """
+    Nombre d'utilisateurs du realm (filtres USER_FILTERS optionnels) : un seul appel /users/count,
+    comptage en base côté serveur. Repli sur la pagination si l'endpoint ou un filtre n'est pas supporté.
+    """
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, "")}
+    r = requests.get(
+        f"{base_url}/admin/realms/{realm}/users/count",
+        params=filters,
+        headers=auth_headers(token),
+        timeout=30,
+    )
+    if r.status_code in (400, 404, 405):
+        return _count_users_paged(base_url, realm, token, filters)
+    r.raise_for_status()
+    return int(r.json())
+
+
+def list_user_count_per_realm(
+    base_url: str,
+    token: str,
+    filters: Optional[Dict[str, str]] = None,
+    workers: int = COUNT_WORKERS,
+) -> List[Tuple[str, int]]:
+    """(realm, nombre) pour chaque realm, realms interrogés en parallèle ; -1 si le comptage échoue."""
+    realms = [r.get("realm") or r.get("id") for r in get_realms(base_url, token)]
+    realms = [r for r in realms if r]
+
+    def count(realm: str) -> Tuple[str, int]:
         try:
-            n = count_users_in_realm(base_url, realm, token)
-            result.append((realm, n))
+            return realm, count_users_in_realm(base_url, realm, token, filters)
         except Exception as e:
-            result.append((realm, -1))
             print(f"  ⚠ {realm}: erreur ({e})", file=sys.stderr)
-    return result
+            return realm, -1
+
+    if not realms:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(realms)))) as pool:
+        return list(pool.map(count, realms))
 
 
 def get_realm_management_client_id(base_url: str, realm: str, token: str) -> Optional[str]:
@@ -280,73 +411,126 @@ def create_loadtest_users(
     return created, skipped
 
 
-def get_users_in_realm(base_url: str, realm: str, token: str) -> List[dict]:
-    out = []
+def _is_test_username(username: str) -> bool:
+    return username not in PROTECTED_USERNAMES and any(username.startswith(p) for p in TEST_USERNAME_PREFIXES)
+
+
+def iter_candidate_pages(
+    base_url: str,
+    realm: str,
+    token: Callable[[], str],
+    prefix: str,
+    http: Optional[requests.Session] = None,
+) -> Iterator[List[dict]]:
+    """
+    Pages de la recherche serveur `search=prefix` (briefRepresentation : id et username seulement).
+    Le générateur reçoit via send() le nombre de candidats restés en place dans la page (non supprimés) :
+    les suivants glissent vers le début de la liste, l'offset n'avance que de ce nombre.
+    """
+    http = http or requests
     first = 0
-    page_size = 500
     while True:
-        r = requests.get(
+        r = http.get(
             f"{base_url}/admin/realms/{realm}/users",
-            params={"first": first, "max": page_size},
-            headers=auth_headers(token),
-            timeout=15,
+            params={"search": prefix, "briefRepresentation": "true", "first": first, "max": PAGE_SIZE},
+            headers=auth_headers(token()),
+            timeout=30,
         )
         r.raise_for_status()
-        users = r.json()
-        out.extend(users)
-        if len(users) < page_size:
+        page = r.json()
+        kept = yield page
+        if len(page) < PAGE_SIZE:
+            return
+        first += len(page) if kept is None else kept
+
+
+def _delete_user(
+    http: requests.Session, base_url: str, realm: str, token: Callable[[], str], user_id: str, retries: int
+) -> Tuple[bool, str]:
+    """DELETE avec nouvelles tentatives (429, 5xx, erreurs réseau ; attente exponentielle). 404 = déjà supprimé."""
+    detail = ""
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(min(10.0, 0.5 * 2 ** (attempt - 1)) * (0.5 + random.random()))
+        try:
+            r = http.delete(f"{base_url}/admin/realms/{realm}/users/{user_id}", headers=auth_headers(token()), timeout=10)
+        except requests.RequestException as e:
+            detail = type(e).__name__
+            continue
+        if r.status_code in (200, 204, 404):
+            return True, ""
+        detail = str(r.status_code)
+        if r.status_code != 429 and r.status_code < 500:
             break
-        first += page_size
-    return out
+    return False, detail
 
 
 def delete_test_users(
     base_url: str,
     realm: str,
-    token: str,
+    token: Callable[[], str],
     dry_run: bool = True,
+    workers: int = DELETE_WORKERS,
+    retries: int = DELETE_RETRIES,
 ) -> Tuple[int, int]:
     """
-    Supprime uniquement les utilisateurs dont le username commence par TEST_USERNAME_PREFIX.
+    Supprime uniquement les utilisateurs dont le username commence par un préfixe de TEST_USERNAME_PREFIXES.
     Ne touche jamais aux utilisateurs protégés (admin, etc.).
-    Retourne (nombre supprimés, nombre ignorés/protégés).
+    Seuls les candidats de la recherche serveur (search=préfixe) sont lus, page par page, et supprimés
+    par un pool de `workers` threads (nouvelles tentatives, débit affiché toutes les PROGRESS_INTERVAL s).
+    Retourne (nombre supprimés, nombre ignorés/protégés/en échec parmi les candidats).
     """
-    users = get_users_in_realm(base_url, realm, token)
+    http = requests.Session()
+    http.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers)))
     deleted = 0
     skipped = 0
-    for u in users:
-        username = (u.get("username") or "").strip()
-        if not username:
-            skipped += 1
+    for prefix in TEST_USERNAME_PREFIXES:
+        expected = count_users_in_realm(base_url, realm, token(), {"search": prefix})
+        if not expected:
             continue
-        if username in PROTECTED_USERNAMES:
-            skipped += 1
-            continue
-        if not any(username.startswith(p) for p in TEST_USERNAME_PREFIXES):
-            skipped += 1
-            continue
-        user_id = u.get("id")
-        if not user_id:
-            continue
-        if dry_run:
-            print(f"  [dry-run] serait supprimé : {username} ({user_id})")
-            deleted += 1
-        else:
-            try:
-                rd = requests.delete(
-                    f"{base_url}/admin/realms/{realm}/users/{user_id}",
-                    headers=auth_headers(token),
-                    timeout=10,
-                )
-                if rd.status_code in (200, 204):
-                    print(f"  Supprimé : {username}")
-                    deleted += 1
+        print(f"  {prefix}* : {expected} candidat(s)")
+        start = time.monotonic()
+        last_report = start
+        done = 0
+        pages = iter_candidate_pages(base_url, realm, token, prefix, http)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            page = next(pages, None)
+            while page is not None:
+                targets = []
+                for u in page:
+                    username = (u.get("username") or "").strip()
+                    if u.get("id") and username.startswith(prefix) and _is_test_username(username):
+                        targets.append((username, u["id"]))
+                kept = len(page) - len(targets)
+                skipped += kept
+                if dry_run:
+                    for username, user_id in targets:
+                        print(f"  [dry-run] serait supprimé : {username} ({user_id})")
+                    deleted += len(targets)
+                    kept = len(page)
                 else:
-                    print(f"  ⚠ Échec suppression {username}: {rd.status_code}", file=sys.stderr)
-                    skipped += 1
-            except Exception as e:
-                print(f"  ⚠ Erreur suppression {username}: {e}", file=sys.stderr)
-                skipped += 1
+                    results = pool.map(lambda t: _delete_user(http, base_url, realm, token, t[1], retries), targets)
+                    for (username, _), (ok, detail) in zip(targets, results):
+                        if ok:
+                            deleted += 1
+                        else:
+                            print(f"  ⚠ Échec suppression {username}: {detail}", file=sys.stderr)
+                            skipped += 1
+                            kept += 1
+                    done += len(targets)
+                    now = time.monotonic()
+                    if now - last_report >= PROGRESS_INTERVAL:
+                        rate = done / (now - start)
+                        eta = max(0, expected - done) / rate if rate else 0
+                        print(f"  {prefix}* : {done}/{expected} traités ({rate:.0f}/s, reste ~{eta:.0f} s)")
+                        last_report = now
+                try:
+                    page = pages.send(kept)
+                except StopIteration:
+                    page = None
+        if not dry_run and done:
+            elapsed = time.monotonic() - start
+            print(f"  {prefix}* : {done} traités en {elapsed:.1f} s ({done / elapsed if elapsed else 0:.0f}/s)")
     return deleted, skipped
 
 
@@ -363,12 +547,18 @@ def main() -> int:
 
     # list-users
     p_list = sub.add_parser("list-users", help="Afficher le nombre d'utilisateurs par realm")
+    for name, (flag, help_text) in USER_FILTERS.items():
+        choices = ("true", "false") if name in _BOOLEAN_FILTERS else None
+        p_list.add_argument(flag, dest=name, choices=choices, default=None, help=help_text)
+    p_list.add_argument("--workers", type=int, default=COUNT_WORKERS, help=f"Realms interrogés en parallèle (défaut: {COUNT_WORKERS})")
     p_list.add_argument("--url", default=DEFAULT_URL, help="URL Keycloak")
 
     # delete-test-users
     p_del = sub.add_parser("delete-test-users", help="Supprimer les utilisateurs de test (loadtest_* et testuser_*)")
     p_del.add_argument("--dry-run", action="store_true", help="Afficher les utilisateurs qui seraient supprimés sans supprimer")
     p_del.add_argument("--realm", default=DEFAULT_REALM, help="Realm à traiter (défaut: master)")
+    p_del.add_argument("--workers", type=int, default=DELETE_WORKERS, help=f"Suppressions en parallèle (défaut: {DELETE_WORKERS})")
+    p_del.add_argument("--retries", type=int, default=DELETE_RETRIES, help=f"Nouvelles tentatives par suppression (429, 5xx ; défaut: {DELETE_RETRIES})")
     p_del.add_argument("--url", default=DEFAULT_URL, help="URL Keycloak")
 
     # create-loadtest-users (pour Locust : loadtest_user_1, loadtest_user_2, ...)
@@ -395,10 +585,15 @@ def main() -> int:
         return 0 if ok else 1
 
     if args.command == "list-users":
-        counts = list_user_count_per_realm(base_url, token)
-        print("Nombre d'utilisateurs par realm :")
+        filters = {k: getattr(args, k) for k in USER_FILTERS if getattr(args, k)}
+        counts = list_user_count_per_realm(base_url, token, filters, workers=args.workers)
+        suffix = " (" + ", ".join(f"{k}={v}" for k, v in filters.items()) + ")" if filters else ""
+        print(f"Nombre d'utilisateurs par realm{suffix} :")
         for realm, n in sorted(counts, key=lambda x: x[0]):
             print(f"  {realm}: {n}" if n >= 0 else f"  {realm}: erreur")
+        total = sum(n for _, n in counts if n >= 0)
+        if len(counts) > 1:
+            print(f"  total: {total}")
         return 0
 
     if args.command == "delete-test-users":
@@ -408,7 +603,8 @@ def main() -> int:
             print(f"Mode dry-run (realm={realm}) — aucun utilisateur ne sera supprimé :")
         else:
             print(f"Suppression des utilisateurs de test (username commençant par {list(TEST_USERNAME_PREFIXES)}) dans le realm '{realm}' :")
-        deleted, skipped = delete_test_users(base_url, realm, token, dry_run=dry_run)
+        provider = admin_token_provider(base_url, admin_user, admin_pass)
+        deleted, skipped = delete_test_users(base_url, realm, provider, dry_run=dry_run, workers=args.workers, retries=args.retries)
         print(f"Résultat : {deleted} utilisateur(s) {'à supprimer' if dry_run else 'supprimé(s)'}, {skipped} ignoré(s)/protégé(s).")
         return 0
 
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Recherche automatique de capacité : débit maximal soutenable sous un SLO.
+
+Utilisé par keycloak_load_test.py, keycloak_load_test_multi_user.py (--mode search) et
+test_keycloak.py (--strategy search). Le niveau de charge (concurrence ou débit cible) est
+augmenté par paliers courts (échelle ×factor) jusqu'à violation du SLO, puis affiné par
+dichotomie entre le dernier palier conforme et le premier palier en échec.
+
+Chaque palier dure --step-duration secondes ; les --stabilize premières secondes sont exclues
+des mesures. Le rapport donne le débit max soutenable avec un intervalle de confiance à 95 %
+(calculé sur le débit par seconde du palier retenu).
+"""
+
+import argparse
+import math
+import statistics
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from keycloak_load_profile import Result, Stage, StageMark, percentile, run_profile
+
+SEARCH_BY = ("concurrency", "rate")
+
+
+class Slo(NamedTuple):
+    p99_sec: float
+    max_error_rate: float
+
+
+class StepOutcome(NamedTuple):
+    level: int
+    requests: int
+    throughput: float
+    ci_low: float
+    ci_high: float
+    p99: float
+    error_rate: float
+    ok: bool
+
+
+def add_search_arguments(parser: argparse.ArgumentParser, default_by: str = "concurrency") -> None:
+    """Options communes aux outils pour le mode search."""
+    parser.add_argument("--slo-p99", type=float, default=0.5, metavar="SEC", help="SLO : p99 maximal en secondes (défaut: 0.5)")
+    parser.add_argument("--slo-error-rate", type=float, default=0.001, metavar="RATIO", help="SLO : taux d'erreur maximal (défaut: 0.001 = 0.1 %%)")
+    parser.add_argument("--search-by", choices=SEARCH_BY, default=default_by, help=f"Niveau recherché : concurrence (threads) ou débit cible req/s (défaut: {default_by})")
+    parser.add_argument("--search-start", type=int, default=5, metavar="N", help="Premier niveau testé (défaut: 5)")
+    parser.add_argument("--search-max", type=int, default=2000, metavar="N", help="Niveau maximal (défaut: 2000)")
+    parser.add_argument("--search-factor", type=float, default=2.0, help="Facteur de l'échelle avant dichotomie (défaut: 2)")
+    parser.add_argument("--search-resolution", type=float, default=0.05, metavar="RATIO", help="Arrêt de la dichotomie quand (haut-bas)/bas < RATIO (défaut: 0.05)")
+    parser.add_argument("--search-threads", type=int, default=200, metavar="N", help="Threads disponibles en --search-by rate (défaut: 200)")
+    parser.add_argument("--step-duration", type=float, default=30.0, metavar="SEC", help="Durée d'un palier (défaut: 30)")
+    parser.add_argument("--stabilize", type=float, default=10.0, metavar="SEC", help="Secondes exclues en début de palier (défaut: 10)")
+
+
+def slo_from_args(args) -> Slo:
+    return Slo(args.slo_p99, args.slo_error_rate)
+
+
+def search_stage(args, level: int) -> Stage:
+    """Palier d'un niveau : concurrence = `level` threads ; débit = `level` req/s avec --search-threads threads."""
+    if args.search_by == "rate":
+        return Stage(f"search-{level}req/s", args.step_duration, args.search_threads, float(level), "step")
+    return Stage(f"search-{level}", args.step_duration, level, None, "step")
+
+
+def evaluate_step(level: int, results: List[Result], start: float, end: float, stabilize: float, slo: Slo) -> StepOutcome:
+    """Stats d'un palier après la fenêtre de stabilisation ; IC 95 % sur le débit par seconde."""
+    window_start = start + min(stabilize, max(end - start - 1.0, 0.0))
+    window = [r for r in results if window_start <= r[3] <= end]
+    span = max(end - window_start, 1e-9)
+    nb_sec = max(1, int(span))
+    per_sec = [0.0] * nb_sec
+    for r in window:
+        per_sec[min(int(r[3] - window_start), nb_sec - 1)] += 1
+    throughput = len(window) / span
+    if nb_sec >= 2:
+        half = 1.96 * statistics.stdev(per_sec) / math.sqrt(nb_sec)
+    else:
+        half = 0.0
+    ok_lat = sorted(r[1] for r in window if r[0])
+    errors = sum(1 for r in window if not r[0])
+    error_rate = errors / len(window) if window else 1.0
+    p99 = percentile(ok_lat, 99) if ok_lat else float("inf")
+    ok = bool(window) and p99 <= slo.p99_sec and error_rate <= slo.max_error_rate
+    return StepOutcome(level, len(window), throughput, max(throughput - half, 0.0), throughput + half, p99, error_rate, ok)
+
+
+def search_capacity(
+    run_step: Callable[[int], Tuple[List[Result], StageMark]],
+    slo: Slo,
+    start_level: int,
+    max_level: int,
+    factor: float,
+    resolution: float,
+    stabilize: float,
+    on_step: Optional[Callable[[StepOutcome], None]] = None,
+) -> Tuple[Optional[StepOutcome], List[StepOutcome]]:
+    """
+    Échelle puis dichotomie. run_step(level) exécute un palier et retourne (résultats du palier, bornes).
+    Retourne (meilleur palier conforme ou None, tous les paliers).
+    """
+    steps: List[StepOutcome] = []
+
+    def run(level: int) -> StepOutcome:
+        results, mark = run_step(level)
+        outcome = evaluate_step(level, results, mark.start, mark.end, stabilize, slo)
+        steps.append(outcome)
+        if on_step:
+            on_step(outcome)
+        return outcome
+
+    best: Optional[StepOutcome] = None
+    failed_level: Optional[int] = None
+    level = max(1, start_level)
+    # Échelle : ×factor tant que le SLO est respecté
+    while level <= max_level:
+        outcome = run(level)
+        if not outcome.ok:
+            failed_level = level
+            break
+        best = outcome
+        if level == max_level:
+            break
+        level = min(max_level, max(level + 1, int(level * factor)))
+    if failed_level is None:
+        return best, steps
+
+    # Dichotomie entre le dernier niveau conforme et le premier en échec
+    lo = best.level if best else 0
+    hi = failed_level
+    while hi - lo > 1 and (lo == 0 or (hi - lo) / lo > resolution):
+        mid = (lo + hi) // 2
+        outcome = run(mid)
+        if outcome.ok:
+            lo = mid
+            best = outcome
+        else:
+            hi = mid
+    return best, steps
+
+
+def print_step(outcome: StepOutcome) -> None:
+    mark = "✅" if outcome.ok else "❌"
+    p99 = f"{outcome.p99:.3f}" if math.isfinite(outcome.p99) else "n/a"
+    print(f"   {mark} niveau {outcome.level:>5} : {outcome.throughput:8.1f} req/s "
+          f"[{outcome.ci_low:.1f} ; {outcome.ci_high:.1f}]  p99={p99}  erreurs={outcome.error_rate * 100:.2f} %")
+
+
+def print_search_report(best: Optional[StepOutcome], steps: List[StepOutcome], slo: Slo, search_by: str) -> None:
+    print("  📈 Recherche de capacité")
+    print("-" * 40)
+    print(f"     SLO              : p99 ≤ {slo.p99_sec:.3f} s, erreurs ≤ {slo.max_error_rate * 100:.2f} %")
+    print(f"     Paliers testés   : {len(steps)}")
+    if best is None:
+        print("     Aucun niveau ne respecte le SLO (réduire --search-start).")
+        return
+    unit = "req/s cible" if search_by == "rate" else "threads"
+    print(f"     Niveau max       : {best.level} {unit}")
+    print(f"     Débit soutenable : {best.throughput:.1f} req/s (IC 95 % : {best.ci_low:.1f} – {best.ci_high:.1f})")
+    print(f"     p99 / erreurs    : {best.p99:.3f} s / {best.error_rate * 100:.2f} %")
+
+
+def steps_as_dicts(steps: List[StepOutcome]) -> List[dict]:
+    """Paliers sérialisables (artefact de résultats)."""
+    return [
+        {k: (v if not isinstance(v, float) or math.isfinite(v) else None) for k, v in s._asdict().items()}
+        for s in steps
+    ]
+
+
+def search_record(args, best: Optional[StepOutcome], steps: List[StepOutcome]) -> dict:
+    """Section « search » de l'artefact de résultats (keycloak_run_results)."""
+    return {
+        "search": {
+            "search_by": args.search_by,
+            "slo": slo_from_args(args)._asdict(),
+            "best": steps_as_dicts([best])[0] if best else None,
+            "steps": steps_as_dicts(steps),
+        }
+    }
+
+
+def run_search(
+    args,
+    request_factory: Callable[[int], Callable[[], Tuple[bool, float, Optional[str]]]],
+    results: List[Result],
+    results_lock: threading.Lock,
+    timeout: float,
+    pause: float = 2.0,
+) -> Tuple[Optional[StepOutcome], List[StepOutcome], List[StageMark]]:
+    """
+    Recherche complète avec le moteur de paliers (keycloak_load_profile) : chaque niveau est un palier
+    « step ». Les résultats de tous les paliers sont ajoutés à `results`. Retourne (meilleur, paliers, bornes).
+    """
+    marks: List[StageMark] = []
+
+    def run_step(level: int) -> Tuple[List[Result], StageMark]:
+        step_results: List[Result] = []
+        step_lock = threading.Lock()
+        mark = run_profile([search_stage(args, level)], request_factory, step_results, step_lock, timeout)[0]
+        with results_lock:
+            results.extend(step_results)
+        marks.append(mark)
+        # Courte pause entre paliers pour laisser retomber les files d'attente côté Keycloak
+        time.sleep(pause)
+        return step_results, mark
+
+    best, steps = search_capacity(
+        run_step,
+        slo_from_args(args),
+        args.search_start,
+        args.search_max,
+        args.search_factor,
+        args.search_resolution,
+        args.stabilize,
+        on_step=print_step,
+    )
+    return best, steps, marks
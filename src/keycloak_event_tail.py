@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Lecture en continu des événements Keycloak dans ses logs (listener jboss-logging), alternative au
+polling de /admin/realms/{realm}/events : aucun appel à l'API Admin, pas de rafale manquée entre
+deux collectes.
+
+Keycloak journalise chaque événement (logger org.keycloak.events) sous la forme
+  type="LOGIN", realmId="...", realmName="master", clientId="app", userId="...", ..., username="bob"
+(valeurs sans guillemets sur les anciennes versions), dans une ligne JSON (KC_LOG_CONSOLE_OUTPUT=json
+ou KC_LOG_FILE_OUTPUT=json) ou texte. Les lignes sont filtrées par simple recherche de sous-chaîne
+avant tout décodage ; seules les lignes d'événements sont décodées (json + une regex clé=valeur).
+
+État borné : compteurs par (realm, type, client, erreur) plafonnés (EXPORTER_EVENT_LOG_MAX_SERIES,
+au-delà client_id="__other__"), pics par seconde sur une fenêtre glissante, histogramme du retard
+de lecture, derniers LOGIN par realm.
+
+Sources : fichier suivi comme `tail -F` (rotation et troncature gérées) ou "-" (entrée standard).
+Usage autonome (débits par seconde en direct) :
+  docker logs -f keycloak 2>&1 | python keycloak_event_tail.py -
+  python keycloak_event_tail.py /var/log/keycloak/keycloak.log --from-start
+"""
+
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional, TextIO
+
+EVENT_LOGGER = "org.keycloak.events"
+MAX_SERIES = int(os.environ.get("EXPORTER_EVENT_LOG_MAX_SERIES", "5000"))
+PEAK_WINDOW = int(os.environ.get("EXPORTER_EVENT_LOG_PEAK_WINDOW", "60"))
+MAX_LOGINS = int(os.environ.get("EXPORTER_LAST_LOGIN_EVENTS", "25"))
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+MAX_PARTIAL_LINE = 1 << 20
+OTHER_CLIENT = "__other__"
+
+_KV = re.compile(r'(\w+)=(?:"((?:[^"\\]|\\.)*)"|([^,\s]*))')
+
+
+def _parse_timestamp(value) -> Optional[float]:
+    """Horodatage JSON Keycloak (ISO 8601) → epoch s ; None si absent ou illisible."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_event_line(line: str) -> Optional[dict]:
+    """
+    Ligne de log → événement {"type", "realm", "clientId", "userId", "error", "username", "time"}
+    (time en epoch s ou None) ; None si ce n'est pas une ligne d'événement.
+    """
+    if EVENT_LOGGER not in line or "type=" not in line:
+        return None
+    timestamp = None
+    message = line
+    if line.lstrip().startswith("{"):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if not str(record.get("loggerName", "")).startswith(EVENT_LOGGER):
+            return None
+        message = str(record.get("message") or "")
+        timestamp = _parse_timestamp(record.get("timestamp"))
+    fields = {m.group(1): m.group(2) if m.group(2) is not None else m.group(3) for m in _KV.finditer(message)}
+    event_type = fields.get("type")
+    if not event_type:
+        return None
+    user_id = fields.get("userId")
+    return {
+        "type": event_type,
+        "realm": fields.get("realmName") or fields.get("realmId") or "",
+        "clientId": fields.get("clientId") or "",
+        "userId": user_id if user_id and user_id != "null" else None,
+        "error": fields.get("error") or "",
+        "username": fields.get("username") or "",
+        "time": timestamp,
+    }
+
+
+class EventLogTailer:
+    """Suit un fichier de log (ou stdin) et agrège les événements Keycloak en mémoire bornée."""
+
+    def __init__(self, path: str, from_start: bool = False, max_series: int = MAX_SERIES, peak_window: int = PEAK_WINDOW) -> None:
+        self.path = path
+        self.from_start = from_start
+        self.max_series = max_series
+        self.peak_window = max(1, peak_window)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counts: Dict[tuple, int] = {}  # (realm, type, client, erreur) -> n
+        self._seconds: deque = deque(maxlen=self.peak_window)  # [(seconde epoch, {(realm, type): n})]
+        self.lag = [0] * (len(LAG_BUCKETS) + 1) + [0.0]
+        self.logins: Dict[str, deque] = {}  # realm -> derniers LOGIN
+        self.lines = 0
+        self.events = 0
+        self.overflow = 0
+        self.open = False
+
+    def feed(self, line: str, now: Optional[float] = None) -> Optional[dict]:
+        """Traite une ligne ; retourne l'événement reconnu (ou None)."""
+        evt = parse_event_line(line)
+        now = now if now is not None else time.time()
+        with self._lock:
+            self.lines += 1
+            if evt is None:
+                return None
+            self.events += 1
+            key = (evt["realm"], evt["type"], evt["clientId"], evt["error"])
+            if key not in self.counts and len(self.counts) >= self.max_series:
+                key = (evt["realm"], evt["type"], OTHER_CLIENT, evt["error"])
+                self.overflow += 1
+            self.counts[key] = self.counts.get(key, 0) + 1
+            second = int(evt["time"] if evt["time"] is not None else now)
+            if not self._seconds or self._seconds[-1][0] < second:
+                self._seconds.append((second, {}))
+            slot = self._seconds[-1][1] if self._seconds[-1][0] == second else None
+            if slot is not None:
+                slot[(evt["realm"], evt["type"])] = slot.get((evt["realm"], evt["type"]), 0) + 1
+            if evt["time"] is not None:
+                delay = max(0.0, now - evt["time"])
+                self.lag[bisect.bisect_left(LAG_BUCKETS, delay)] += 1
+                self.lag[-1] += delay
+            if evt["type"] == "LOGIN" and evt["userId"]:
+                logins = self.logins.get(evt["realm"])
+                if logins is None:
+                    logins = self.logins[evt["realm"]] = deque(maxlen=MAX_LOGINS)
+                logins.append({"userId": evt["userId"], "username": evt["username"], "time": int(second * 1000)})
+        return evt
+
+    def snapshot(self) -> dict:
+        """
+        État figé pour le rendu des métriques. Pics calculés sur les secondes écoulées des peak_window
+        dernières secondes : après une rafale suivie d'un silence, le pic retombe.
+        """
+        with self._lock:
+            peaks: Dict[tuple, int] = {}
+            current = int(time.time())
+            while self._seconds and self._seconds[0][0] < current - self.peak_window:
+                self._seconds.popleft()
+            for second, slot in self._seconds:
+                if second >= current:
+                    continue
+                for key, count in slot.items():
+                    peaks[key] = max(peaks.get(key, 0), count)
+            return {
+                "counts": dict(self.counts),
+                "peaks": peaks,
+                "lag": list(self.lag),
+                "logins": {realm: list(reversed(d)) for realm, d in self.logins.items()},
+                "lines": self.lines,
+                "events": self.events,
+                "overflow": self.overflow,
+                "open": self.open,
+            }
+
+    def _read_stream(self, stream: TextIO) -> None:
+        for line in stream:
+            if self._stop.is_set():
+                return
+            self.feed(line)
+
+    def _follow_file(self) -> None:
+        """Suivi façon `tail -F` : réouverture si le fichier est remplacé (rotation) ou tronqué."""
+        f = None
+        inode = None
+        partial = ""
+        first_open = True
+        while not self._stop.is_set():
+            if f is None:
+                try:
+                    f = open(self.path, "r", encoding="utf-8", errors="replace")
+                except OSError:
+                    self.open = False
+                    self._stop.wait(1.0)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if first_open and not self.from_start:
+                    f.seek(0, os.SEEK_END)
+                first_open = False
+                partial = ""
+                self.open = True
+            line = f.readline()
+            if line:
+                partial += line
+                if partial.endswith("\n"):
+                    self.feed(partial)
+                    partial = ""
+                elif len(partial) > MAX_PARTIAL_LINE:
+                    partial = ""
+                continue
+            try:
+                st = os.stat(self.path)
+                rotated = st.st_ino != inode or st.st_size < f.tell()
+            except OSError:
+                rotated = True
+            if rotated:
+                f.close()
+                f = None
+                continue
+            self._stop.wait(0.2)
+        if f is not None:
+            f.close()
+
+    def run(self) -> None:
+        if self.path == "-":
+            self.open = True
+            self._read_stream(sys.stdin)
+            self.open = False
+        else:
+            self._follow_file()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Débits d'événements Keycloak par seconde, lus dans les logs (listener jboss-logging).")
+    parser.add_argument("path", nargs="?", default="-", help="Fichier de log suivi, ou - pour l'entrée standard (défaut)")
+    parser.add_argument("--from-start", action="store_true", help="Lire le fichier depuis le début (défaut : seulement les nouvelles lignes)")
+    parser.add_argument("--types", type=str, default="LOGIN,LOGIN_ERROR,REFRESH_TOKEN,LOGOUT", help="Types affichés (défaut: LOGIN,LOGIN_ERROR,REFRESH_TOKEN,LOGOUT)")
+    args = parser.parse_args()
+
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+    tailer = EventLogTailer(args.path, from_start=args.from_start, peak_window=2)
+    tailer.start()
+    print(f"  {'heure':<8} " + " ".join(f"{t[:14]:>14}" for t in types) + "   (événements/s)")
+    previous: Dict[str, int] = {}
+    try:
+        while True:
+            time.sleep(1.0)
+            snap = tailer.snapshot()
+            totals: Dict[str, int] = {}
+            for (_, event_type, _, _), count in snap["counts"].items():
+                totals[event_type] = totals.get(event_type, 0) + count
+            print(f"  {time.strftime('%H:%M:%S')} " + " ".join(f"{totals.get(t, 0) - previous.get(t, 0):>14}" for t in types))
+            previous = totals
+            if tailer._thread is not None and not tailer._thread.is_alive():
+                break
+    except KeyboardInterrupt:
+        pass
+    tailer.stop()
+    snap = tailer.snapshot()
+    print(f"  {snap['events']} événements sur {snap['lines']} lignes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Registre persistant de comptes de test (fixtures) réutilisables entre runs.
+
+Chaque --create-users de keycloak_load_test_multi_user.py créait N users loadtest_{i}_{run_id}
+puis les supprimait : plusieurs minutes de préparation par run et un cache utilisateurs froid.
+Avec --reuse-fixtures, les comptes {prefix}{i} (i = 0..N-1) sont enregistrés dans un registre
+local (JSON) indexé par realm, préfixe, nombre et politique de mot de passe du realm :
+
+  - validation rapide : GET /admin/realms/{realm}/users/count?search={prefix} (un appel) ;
+  - si des comptes manquent : seuls les manquants sont créés (liste briefRepresentation + pool) ;
+  - suppression uniquement sur demande (--cleanup-fixtures ou sous-commande cleanup).
+
+Le registre est stocké dans le répertoire des résultats (FIXTURES_FILE, défaut results/fixtures.json,
+monté dans le conteneur) ; il contient le mot de passe commun des comptes de test.
+
+Usage :
+  python keycloak_fixtures.py ensure --realm master --count 1000 --password testpass
+  python keycloak_fixtures.py list
+  python keycloak_fixtures.py cleanup --realm master --prefix loadtest_fixture_
+
+Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD, FIXTURES_FILE.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections.abc import Sequence as SequenceABC
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Tuple
+
+import requests
+
+from keycloak_admin_utils import (
+    DEFAULT_ADMIN,
+    DEFAULT_ADMIN_PASS,
+    DEFAULT_REALM,
+    DEFAULT_URL,
+    admin_token_provider,
+    auth_headers,
+    create_user_with_password,
+)
+from keycloak_run_results import DEFAULT_RESULTS_DIR
+
+DEFAULT_FIXTURES_FILE = os.environ.get("FIXTURES_FILE", os.path.join(DEFAULT_RESULTS_DIR, "fixtures.json"))
+# Doit commencer par un préfixe de TEST_USERNAME_PREFIXES (delete-test-users les supprime aussi)
+DEFAULT_FIXTURE_PREFIX = "loadtest_fixture_"
+PAGE_SIZE = 500
+CREATE_WORKERS = 8
+
+
+class FixtureAccounts(SequenceABC):
+    """Comptes {prefix}{i} d'une fixture, générés à la demande (pas de liste en mémoire)."""
+
+    def __init__(self, prefix: str, count: int, password: str) -> None:
+        self.prefix = prefix
+        self.count = count
+        self.password = password
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return f"{self.prefix}{i}", self.password
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def fixture_key(realm: str, prefix: str, count: int, policy: str) -> str:
+    """Clé du registre : realm, préfixe, nombre, empreinte de la politique de mot de passe."""
+    policy_hash = hashlib.sha256(policy.encode("utf-8")).hexdigest()[:12]
+    return f"{realm}|{prefix}|{count}|{policy_hash}"
+
+
+def load_registry(path: str = DEFAULT_FIXTURES_FILE) -> Dict[str, dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("fixtures", {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"  ⚠ Registre de fixtures illisible ({path}) : {e}", file=sys.stderr)
+        return {}
+
+
+def save_registry(fixtures: Dict[str, dict], path: str = DEFAULT_FIXTURES_FILE) -> None:
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fixtures": fixtures}, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"  ⚠ Registre de fixtures non enregistré ({path}) : {e}", file=sys.stderr)
+
+
+def get_password_policy(base_url: str, realm: str, token: str) -> str:
+    r = requests.get(f"{base_url}/admin/realms/{realm}", headers=auth_headers(token), timeout=10)
+    r.raise_for_status()
+    return r.json().get("passwordPolicy") or ""
+
+
+def count_prefixed_users(base_url: str, realm: str, token: str, prefix: str) -> int:
+    """Validation rapide : nombre d'utilisateurs correspondant à la recherche `prefix`."""
+    r = requests.get(
+        f"{base_url}/admin/realms/{realm}/users/count",
+        params={"search": prefix},
+        headers=auth_headers(token),
+        timeout=15,
+    )
+    r.raise_for_status()
+    return int(r.json())
+
+
+def list_prefixed_users(base_url: str, realm: str, token: Callable[[], str], prefix: str) -> Dict[str, str]:
+    """{username: id} des utilisateurs dont le username commence par `prefix` (recherche serveur paginée)."""
+    out: Dict[str, str] = {}
+    first = 0
+    while True:
+        r = requests.get(
+            f"{base_url}/admin/realms/{realm}/users",
+            params={"search": prefix, "briefRepresentation": "true", "first": first, "max": PAGE_SIZE},
+            headers=auth_headers(token()),
+            timeout=30,
+        )
+        r.raise_for_status()
+        page = r.json()
+        for u in page:
+            username = u.get("username") or ""
+            if username.startswith(prefix) and u.get("id"):
+                out[username] = u["id"]
+        if len(page) < PAGE_SIZE:
+            break
+        first += PAGE_SIZE
+    return out
+
+
+def _reset_password(base_url: str, realm: str, token: str, user_id: str, password: str) -> bool:
+    r = requests.put(
+        f"{base_url}/admin/realms/{realm}/users/{user_id}/reset-password",
+        json={"type": "password", "temporary": False, "value": password},
+        headers=auth_headers(token),
+        timeout=10,
+    )
+    return r.status_code in (200, 204)
+
+
+def ensure_fixture(
+    base_url: str,
+    realm: str,
+    admin_user: str,
+    admin_pass: str,
+    count: int,
+    password: str,
+    prefix: str = DEFAULT_FIXTURE_PREFIX,
+    registry_path: str = DEFAULT_FIXTURES_FILE,
+) -> Tuple[FixtureAccounts, dict]:
+    """
+    Garantit que les comptes {prefix}0..{prefix}{count-1} existent avec `password`.
+    Retourne (comptes, infos : reused, created, reset, elapsed).
+    """
+    start = time.perf_counter()
+    token = admin_token_provider(base_url, admin_user, admin_pass)
+    policy = get_password_policy(base_url, realm, token())
+    key = fixture_key(realm, prefix, count, policy)
+    fixtures = load_registry(registry_path)
+    entry = fixtures.get(key)
+    accounts = FixtureAccounts(prefix, count, password)
+    info = {"key": key, "reused": False, "created": 0, "reset": 0, "failed": 0}
+
+    # Chemin rapide : fixture connue, même mot de passe, comptes présents (un seul appel /users/count)
+    if entry and entry.get("password") == password and count_prefixed_users(base_url, realm, token(), prefix) >= count:
+        info["reused"] = True
+    else:
+        existing = list_prefixed_users(base_url, realm, token, prefix)
+        # Mot de passe des comptes existants connu si une fixture du même préfixe l'a enregistré
+        known = any(
+            e.get("realm") == realm and e.get("prefix") == prefix and e.get("password") == password
+            and e.get("password_policy") == policy
+            for e in fixtures.values()
+        )
+        wanted = [accounts[i][0] for i in range(count)]
+        missing = [u for u in wanted if u not in existing]
+        to_reset = [existing[u] for u in wanted if u in existing] if not known else []
+
+        def create(username: str) -> bool:
+            return create_user_with_password(base_url, realm, token(), username, password)
+
+        def reset(user_id: str) -> bool:
+            return _reset_password(base_url, realm, token(), user_id, password)
+
+        with ThreadPoolExecutor(max_workers=CREATE_WORKERS) as pool:
+            created = list(pool.map(create, missing))
+            resets = list(pool.map(reset, to_reset))
+        info["created"] = sum(created)
+        info["reset"] = sum(resets)
+        info["failed"] = (len(created) - sum(created)) + (len(resets) - sum(resets))
+        if to_reset:
+            # Mots de passe changés : les autres fixtures du même préfixe ne sont plus fiables
+            for other in [k for k, e in fixtures.items() if e.get("realm") == realm and e.get("prefix") == prefix]:
+                fixtures.pop(other)
+
+    fixtures[key] = {
+        "realm": realm,
+        "prefix": prefix,
+        "count": count,
+        "password": password,
+        "password_policy": policy,
+        "created_at": (entry or {}).get("created_at") or _now(),
+        "validated_at": _now(),
+    }
+    if info["failed"]:
+        # Fixture incomplète : ne pas l'enregistrer pour forcer une nouvelle vérification au prochain run
+        fixtures.pop(key)
+    save_registry(fixtures, registry_path)
+    info["elapsed"] = time.perf_counter() - start
+    return accounts, info
+
+
+def cleanup_fixtures(
+    base_url: str,
+    realm: str,
+    admin_user: str,
+    admin_pass: str,
+    prefix: str = DEFAULT_FIXTURE_PREFIX,
+    registry_path: str = DEFAULT_FIXTURES_FILE,
+) -> int:
+    """Supprime les comptes {prefix}* du realm et les entrées correspondantes du registre. Retourne le nombre supprimé."""
+    token = admin_token_provider(base_url, admin_user, admin_pass)
+    existing = list_prefixed_users(base_url, realm, token, prefix)
+
+    def delete(user_id: str) -> bool:
+        r = requests.delete(f"{base_url}/admin/realms/{realm}/users/{user_id}", headers=auth_headers(token()), timeout=10)
+        return r.status_code in (200, 204)
+
+    with ThreadPoolExecutor(max_workers=CREATE_WORKERS) as pool:
+        deleted = sum(pool.map(delete, existing.values()))
+    fixtures = load_registry(registry_path)
+    for key in [k for k, e in fixtures.items() if e.get("realm") == realm and e.get("prefix") == prefix]:
+        fixtures.pop(key)
+    save_registry(fixtures, registry_path)
+    return deleted
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Registre de comptes de test réutilisables (fixtures)")
+    parser.add_argument("--url", default=DEFAULT_URL, help="URL Keycloak")
+    parser.add_argument("--registry", default=DEFAULT_FIXTURES_FILE, help="Fichier registre (défaut: FIXTURES_FILE ou results/fixtures.json)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ensure = sub.add_parser("ensure", help="Créer / compléter une fixture (seuls les comptes manquants sont créés)")
+    p_ensure.add_argument("--realm", default=DEFAULT_REALM, help="Realm (défaut: KEYCLOAK_REALM ou master)")
+    p_ensure.add_argument("--count", type=int, required=True, metavar="N", help="Nombre de comptes")
+    p_ensure.add_argument("--password", default=os.environ.get("LOAD_TEST_USER_PASSWORD", "testpass"), help="Mot de passe commun")
+    p_ensure.add_argument("--prefix", default=DEFAULT_FIXTURE_PREFIX, help=f"Préfixe des usernames (défaut: {DEFAULT_FIXTURE_PREFIX})")
+
+    sub.add_parser("list", help="Afficher les fixtures enregistrées")
+
+    p_clean = sub.add_parser("cleanup", help="Supprimer les comptes d'une fixture et son entrée du registre")
+    p_clean.add_argument("--realm", default=DEFAULT_REALM, help="Realm (défaut: KEYCLOAK_REALM ou master)")
+    p_clean.add_argument("--prefix", default=DEFAULT_FIXTURE_PREFIX, help=f"Préfixe des usernames (défaut: {DEFAULT_FIXTURE_PREFIX})")
+
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+    admin_user = os.environ.get("KEYCLOAK_ADMIN_USER", DEFAULT_ADMIN)
+    admin_pass = os.environ.get("KEYCLOAK_ADMIN_PASSWORD", DEFAULT_ADMIN_PASS)
+
+    if args.command == "list":
+        fixtures = load_registry(args.registry)
+        if not fixtures:
+            print("Aucune fixture enregistrée.")
+        for e in sorted(fixtures.values(), key=lambda e: (e["realm"], e["prefix"], e["count"])):
+            print(f"  {e['realm']:<20} {e['prefix']}0..{e['count'] - 1:<10} politique='{e['password_policy']}'  validée {e['validated_at']}")
+        return 0
+
+    try:
+        if args.command == "ensure":
+            accounts, info = ensure_fixture(base_url, args.realm, admin_user, admin_pass, args.count, args.password, args.prefix, args.registry)
+            state = "réutilisée" if info["reused"] else f"{info['created']} créés, {info['reset']} mots de passe réinitialisés"
+            print(f"Fixture {args.prefix}0..{args.count - 1} (realm={args.realm}) : {state} en {info['elapsed']:.1f} s")
+            return 0 if not info["failed"] else 1
+        if args.command == "cleanup":
+            deleted = cleanup_fixtures(base_url, args.realm, admin_user, admin_pass, args.prefix, args.registry)
+            print(f"Fixture {args.prefix}* (realm={args.realm}) : {deleted} utilisateur(s) supprimé(s).")
+            return 0
+    except requests.exceptions.RequestException as e:
+        print(f"Erreur Keycloak : {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Matrice de coût des politiques de hachage de mot de passe (passwordPolicy) sur la latence de login.
+
+La latence d'un login password grant est dominée par le hachage du mot de passe (itérations
+pbkdf2-sha256 / sha512, paramètres argon2). Pour chaque politique (--policy, répétable) :
+  1. création d'un realm « frère » {--realm-prefix}-{i} avec cette passwordPolicy ;
+  2. création de --users comptes (create_test_users de keycloak_load_test_multi_user.py) ;
+  3. même charge multi-comptes (--concurrent threads pendant --duration s, login() et worker_multi) ;
+  4. suppression du realm (sauf --keep-realms).
+
+Sortie : une matrice politique → coût de hachage (itérations, temps pbkdf2 mesuré localement à
+titre indicatif) → débit, p50, p99, erreurs. Un artefact de résultats est enregistré par politique.
+
+Usage :
+  python keycloak_hash_benchmark.py
+  python keycloak_hash_benchmark.py --policy "hashAlgorithm(pbkdf2-sha256) and hashIterations(27500)" \\
+      --policy "hashAlgorithm(argon2)" --users 200 --concurrent 20 --duration 60
+
+Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import requests
+
+from keycloak_accounts import AccountScheduler
+from keycloak_load_profile import Result, percentile
+from keycloak_load_test_multi_user import (
+    auth_headers,
+    create_test_users,
+    get_admin_token,
+    login,
+    make_account_request,
+    worker_multi,
+)
+from keycloak_run_results import DEFAULT_RESULTS_DIR, build_run_record, fetch_keycloak_version, save_run
+
+try:
+    from dotenv import load_dotenv
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv(os.path.join(_root, ".env"))
+    load_dotenv()
+except ImportError:
+    pass
+
+_DEFAULT_PORT = os.environ.get("KEYCLOAK_PORT", "8080")
+_DEFAULT_URL = os.environ.get("KEYCLOAK_URL", f"http://localhost:{_DEFAULT_PORT}").rstrip("/")
+_DEFAULT_ADMIN = os.environ.get("KEYCLOAK_ADMIN_USER", "admin")
+_DEFAULT_ADMIN_PASS = os.environ.get("KEYCLOAK_ADMIN_PASSWORD", "admin")
+
+DEFAULT_POLICIES = (
+    "hashAlgorithm(pbkdf2-sha256) and hashIterations(27500)",
+    "hashAlgorithm(pbkdf2-sha512) and hashIterations(210000)",
+    "hashAlgorithm(argon2)",
+)
+_PBKDF2_DIGESTS = {"pbkdf2": "sha1", "pbkdf2-sha256": "sha256", "pbkdf2-sha512": "sha512"}
+
+
+def policy_hash_params(policy: str) -> dict:
+    """Algorithme et itérations déclarés dans une passwordPolicy (None si absents)."""
+    alg = re.search(r"hashAlgorithm\(([^)]*)\)", policy)
+    iterations = re.search(r"hashIterations\((\d+)\)", policy)
+    return {
+        "algorithm": alg.group(1) if alg else None,
+        "iterations": int(iterations.group(1)) if iterations else None,
+    }
+
+
+def local_hash_cost_ms(params: dict) -> Optional[float]:
+    """Temps d'un hachage pbkdf2 équivalent mesuré localement (ordre de grandeur ; None pour argon2)."""
+    digest = _PBKDF2_DIGESTS.get(params["algorithm"] or "")
+    if digest is None or not params["iterations"]:
+        return None
+    start = time.perf_counter()
+    hashlib.pbkdf2_hmac(digest, b"benchmark-password", os.urandom(16), params["iterations"])
+    return (time.perf_counter() - start) * 1000
+
+
+def create_realm(base_url: str, token: str, realm: str, policy: str) -> bool:
+    """
+    Crée le realm de benchmark ; False s'il existe déjà (409). Un realm existant n'est jamais
+    modifié ni supprimé : il peut s'agir d'un vrai tenant dont le nom collisionne avec --realm-prefix.
+    """
+    r = requests.post(
+        f"{base_url}/admin/realms",
+        json={"realm": realm, "enabled": True, "passwordPolicy": policy},
+        headers=auth_headers(token),
+        timeout=60,
+    )
+    if r.status_code == 409:
+        return False
+    r.raise_for_status()
+    return True
+
+
+def delete_realm(base_url: str, token: str, realm: str) -> None:
+    requests.delete(f"{base_url}/admin/realms/{realm}", headers=auth_headers(token), timeout=60)
+
+
+def run_policy_load(
+    base_url: str,
+    realm: str,
+    accounts: list,
+    concurrent: int,
+    duration: float,
+    timeout: float,
+    warmup: int,
+) -> tuple:
+    """Charge constante multi-comptes sur un realm ; retourne (résultats, début, fin)."""
+    for i in range(warmup):
+        u, p = accounts[i % len(accounts)]
+        login(base_url, realm, u, p, timeout)
+    scheduler = AccountScheduler(accounts)
+    results: List[Result] = []
+    results_lock = threading.Lock()
+    stop = threading.Event()
+    start = time.monotonic()
+    deadline = start + duration
+
+    def do_login(realm: str, username: str, password: str):
+        return login(base_url, realm, username, password, timeout)
+
+    threads = [
+        threading.Thread(
+            target=worker_multi,
+            args=(make_account_request(do_login, scheduler, realm), deadline, results, results_lock, stop),
+            daemon=True,
+        )
+        for _ in range(concurrent)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=timeout + 2)
+    return results, start, time.monotonic()
+
+
+def summarize(policy: str, realm: str, results: List[Result], start: float, end: float) -> dict:
+    params = policy_hash_params(policy)
+    ok_lat = sorted(r[1] for r in results if r[0])
+    total = len(results)
+    return {
+        "policy": policy,
+        "realm": realm,
+        "algorithm": params["algorithm"] or "(défaut)",
+        "iterations": params["iterations"],
+        "local_hash_ms": local_hash_cost_ms(params),
+        "requests": total,
+        "throughput": total / max(end - start, 1e-9),
+        "p50": percentile(ok_lat, 50) if ok_lat else None,
+        "p99": percentile(ok_lat, 99) if ok_lat else None,
+        "avg": statistics.mean(ok_lat) if ok_lat else None,
+        "error_rate": (total - len(ok_lat)) / total if total else 1.0,
+    }
+
+
+def print_matrix(rows: List[dict]) -> None:
+    print("  📊 Matrice coût de hachage → débit / latence")
+    print("-" * 100)
+    print(f"  {'algorithme':<15} {'itérations':>10} {'hash local':>11} {'req/s':>9} {'p50 (s)':>9} {'p99 (s)':>9} {'erreurs':>8}  politique")
+    for r in rows:
+        iterations = str(r["iterations"]) if r["iterations"] else "défaut"
+        local = f"{r['local_hash_ms']:.1f} ms" if r["local_hash_ms"] is not None else "n/a"
+        p50 = f"{r['p50']:.3f}" if r["p50"] is not None else "n/a"
+        p99 = f"{r['p99']:.3f}" if r["p99"] is not None else "n/a"
+        print(f"  {r['algorithm']:<15} {iterations:>10} {local:>11} {r['throughput']:>9.1f} {p50:>9} {p99:>9} "
+              f"{r['error_rate'] * 100:>7.2f}%  {r['policy']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Matrice de coût des politiques de hachage de mot de passe (realms frères).")
+    parser.add_argument("--url", type=str, default=_DEFAULT_URL, help="URL Keycloak")
+    parser.add_argument("--admin-user", type=str, default=_DEFAULT_ADMIN, help="Admin (création des realms / users)")
+    parser.add_argument("--admin-password", type=str, default=_DEFAULT_ADMIN_PASS, help="Mot de passe admin")
+    parser.add_argument("--policy", action="append", metavar="POLICY", help="passwordPolicy Keycloak à tester (répétable ; défaut : pbkdf2-sha256 27500, pbkdf2-sha512 210000, argon2)")
+    parser.add_argument("--realm-prefix", type=str, default="hashbench", help="Préfixe des realms créés (défaut: hashbench → hashbench-1, ...)")
+    parser.add_argument("--users", type=int, default=100, metavar="N", help="Comptes créés par realm (défaut: 100)")
+    parser.add_argument("--user-password", type=str, default="Testpass-123", help="Mot de passe des comptes (doit respecter les politiques)")
+    parser.add_argument("--concurrent", type=int, default=10, metavar="N", help="Threads de login (défaut: 10)")
+    parser.add_argument("--duration", type=float, default=30.0, metavar="SEC", help="Durée de la charge par politique (défaut: 30)")
+    parser.add_argument("--warmup", type=int, default=20, help="Logins de warmup par realm (exclus des stats)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout par requête")
+    parser.add_argument("--keep-realms", action="store_true", help="Ne pas supprimer les realms créés")
+    parser.add_argument("--results-dir", type=str, default=DEFAULT_RESULTS_DIR, metavar="DIR", help="Répertoire des artefacts de résultats (défaut: RESULTS_DIR ou results/)")
+    parser.add_argument("--no-save", action="store_true", help="Ne pas écrire les artefacts de résultats")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    policies = args.policy or list(DEFAULT_POLICIES)
+    keycloak_version = fetch_keycloak_version(base_url, args.admin_user, args.admin_password)
+
+    print("=" * 60)
+    print("  🔐 Benchmark des politiques de hachage")
+    print(f"     URL        : {base_url}")
+    print(f"     Politiques : {len(policies)} (realms {args.realm_prefix}-1..{len(policies)})")
+    print(f"     Charge     : {args.users} comptes, {args.concurrent} threads, {args.duration:.0f}s par politique")
+    print("=" * 60)
+
+    rows = []
+    for i, policy in enumerate(policies, start=1):
+        realm = f"{args.realm_prefix}-{i}"
+        print(f"\n▶ [{i}/{len(policies)}] {policy} (realm {realm})")
+        try:
+            created = create_realm(base_url, get_admin_token(base_url, args.admin_user, args.admin_password), realm, policy)
+        except requests.exceptions.RequestException as e:
+            print(f"  ⚠ Création du realm impossible : {e}")
+            continue
+        if not created:
+            print(f"  ⚠ Le realm {realm} existe déjà : politique ignorée (supprimer le realm ou changer --realm-prefix)")
+            continue
+        try:
+            t0 = time.perf_counter()
+            accounts, _ = create_test_users(
+                base_url, realm, args.admin_user, args.admin_password,
+                args.users, args.user_password, str(int(time.time())),
+            )
+            print(f"  {len(accounts)} comptes créés en {time.perf_counter() - t0:.1f} s")
+            if not accounts:
+                print("  ⚠ Aucun compte créé (mot de passe conforme à la politique ?)")
+                continue
+            results, start, end = run_policy_load(
+                base_url, realm, accounts, args.concurrent, args.duration, args.timeout, args.warmup,
+            )
+            row = summarize(policy, realm, results, start, end)
+            rows.append(row)
+            p99 = f"{row['p99']:.3f}" if row["p99"] is not None else "n/a"
+            print(f"  {row['throughput']:.1f} req/s, p99={p99} s, erreurs={row['error_rate'] * 100:.2f} %")
+            if not args.no_save:
+                record = build_run_record(
+                    "keycloak_hash_benchmark", dict(vars(args), policy=policy, realm=realm), results, start, end,
+                    keycloak_version=keycloak_version,
+                    extra={"password_policy": policy, "hash_cost": {k: row[k] for k in ("algorithm", "iterations", "local_hash_ms")}},
+                )
+                path = save_run(record, args.results_dir)
+                if path:
+                    print(f"  💾 Résultats : {path}")
+        finally:
+            if not args.keep_realms:
+                try:
+                    delete_realm(base_url, get_admin_token(base_url, args.admin_user, args.admin_password), realm)
+                except requests.exceptions.RequestException as e:
+                    print(f"  ⚠ Suppression du realm {realm} impossible : {e}")
+
+    print()
+    print("=" * 60)
+    if not rows:
+        print("  Aucun résultat.")
+        return 1
+    print_matrix(rows)
+    print("=" * 60)
+    print("  Hash local : pbkdf2 équivalent mesuré sur cette machine (ordre de grandeur, un cœur).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
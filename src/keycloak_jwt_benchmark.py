@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Benchmark de vérification JWT hors ligne (coût CPU côté resource server).
+
+Les resource servers valident localement les access tokens émis par Keycloak : le coût dépend
+fortement de l'algorithme de signature du realm (RS256, ES256, EdDSA, ...). Le script :
+  1. collecte un corpus de vrais access tokens (logins password grant concurrents, ou fichier) ;
+  2. récupère le JWKS du realm une seule fois (cache fichier optionnel) ;
+  3. mesure le débit de vérification de signature par algorithme, sur plusieurs processus.
+
+Les tokens sont émis pour un client dédié (jwt-bench, public, direct access grants), créé s'il
+n'existe pas. Optionnellement (--algorithms), le script bascule l'attribut
+« access.token.signed.response.alg » de ce client pour chaque algorithme, collecte les tokens, puis
+restaure la valeur d'origine : un arrêt brutal entre les deux ne laisse modifié que le client de
+benchmark. Les clients intégrés (admin-cli, ...) ne sont modifiés qu'avec --allow-builtin-client.
+Le realm doit posséder une clé active pour chaque algorithme demandé (Realm settings → Keys → Providers).
+
+Usage :
+  python keycloak_jwt_benchmark.py --tokens 500 --processes 4 --duration 10
+  python keycloak_jwt_benchmark.py --algorithms RS256,ES256,EdDSA --processes 4
+  python keycloak_jwt_benchmark.py --corpus-file tokens.txt --jwks-cache jwks.json
+
+Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD.
+Dépendance : PyJWT[crypto] (voir requirements.txt).
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+try:
+    from dotenv import load_dotenv
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv(os.path.join(_root, ".env"))
+    load_dotenv()
+except ImportError:
+    pass
+
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+from keycloak_accounts import AccountStore
+from keycloak_admin_utils import (
+    DEFAULT_ADMIN,
+    DEFAULT_ADMIN_PASS,
+    DEFAULT_REALM,
+    DEFAULT_URL,
+    auth_headers,
+    get_admin_token,
+)
+from keycloak_run_results import DEFAULT_RESULTS_DIR, build_run_record, fetch_keycloak_version, save_run
+
+TOKEN_ALG_ATTRIBUTE = "access.token.signed.response.alg"
+BENCH_CLIENT_ID = "jwt-bench"
+# Clients créés par Keycloak dans chaque realm : jamais modifiés sans --allow-builtin-client
+BUILTIN_CLIENTS = ("admin-cli", "account", "account-console", "broker", "realm-management", "security-admin-console")
+
+
+def fetch_access_token(
+    base_url: str,
+    realm: str,
+    client_id: str,
+    username: str,
+    password: str,
+    timeout: float = 10.0,
+) -> Optional[str]:
+    """Login password grant ; retourne l'access_token ou None."""
+    try:
+        r = requests.post(
+            f"{base_url}/realms/{realm}/protocol/openid-connect/token",
+            data={
+                "client_id": client_id,
+                "username": username,
+                "password": password,
+                "grant_type": "password",
+            },
+            timeout=timeout,
+        )
+        if r.status_code != 200:
+            return None
+        return r.json().get("access_token")
+    except requests.exceptions.RequestException:
+        return None
+
+
+def collect_token_corpus(
+    base_url: str,
+    realm: str,
+    client_id: str,
+    accounts: Sequence[Tuple[str, str]],
+    nb_tokens: int,
+    workers: int,
+    timeout: float,
+) -> List[str]:
+    """Collecte nb_tokens access tokens via des logins concurrents (comptes utilisés à tour de rôle)."""
+    tokens = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(fetch_access_token, base_url, realm, client_id, *accounts[i % len(accounts)], timeout)
+            for i in range(nb_tokens)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            tok = future.result()
+            if tok:
+                tokens.append(tok)
+    return tokens
+
+
+def fetch_jwks(base_url: str, realm: str, cache_path: Optional[str] = None) -> dict:
+    """JWKS du realm, récupéré une seule fois. Si cache_path existe, il est lu sans appel réseau."""
+    if cache_path and os.path.isfile(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    r = requests.get(f"{base_url}/realms/{realm}/protocol/openid-connect/certs", timeout=10)
+    r.raise_for_status()
+    jwks = r.json()
+    if cache_path:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(jwks, f)
+    return jwks
+
+
+def token_header(token: str) -> dict:
+    """En-tête JOSE décodé (sans vérification)."""
+    head = token.split(".", 1)[0]
+    head += "=" * (-len(head) % 4)
+    return json.loads(base64.urlsafe_b64decode(head))
+
+
+def group_tokens_by_alg(tokens: List[str]) -> Dict[str, List[str]]:
+    groups: Dict[str, List[str]] = {}
+    for tok in tokens:
+        try:
+            alg = token_header(tok).get("alg") or "unknown"
+        except (ValueError, IndexError):
+            continue
+        groups.setdefault(alg, []).append(tok)
+    return groups
+
+
+def get_client(base_url: str, realm: str, token: str, client_id: str) -> Optional[dict]:
+    r = requests.get(
+        f"{base_url}/admin/realms/{realm}/clients",
+        params={"clientId": client_id},
+        headers=auth_headers(token),
+        timeout=15,
+    )
+    r.raise_for_status()
+    for c in r.json():
+        if c.get("clientId") == client_id:
+            return c
+    return None
+
+
+def ensure_bench_client(base_url: str, realm: str, token: str, client_id: str) -> Optional[dict]:
+    """Client de collecte ; le client de benchmark dédié est créé s'il n'existe pas (public, direct access grants)."""
+    client = get_client(base_url, realm, token, client_id)
+    if client is not None or client_id != BENCH_CLIENT_ID:
+        return client
+    r = requests.post(
+        f"{base_url}/admin/realms/{realm}/clients",
+        json={
+            "clientId": client_id,
+            "enabled": True,
+            "publicClient": True,
+            "directAccessGrantsEnabled": True,
+            "standardFlowEnabled": False,
+        },
+        headers=auth_headers(token),
+        timeout=15,
+    )
+    if r.status_code not in (201, 409):
+        r.raise_for_status()
+    return get_client(base_url, realm, token, client_id)
+
+
+def set_client_token_alg(base_url: str, realm: str, token: str, client: dict, alg: Optional[str]) -> bool:
+    """Positionne (ou retire si alg=None) l'algorithme de signature des access tokens du client."""
+    attributes = dict(client.get("attributes") or {})
+    if alg:
+        attributes[TOKEN_ALG_ATTRIBUTE] = alg
+    else:
+        attributes.pop(TOKEN_ALG_ATTRIBUTE, None)
+    body = dict(client)
+    body["attributes"] = attributes
+    r = requests.put(
+        f"{base_url}/admin/realms/{realm}/clients/{client['id']}",
+        json=body,
+        headers=auth_headers(token),
+        timeout=15,
+    )
+    return r.status_code in (200, 204)
+
+
+# ── Vérification (processus workers) ─────────────────────────────────────────
+_WORKER_KEYS: Dict[str, object] = {}
+
+
+def _init_worker(jwks: dict) -> None:
+    """Construit une fois par processus les clés publiques à partir du JWKS (cache local au worker)."""
+    _WORKER_KEYS.clear()
+    for jwk in jwks.get("keys", []):
+        if jwk.get("use", "sig") != "sig" or not jwk.get("kid"):
+            continue
+        try:
+            _WORKER_KEYS[jwk["kid"]] = jwt.PyJWK(jwk).key
+        except (jwt.exceptions.PyJWKError, jwt.exceptions.InvalidKeyError):
+            continue
+
+
+def _verify_for(args: Tuple[List[str], str, float]) -> Tuple[int, int, float]:
+    """Vérifie les tokens en boucle pendant `duration` secondes. Retourne (vérifications, échecs, durée)."""
+    tokens, alg, duration = args
+    options = {"verify_aud": False, "verify_exp": False, "verify_iat": False, "verify_nbf": False}
+    prepared = []
+    for tok in tokens:
+        key = _WORKER_KEYS.get(token_header(tok).get("kid"))
+        prepared.append((tok, key))
+    done = 0
+    failures = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        for tok, key in prepared:
+            if key is None:
+                failures += 1
+            else:
+                try:
+                    jwt.decode(tok, key, algorithms=[alg], options=options)
+                except jwt.exceptions.PyJWTError:
+                    failures += 1
+            done += 1
+    return done, failures, time.perf_counter() - start
+
+
+def benchmark_verification(
+    tokens: List[str],
+    alg: str,
+    jwks: dict,
+    processes: int,
+    duration: float,
+) -> Tuple[int, int, float]:
+    """Lance `processes` workers vérifiant le corpus en parallèle. Retourne (vérifications, échecs, vérif/s cumulées)."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=processes, initializer=_init_worker, initargs=(jwks,)) as pool:
+        # La construction des clés (initializer) est faite avant le chronométrage de chaque worker
+        outcomes = pool.map(_verify_for, [(tokens, alg, duration)] * processes)
+    done = sum(o[0] for o in outcomes)
+    failures = sum(o[1] for o in outcomes)
+    rate = sum(o[0] / o[2] for o in outcomes if o[2] > 0)
+    return done, failures, rate
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark de vérification JWT hors ligne par algorithme (JWKS en cache, multi-processus)."
+    )
+    parser.add_argument("--url", type=str, default=DEFAULT_URL, help="URL Keycloak")
+    parser.add_argument("--realm", type=str, default=DEFAULT_REALM, help="Realm")
+    parser.add_argument("--client-id", type=str, default=BENCH_CLIENT_ID, help=f"Client utilisé pour les logins (défaut: {BENCH_CLIENT_ID}, créé si absent)")
+    parser.add_argument("--allow-builtin-client", action="store_true", help="Autoriser --algorithms sur un client intégré (admin-cli, ...)")
+    parser.add_argument("--user", type=str, default=DEFAULT_ADMIN, help="Username pour la collecte des tokens")
+    parser.add_argument("--password", type=str, default=DEFAULT_ADMIN_PASS, help="Mot de passe pour la collecte")
+    parser.add_argument("--accounts-file", type=str, metavar="PATH", help="Comptes 'username:password' pour la collecte (au lieu de --user ; .gz et JSONL acceptés)")
+    parser.add_argument("--admin-user", type=str, default=DEFAULT_ADMIN, help="Admin (client de benchmark, --algorithms)")
+    parser.add_argument("--admin-password", type=str, default=DEFAULT_ADMIN_PASS, help="Mot de passe admin")
+    parser.add_argument("--tokens", type=int, default=200, metavar="N", help="Taille du corpus par algorithme (défaut: 200)")
+    parser.add_argument("--concurrent", type=int, default=10, metavar="N", help="Threads de collecte (défaut: 10)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout par requête de collecte")
+    parser.add_argument(
+        "--algorithms",
+        type=str,
+        metavar="LIST",
+        help="Algorithmes à comparer (ex. RS256,ES256,EdDSA) : bascule l'algo de signature du client puis restaure",
+    )
+    parser.add_argument("--corpus-file", type=str, metavar="PATH", help="Corpus de tokens (un par ligne) : lu s'il existe, sinon écrit après collecte")
+    parser.add_argument("--jwks-cache", type=str, metavar="PATH", help="Fichier cache du JWKS (lu s'il existe, sinon écrit)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, metavar="N", help="Processus de vérification (défaut: nb CPU)")
+    parser.add_argument("--duration", type=float, default=10.0, metavar="SEC", help="Durée de mesure par algorithme (défaut: 10)")
+    parser.add_argument("--results-dir", type=str, default=DEFAULT_RESULTS_DIR, metavar="DIR", help="Répertoire des artefacts de résultats (défaut: RESULTS_DIR ou results/)")
+    parser.add_argument("--no-save", action="store_true", help="Ne pas écrire l'artefact de résultats")
+    args = parser.parse_args()
+
+    if jwt is None:
+        print("Erreur: PyJWT[crypto] requis (pip install 'PyJWT[crypto]')", file=sys.stderr)
+        return 1
+
+    base_url = args.url.rstrip("/")
+    if args.algorithms and args.client_id in BUILTIN_CLIENTS and not args.allow_builtin_client:
+        print(f"Erreur: --algorithms modifierait le client intégré '{args.client_id}' (utiliser le client "
+              f"{BENCH_CLIENT_ID}, ou --allow-builtin-client)")
+        return 1
+    if args.accounts_file:
+        try:
+            accounts: Sequence[Tuple[str, str]] = AccountStore(args.accounts_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Erreur: lecture de {args.accounts_file} : {e}")
+            return 1
+        if not accounts:
+            print("Erreur: aucun compte dans le fichier (format: username:password par ligne)")
+            return 1
+    else:
+        accounts = [(args.user, args.password)]
+
+    print("=" * 60)
+    print("  🔐 Benchmark vérification JWT (hors ligne)")
+    print(f"     URL        : {base_url}")
+    print(f"     Realm      : {args.realm}")
+    print(f"     Client     : {args.client_id}")
+    print(f"     Processus  : {args.processes}, durée {args.duration}s par algorithme")
+    print("=" * 60)
+
+    tokens: List[str] = []
+    if args.corpus_file and os.path.isfile(args.corpus_file):
+        with open(args.corpus_file, "r", encoding="utf-8") as f:
+            tokens = [line.strip() for line in f if line.strip()]
+        print(f"\n📂 Corpus chargé depuis {args.corpus_file} : {len(tokens)} tokens")
+    else:
+        try:
+            admin_token = get_admin_token(base_url, args.admin_user, args.admin_password)
+            client = ensure_bench_client(base_url, args.realm, admin_token, args.client_id)
+        except requests.exceptions.RequestException as e:
+            print(f"Erreur: client '{args.client_id}' inaccessible dans le realm '{args.realm}' : {e}")
+            return 1
+        if not client:
+            print(f"Erreur: client '{args.client_id}' introuvable dans le realm '{args.realm}'")
+            return 1
+        algorithms = [a.strip() for a in args.algorithms.split(",") if a.strip()] if args.algorithms else [None]
+        original_alg = (client.get("attributes") or {}).get(TOKEN_ALG_ATTRIBUTE)
+        try:
+            for alg in algorithms:
+                if alg and not set_client_token_alg(base_url, args.realm, admin_token, client, alg):
+                    print(f"  ⚠ Impossible de basculer le client en {alg}, ignoré.")
+                    continue
+                start = time.perf_counter()
+                batch = collect_token_corpus(
+                    base_url, args.realm, args.client_id, accounts, args.tokens, args.concurrent, args.timeout
+                )
+                print(f"\n📥 {alg + ' : ' if alg else ''}{len(batch)} tokens collectés en {time.perf_counter() - start:.1f}s")
+                tokens.extend(batch)
+        finally:
+            if args.algorithms:
+                set_client_token_alg(base_url, args.realm, admin_token, client, original_alg)
+                print("\n  ↩ Algorithme d'origine du client restauré.")
+
+    if not tokens:
+        print("Erreur: corpus vide (vérifier « Direct access grants » et les identifiants).")
+        return 1
+    if args.corpus_file and not os.path.isfile(args.corpus_file):
+        with open(args.corpus_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(tokens) + "\n")
+
+    jwks = fetch_jwks(base_url, args.realm, args.jwks_cache)
+    print(f"🔑 JWKS : {len(jwks.get('keys', []))} clé(s) {'(cache ' + args.jwks_cache + ')' if args.jwks_cache else ''}\n")
+
+    print("  📊 Résultats (vérifications de signature)")
+    print("-" * 60)
+    print(f"     {'Algo':<8} {'Tokens':>7} {'Vérif/s':>12} {'Vérif/s/proc':>13} {'µs/vérif':>10} {'Échecs':>7}")
+    verification: Dict[str, dict] = {}
+    start = time.monotonic()
+    for alg, group in sorted(group_tokens_by_alg(tokens).items()):
+        done, failures, rate = benchmark_verification(group, alg, jwks, args.processes, args.duration)
+        per_proc = rate / max(args.processes, 1)
+        us = 1e6 / per_proc if per_proc > 0 else 0.0
+        print(f"     {alg:<8} {len(group):>7} {rate:>12.0f} {per_proc:>13.0f} {us:>10.1f} {failures:>7}")
+        verification[alg] = {
+            "tokens": len(group),
+            "verifications": done,
+            "failures": failures,
+            "rate": round(rate, 1),
+            "rate_per_process": round(per_proc, 1),
+            "us_per_verification": round(us, 2),
+        }
+    end = time.monotonic()
+    print("=" * 60)
+
+    if not args.no_save:
+        # Aucune requête HTTP mesurée : les débits de vérification par algorithme sont dans extra
+        record = build_run_record(
+            "keycloak_jwt_benchmark", vars(args), [], start, end,
+            keycloak_version=fetch_keycloak_version(base_url, args.admin_user, args.admin_password),
+            extra={"processes": args.processes, "jwks_keys": len(jwks.get("keys", [])), "verification": verification},
+        )
+        path = save_run(record, args.results_dir)
+        if path:
+            print(f"  💾 Résultats : {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
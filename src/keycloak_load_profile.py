@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Profils de charge déclaratifs (paliers) pour keycloak_load_test.py et keycloak_load_test_multi_user.py.
+
+Un profil est une liste de paliers (stages) exécutés à la suite par le même moteur :
+  - users    : nombre d'utilisateurs virtuels (threads) visé en fin de palier ;
+  - rate     : débit cible global en req/s (optionnel, sinon débit max) ;
+  - duration : durée du palier en secondes ;
+  - curve    : « linear » (interpolation depuis la cible du palier précédent) ou « step » (saut immédiat).
+
+Fichier JSON (ou YAML si PyYAML est installé) :
+  {"stages": [
+      {"name": "montée",  "duration": 60,   "users": 50,  "curve": "linear"},
+      {"name": "pic",     "duration": 10,   "users": 200, "curve": "step"},
+      {"name": "plateau", "duration": 3600, "users": 50,  "rate": 100}
+  ]}
+
+Les bornes de chaque palier sont enregistrées et reprises dans le rapport (stats par palier).
+"""
+
+import json
+import math
+import statistics
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+CURVES = ("linear", "step")
+
+# Résultat d'une requête : (succès, latence_sec, message_erreur, instant_fin monotonic)
+Result = Tuple[bool, float, Optional[str], float]
+
+
+class Stage(NamedTuple):
+    name: str
+    duration: float
+    users: int
+    rate: Optional[float]
+    curve: str
+
+
+class StageMark(NamedTuple):
+    """Bornes (temps monotonic) d'un palier exécuté."""
+    name: str
+    start: float
+    end: float
+
+
+def parse_stages(data) -> List[Stage]:
+    """Valide une liste de paliers (dict {"stages": [...]} ou liste directe)."""
+    raw = data.get("stages") if isinstance(data, dict) else data
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("profil invalide : liste 'stages' vide ou absente")
+    stages = []
+    prev_users = None
+    for i, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise ValueError(f"palier {i} : objet attendu")
+        duration = float(entry.get("duration", 0))
+        if duration < 0:
+            raise ValueError(f"palier {i} : durée négative")
+        users = entry.get("users", prev_users)
+        if users is None:
+            raise ValueError(f"palier {i} : 'users' requis (pas de palier précédent)")
+        users = int(users)
+        rate = entry.get("rate")
+        rate = float(rate) if rate is not None else None
+        if rate is not None and rate <= 0:
+            raise ValueError(f"palier {i} : 'rate' doit être > 0")
+        curve = entry.get("curve", "linear")
+        if curve not in CURVES:
+            raise ValueError(f"palier {i} : curve '{curve}' inconnue ({', '.join(CURVES)})")
+        stages.append(Stage(str(entry.get("name") or f"stage_{i + 1}"), duration, max(users, 0), rate, curve))
+        prev_users = users
+    return stages
+
+
+def load_profile(path: str) -> List[Stage]:
+    """Charge un profil JSON ou YAML (extension .yml / .yaml)."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yml", ".yaml")):
+            if yaml is None:
+                raise ValueError("PyYAML requis pour les profils YAML (pip install pyyaml), ou utiliser du JSON")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    return parse_stages(data)
+
+
+def ramp_stages(users: int, ramp_up: float, hold: float, ramp_down: float) -> List[Stage]:
+    """Équivalent du mode ramp (montée → pic → descente) exprimé en paliers."""
+    return [
+        Stage("ramp-up", ramp_up, users, None, "linear"),
+        Stage("hold", hold, users, None, "step"),
+        Stage("ramp-down", ramp_down, 0, None, "linear"),
+    ]
+
+
+def target_users(stage: Stage, prev_users: int, elapsed: float) -> int:
+    """Nombre d'utilisateurs visé à `elapsed` secondes du début du palier."""
+    if stage.curve == "step" or stage.duration <= 0:
+        return stage.users
+    frac = min(max(elapsed / stage.duration, 0.0), 1.0)
+    return int(round(prev_users + (stage.users - prev_users) * frac))
+
+
+class RatePacer:
+    """Limiteur de débit global partagé par les workers (créneaux espacés de 1/rate)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rate: Optional[float] = None
+        self._next = 0.0
+
+    def set_rate(self, rate: Optional[float]) -> None:
+        with self._lock:
+            if rate != self._rate:
+                self._rate = rate
+                self._next = time.monotonic()
+
+    def wait(self, stop: threading.Event) -> bool:
+        """Attend le prochain créneau ; retourne False si stop est posé pendant l'attente."""
+        with self._lock:
+            if not self._rate:
+                return not stop.is_set()
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + 1.0 / self._rate
+        delay = slot - time.monotonic()
+        if delay > 0:
+            return not stop.wait(delay)
+        return not stop.is_set()
+
+
+def _profile_worker(
+    do_request: Callable[[], Tuple[bool, float, Optional[str]]],
+    pacer: RatePacer,
+    results: List[Result],
+    results_lock: threading.Lock,
+    my_stop: threading.Event,
+) -> None:
+    while not my_stop.is_set():
+        if not pacer.wait(my_stop):
+            break
+        ok, lat, err = do_request()
+        with results_lock:
+            results.append((ok, lat, err, time.monotonic()))
+
+
+def run_profile(
+    stages: List[Stage],
+    request_factory: Callable[[int], Callable[[], Tuple[bool, float, Optional[str]]]],
+    results: List[Result],
+    results_lock: threading.Lock,
+    timeout: float,
+    tick: float = 0.2,
+    on_stage: Optional[Callable[[Stage], None]] = None,
+) -> List[StageMark]:
+    """
+    Exécute les paliers : ajuste toutes les `tick` secondes le nombre de threads actifs et le débit cible.
+    request_factory(i) retourne la fonction de requête du i-ème utilisateur virtuel (état propre au thread).
+    Retourne les bornes de chaque palier.
+    """
+    pacer = RatePacer()
+    active: List[Tuple[threading.Thread, threading.Event]] = []
+    retired: List[threading.Thread] = []
+    marks: List[StageMark] = []
+    spawned = 0
+    prev_users = 0
+
+    def adjust(target: int) -> None:
+        nonlocal spawned
+        while len(active) < target:
+            stop = threading.Event()
+            t = threading.Thread(
+                target=_profile_worker,
+                args=(request_factory(spawned), pacer, results, results_lock, stop),
+                daemon=True,
+            )
+            spawned += 1
+            t.start()
+            active.append((t, stop))
+        while len(active) > target:
+            t, stop = active.pop()
+            stop.set()
+            retired.append(t)
+
+    for stage in stages:
+        if on_stage:
+            on_stage(stage)
+        pacer.set_rate(stage.rate)
+        start = time.monotonic()
+        end = start + stage.duration
+        while True:
+            now = time.monotonic()
+            adjust(target_users(stage, prev_users, now - start))
+            if now >= end:
+                break
+            time.sleep(min(tick, end - now))
+        marks.append(StageMark(stage.name, start, time.monotonic()))
+        prev_users = stage.users
+
+    adjust(0)
+    for t in retired:
+        t.join(timeout=timeout + 2)
+    return marks
+
+
+def announce_stage(stage: Stage) -> None:
+    """Callback on_stage par défaut : affiche le palier qui démarre."""
+    rate = f", {stage.rate:.0f} req/s" if stage.rate else ""
+    print(f"   ▶ Palier « {stage.name} » : {stage.users} users ({stage.curve}), {stage.duration:.0f}s{rate}")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Percentile interpolé (p en %) d'une liste triée ; 0.0 si vide. Implémentation commune aux outils."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    f = int(k)
+    c = f + 1 if f + 1 < len(sorted_values) else f
+    return sorted_values[f] + (k - f) * (sorted_values[c] - sorted_values[f])
+
+
+def print_stage_report(results: List[Result], marks: List[StageMark]) -> None:
+    """Stats par palier (requêtes terminées entre les bornes du palier)."""
+    if not marks:
+        return
+    print("     Paliers :")
+    for i, mark in enumerate(marks):
+        # Le dernier palier inclut les requêtes qui terminent pendant l'arrêt des threads
+        last = i == len(marks) - 1
+        in_stage = [r for r in results if mark.start <= r[3] and (r[3] < mark.end or last)]
+        duration = max(mark.end - mark.start, 1e-9)
+        ok_lat = sorted(r[1] for r in in_stage if r[0])
+        errors = sum(1 for r in in_stage if not r[0])
+        line = f"       [{i + 1}] {mark.name:<12} {duration:7.1f}s  {len(in_stage):>7} req  {len(in_stage) / duration:8.1f} req/s  err={errors}"
+        if ok_lat:
+            line += f"  avg={statistics.mean(ok_lat):.3f}  p95={percentile(ok_lat, 95):.3f}  p99={percentile(ok_lat, 99):.3f}"
+        print(line)
+
+
+def total_duration(stages: List[Stage]) -> float:
+    return math.fsum(s.duration for s in stages)
@@ -2,14 +2,19 @@
 """
 Test de charge Keycloak : connexions simultanées et durée.
 
-Deux modes :
+Quatre modes :
 - constant (défaut) : N threads pendant D secondes (débit max).
 - ramp : X utilisateurs se connectent progressivement sur ramp-up, restent (optionnel), puis
   se déconnectent progressivement sur ramp-down.
+- profile : paliers déclarés dans un fichier JSON/YAML (step, spike, soak, ...), voir keycloak_load_profile.py.
+- search : recherche du débit max soutenable sous un SLO (p99, taux d'erreur), voir keycloak_capacity_search.py.
 
 Usage :
   python keycloak_load_test.py --concurrent 20 --duration 60
   python keycloak_load_test.py --mode ramp --users 50 --ramp-up 60 --hold 30 --ramp-down 60
+  python keycloak_load_test.py --mode profile --profile profiles/spike.json
+  python keycloak_load_test.py --mode search --slo-p99 0.5 --slo-error-rate 0.001
+  python keycloak_load_test.py --timing --connection keep-alive   # phases DNS/connect/TLS/TTFB/transfert
 
 Variables d'environnement (ou .env) : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD
 """
@@ -20,10 +25,26 @@ import statistics
 import sys
 import threading
 import time
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
 import requests
 
+from keycloak_capacity_search import add_search_arguments, print_search_report, run_search, search_record, slo_from_args
+from keycloak_load_profile import (
+    Result,
+    Stage,
+    StageMark,
+    announce_stage,
+    load_profile,
+    percentile,
+    print_stage_report,
+    ramp_stages,
+    run_profile,
+    total_duration,
+)
+from keycloak_request_timing import CONNECTION_MODES, PhaseRecorder, TimedHttpClient, thread_session, timed_login
+from keycloak_run_results import DEFAULT_RESULTS_DIR, build_run_record, fetch_keycloak_version, save_run
+
 try:
     from dotenv import load_dotenv
     _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -47,9 +68,11 @@ def login(
     username: str,
     password: str,
     timeout: float = 10.0,
+    session: Optional[requests.Session] = None,
 ) -> Tuple[bool, float, Optional[str]]:
     """
     Tente un login (obtention de token). Retourne (succès, latence_sec, message_erreur).
+    Sans session, requests.post ouvre une nouvelle connexion à chaque appel.
     """
     url = f"{base_url}/realms/{realm}/protocol/openid-connect/token"
     data = {
@@ -60,7 +83,7 @@ def login(
     }
     start = time.perf_counter()
     try:
-        r = requests.post(url, data=data, timeout=timeout)
+        r = (session or requests).post(url, data=data, timeout=timeout)
         elapsed = time.perf_counter() - start
         if r.status_code == 200:
             return True, elapsed, None
@@ -74,47 +97,17 @@ def login(
 
 
 def worker(
-    base_url: str,
-    realm: str,
-    username: str,
-    password: str,
+    do_login: Callable[[], Tuple[bool, float, Optional[str]]],
     deadline: float,
-    results: List[Tuple[bool, float, Optional[str]]],
+    results: List[Result],
     results_lock: threading.Lock,
     stop: threading.Event,
-    timeout: float,
 ) -> None:
     """Un worker : enchaîne les logins jusqu'à deadline ou stop."""
     while not stop.is_set() and time.monotonic() < deadline:
-        ok, lat, err = login(base_url, realm, username, password, timeout=timeout)
-        with results_lock:
-            results.append((ok, lat, err))
-
-
-def worker_ramp(
-    base_url: str,
-    realm: str,
-    username: str,
-    password: str,
-    results: List[Tuple[bool, float, Optional[str]]],
-    results_lock: threading.Lock,
-    my_stop: threading.Event,
-    timeout: float,
-) -> None:
-    """Un worker pour le mode ramp : enchaîne les logins jusqu'à ce que my_stop soit posé."""
-    while not my_stop.is_set():
-        ok, lat, err = login(base_url, realm, username, password, timeout=timeout)
+        ok, lat, err = do_login()
         with results_lock:
-            results.append((ok, lat, err))
-
-
-def percentile(sorted_values: List[float], p: float) -> float:
-    if not sorted_values:
-        return 0.0
-    k = (len(sorted_values) - 1) * p / 100
-    f = int(k)
-    c = f + 1 if f + 1 < len(sorted_values) else f
-    return sorted_values[f] + (k - f) * (sorted_values[c] - sorted_values[f])
+            results.append((ok, lat, err, time.monotonic()))
 
 
 def main() -> int:
@@ -157,9 +150,16 @@ def main() -> int:
     parser.add_argument(
         "--mode",
         type=str,
-        choices=("constant", "ramp"),
+        choices=("constant", "ramp", "profile", "search"),
         default="constant",
-        help="constant = N threads pendant D s ; ramp = X users montée/descente progressive",
+        help="constant = N threads pendant D s ; ramp = X users montée/descente progressive ; "
+             "profile = paliers (--profile) ; search = capacité max sous SLO",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="PATH",
+        help="Fichier de profil JSON/YAML (liste de paliers users/rate/duration/curve), mode profile",
     )
     parser.add_argument(
         "--users",
@@ -189,13 +189,58 @@ def main() -> int:
         metavar="SEC",
         help="Durée de descente : X → 0 users (mode ramp)",
     )
+    add_search_arguments(parser)
+    parser.add_argument(
+        "--connection",
+        choices=CONNECTION_MODES,
+        default="fresh",
+        help="fresh = nouvelle connexion par requête (défaut) ; keep-alive = connexion persistante par thread",
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="Décompose chaque requête en phases DNS / connect / TLS / TTFB / transfert (histogrammes par phase)",
+    )
+    parser.add_argument(
+        "--results-dir",
+        type=str,
+        default=DEFAULT_RESULTS_DIR,
+        metavar="DIR",
+        help="Répertoire des artefacts de résultats (défaut: RESULTS_DIR ou results/)",
+    )
+    parser.add_argument("--no-save", action="store_true", help="Ne pas écrire l'artefact de résultats")
     args = parser.parse_args()
 
     base_url = args.url.rstrip("/")
     password = args.password or os.environ.get("KEYCLOAK_ADMIN_PASSWORD", _DEFAULT_PASS)
 
+    stages: List[Stage] = []
+    if args.mode == "profile":
+        if not args.profile:
+            parser.error("--mode profile requiert --profile PATH")
+        try:
+            stages = load_profile(args.profile)
+        except (OSError, ValueError) as e:
+            print(f"Erreur: profil {args.profile} : {e}")
+            return 1
+    elif args.mode == "ramp":
+        stages = ramp_stages(args.users, args.ramp_up, args.hold, args.ramp_down)
+
     print("=" * 60)
-    if args.mode == "ramp":
+    if args.mode == "search":
+        print("  🔥 Test de charge Keycloak (recherche de capacité)")
+        print(f"     URL        : {base_url}")
+        print(f"     Realm      : {args.realm}")
+        print(f"     User       : {args.user}")
+        print(f"     SLO        : p99 ≤ {args.slo_p99}s, erreurs ≤ {args.slo_error_rate * 100:.2f} %")
+        print(f"     Paliers    : {args.step_duration}s ({args.stabilize}s de stabilisation), par {args.search_by}")
+    elif args.mode == "profile":
+        print("  🔥 Test de charge Keycloak (profil de paliers)")
+        print(f"     URL        : {base_url}")
+        print(f"     Realm      : {args.realm}")
+        print(f"     User       : {args.user}")
+        print(f"     Profil     : {args.profile} ({len(stages)} paliers, {total_duration(stages):.0f} s)")
+    elif args.mode == "ramp":
         print("  🔥 Test de charge Keycloak (ramp : montée / descente progressive)")
         print(f"     URL        : {base_url}")
         print(f"     Realm      : {args.realm}")
@@ -208,6 +253,7 @@ def main() -> int:
         print(f"     User       : {args.user}")
         print(f"     Concurrent : {args.concurrent} threads")
         print(f"     Durée      : {args.duration} s")
+    print(f"     Connexion  : {args.connection}{' (timing par phase)' if args.timing else ''}")
     print("=" * 60)
 
     # Warmup
@@ -217,45 +263,30 @@ def main() -> int:
             login(base_url, args.realm, args.user, password, args.timeout)
         print("   OK\n")
 
-    results: List[Tuple[bool, float, Optional[str]]] = []
+    results: List[Result] = []
     results_lock = threading.Lock()
-    start_wall = time.monotonic()
-
-    if args.mode == "ramp":
-        # Mode ramp : un stop Event par thread
-        stop_events = [threading.Event() for _ in range(args.users)]
-        threads: List[threading.Thread] = []
-        for i in range(args.users):
-            t = threading.Thread(
-                target=worker_ramp,
-                args=(base_url, args.realm, args.user, password, results, results_lock, stop_events[i], args.timeout),
-                daemon=True,
-            )
-            threads.append(t)
+    marks: List[StageMark] = []
+    extra = {}
+    phases = PhaseRecorder() if args.timing else None
+    timed_client = TimedHttpClient(base_url, args.connection == "keep-alive", args.timeout) if args.timing else None
 
-        # Montée : démarrer les threads progressivement
-        ramp_up_end = start_wall + args.ramp_up
-        for i in range(args.users):
-            when = start_wall + (i / max(args.users, 1)) * args.ramp_up
-            now = time.monotonic()
-            if when > now:
-                time.sleep(when - now)
-            threads[i].start()
+    def do_login() -> Tuple[bool, float, Optional[str]]:
+        if timed_client:
+            return timed_login(timed_client, phases, args.realm, args.user, password)
+        session = thread_session() if args.connection == "keep-alive" else None
+        return login(base_url, args.realm, args.user, password, args.timeout, session=session)
 
-        # Hold au pic
-        time.sleep(args.hold)
+    start_wall = time.monotonic()
 
-        # Descente : arrêter les threads progressivement
-        ramp_down_start = time.monotonic()
-        for i in range(args.users):
-            when = ramp_down_start + (i / max(args.users, 1)) * args.ramp_down
-            now = time.monotonic()
-            if when > now:
-                time.sleep(when - now)
-            stop_events[i].set()
+    # Modes ramp, profile et search : même moteur de paliers (keycloak_load_profile)
+    def request_factory(_: int):
+        return do_login
 
-        for t in threads:
-            t.join(timeout=args.timeout + 2)
+    if args.mode == "search":
+        best, steps, marks = run_search(args, request_factory, results, results_lock, args.timeout)
+        extra.update(search_record(args, best, steps))
+    elif stages:
+        marks = run_profile(stages, request_factory, results, results_lock, args.timeout, on_stage=announce_stage)
     else:
         # Mode constant (comportement d'origine)
         stop = threading.Event()
@@ -264,7 +295,7 @@ def main() -> int:
         for _ in range(args.concurrent):
             t = threading.Thread(
                 target=worker,
-                args=(base_url, args.realm, args.user, password, deadline, results, results_lock, stop, args.timeout),
+                args=(do_login, deadline, results, results_lock, stop),
                 daemon=True,
             )
             t.start()
@@ -279,10 +310,10 @@ def main() -> int:
 
     # Stats
     total = len(results)
-    ok_count = sum(1 for ok, _, _ in results if ok)
-    latencies = [lat for ok, lat, _ in results if ok]
+    ok_count = sum(1 for ok, _, _, _ in results if ok)
+    latencies = [lat for ok, lat, _, _ in results if ok]
     errors = {}
-    for ok, _, err in results:
+    for ok, _, err, _ in results:
         if not ok and err:
             errors[err] = errors.get(err, 0) + 1
 
@@ -298,12 +329,29 @@ def main() -> int:
         lat_sorted = sorted(latencies)
         print(f"     Latence (s)      : min={min(latencies):.3f}  avg={statistics.mean(latencies):.3f}  "
               f"p50={percentile(lat_sorted, 50):.3f}  p95={percentile(lat_sorted, 95):.3f}  p99={percentile(lat_sorted, 99):.3f}")
+    print_stage_report(results, marks)
+    if phases:
+        phases.print_report()
+        extra["timing"] = phases.histograms()
     if errors:
         print(f"     Erreurs          : {dict(errors)}")
         if errors.get("HTTP 403"):
             print("\n  💡 HTTP 403 : activer « Direct access grants » pour le client admin-cli")
             print("     (Realm master → Clients → admin-cli → Paramètres) et vérifier la protection brute force.")
     print("=" * 60)
+    if args.mode == "search":
+        print_search_report(best, steps, slo_from_args(args), args.search_by)
+        print("=" * 60)
+
+    if not args.no_save:
+        record = build_run_record(
+            "keycloak_load_test", vars(args), results, start_wall, end_wall, marks,
+            keycloak_version=fetch_keycloak_version(base_url, args.user, password),
+            extra=extra or None,
+        )
+        path = save_run(record, args.results_dir)
+        if path:
+            print(f"  💾 Résultats : {path}")
     return 0 if (total > 0 and errors.get("HTTP 401", 0) != total) else 1
 
 
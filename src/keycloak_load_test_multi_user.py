@@ -8,14 +8,35 @@ la base et le cache de façon plus réaliste qu'avec un seul compte (token rép
 Deux sources de comptes :
   1. Création automatique : N users créés dans le realm avec un mot de passe commun,
      puis test de charge, puis suppression (sauf --no-cleanup).
-  2. Fichier externe : --accounts-file path avec une ligne "username:password" par compte.
+  2. Fichier externe : --accounts-file path avec une ligne "username:password" par compte
+     (ou JSONL, éventuellement gzip) ; fichier mappé en mémoire avec index d'offsets en cache
+     (AccountStore, keycloak_accounts.py), adapté aux fichiers de plusieurs millions de comptes.
+  3. Fixtures persistantes : --create-users N --reuse-fixtures réutilise les comptes {prefix}0..N-1
+     d'un run précédent (registre local, keycloak_fixtures.py), ne crée que les manquants et ne les
+     supprime que sur demande (--cleanup-fixtures).
 
-Modes : constant (M threads × D s) ou ramp (montée/descente progressive), comme keycloak_load_test.py.
+Multi-realm : --realms "a:3,b:1" (ou "tenant-{1..200}", "@fichier") répartit les requêtes entre
+plusieurs realms selon les poids (keycloak_tenants.py). Avec --create-users N, les comptes
+{prefix}0..N-1 sont provisionnés en masse dans chaque realm (partialImport, idempotent) et
+conservés ; --create-realms crée les realms absents. Rapport par realm et agrégé.
+
+Les comptes sont distribués aux threads par un ordonnanceur global (keycloak_accounts.py) :
+--account-policy round-robin (défaut), random, zipf (utilisateurs chauds) ou lease (bail exclusif).
+
+Modes : constant (M threads × D s), ramp (montée/descente progressive), profile (paliers déclarés
+dans un fichier JSON/YAML) ou search (capacité max sous SLO), comme keycloak_load_test.py — même
+moteur de paliers (keycloak_load_profile.py).
 
 Usage :
   python keycloak_load_test_multi_user.py --create-users 50 --concurrent 20 --duration 60
   python keycloak_load_test_multi_user.py --create-users 30 --mode ramp --ramp-up 60 --hold 30 --ramp-down 60
+  python keycloak_load_test_multi_user.py --create-users 100 --mode profile --profile profiles/step.json
+  python keycloak_load_test_multi_user.py --create-users 200 --mode search --slo-p99 0.5 --search-by rate
   python keycloak_load_test_multi_user.py --accounts-file users.txt --concurrent 10 --duration 30
+  python keycloak_load_test_multi_user.py --create-users 5000 --reuse-fixtures --concurrent 50
+  python keycloak_load_test_multi_user.py --create-users 50 --timing --connection fresh
+  python keycloak_load_test_multi_user.py --create-users 1000 --account-policy zipf --zipf-s 1.2
+  python keycloak_load_test_multi_user.py --realms "tenant-{1..100}" --create-realms --create-users 50 --concurrent 50
 
 Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD.
 Optionnel : LOAD_TEST_USER_PASSWORD (mot de passe des users créés, défaut "testpass").
@@ -27,10 +48,36 @@ import statistics
 import sys
 import threading
 import time
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Sequence, Tuple
 
 import requests
 
+from keycloak_accounts import POLICIES, AccountScheduler, AccountStore, print_scheduler_report
+from keycloak_fixtures import (
+    DEFAULT_FIXTURE_PREFIX,
+    DEFAULT_FIXTURES_FILE,
+    FixtureAccounts,
+    admin_token_provider,
+    cleanup_fixtures,
+    ensure_fixture,
+)
+from keycloak_capacity_search import add_search_arguments, print_search_report, run_search, search_record, slo_from_args
+from keycloak_load_profile import (
+    Result,
+    Stage,
+    StageMark,
+    announce_stage,
+    load_profile,
+    percentile,
+    print_stage_report,
+    ramp_stages,
+    run_profile,
+    total_duration,
+)
+from keycloak_request_timing import CONNECTION_MODES, PhaseRecorder, TimedHttpClient, thread_session, timed_login
+from keycloak_run_results import DEFAULT_RESULTS_DIR, build_run_record, fetch_keycloak_version, save_run
+from keycloak_tenants import TenantSet, parse_realm_weights, print_realm_report, provision_tenants, realm_summary
+
 try:
     from dotenv import load_dotenv
     _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -119,6 +166,7 @@ def login(
     username: str,
     password: str,
     timeout: float = 10.0,
+    session: Optional[requests.Session] = None,
 ) -> Tuple[bool, float, Optional[str]]:
     url = f"{base_url}/realms/{realm}/protocol/openid-connect/token"
     data = {
@@ -129,7 +177,7 @@ def login(
     }
     start = time.perf_counter()
     try:
-        r = requests.post(url, data=data, timeout=timeout)
+        r = (session or requests).post(url, data=data, timeout=timeout)
         elapsed = time.perf_counter() - start
         if r.status_code == 200:
             return True, elapsed, None
@@ -142,19 +190,6 @@ def login(
         return False, elapsed, str(type(e).__name__)
 
 
-def load_accounts_from_file(path: str) -> List[Tuple[str, str]]:
-    accounts = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            if ":" in line:
-                u, p = line.split(":", 1)
-                accounts.append((u.strip(), p.strip()))
-    return accounts
-
-
 def create_test_users(
     base_url: str,
     realm: str,
@@ -178,60 +213,31 @@ def create_test_users(
     return accounts, user_ids
 
 
+LoginFn = Callable[[str, str, str], Tuple[bool, float, Optional[str]]]
+RequestFn = Callable[[], Tuple[bool, float, Optional[str]]]
+
+
 def worker_multi(
-    base_url: str,
-    realm: str,
-    accounts: List[Tuple[str, str]],
+    do_request: RequestFn,
     deadline: float,
-    results: List[Tuple[bool, float, Optional[str]]],
+    results: List[Result],
     results_lock: threading.Lock,
     stop: threading.Event,
-    timeout: float,
 ) -> None:
-    idx = [0]
-
-    def next_account() -> Tuple[str, str]:
-        i = idx[0] % len(accounts)
-        idx[0] += 1
-        return accounts[i]
-
     while not stop.is_set() and time.monotonic() < deadline:
-        user, pwd = next_account()
-        ok, lat, err = login(base_url, realm, user, pwd, timeout=timeout)
+        ok, lat, err = do_request()
         with results_lock:
-            results.append((ok, lat, err))
-
-
-def worker_ramp_multi(
-    base_url: str,
-    realm: str,
-    accounts: List[Tuple[str, str]],
-    results: List[Tuple[bool, float, Optional[str]]],
-    results_lock: threading.Lock,
-    my_stop: threading.Event,
-    timeout: float,
-) -> None:
-    idx = [0]
+            results.append((ok, lat, err, time.monotonic()))
 
-    def next_account() -> Tuple[str, str]:
-        i = idx[0] % len(accounts)
-        idx[0] += 1
-        return accounts[i]
 
-    while not my_stop.is_set():
-        user, pwd = next_account()
-        ok, lat, err = login(base_url, realm, user, pwd, timeout=timeout)
-        with results_lock:
-            results.append((ok, lat, err))
+def make_account_request(do_login: LoginFn, scheduler: AccountScheduler, realm: str) -> RequestFn:
+    """Fonction de requête d'un utilisateur virtuel : compte fourni par l'ordonnanceur global."""
 
+    def do_request() -> Tuple[bool, float, Optional[str]]:
+        with scheduler.checkout() as (user, pwd):
+            return do_login(realm, user, pwd)
 
-def percentile(sorted_values: List[float], p: float) -> float:
-    if not sorted_values:
-        return 0.0
-    k = (len(sorted_values) - 1) * p / 100
-    f = int(k)
-    c = f + 1 if f + 1 < len(sorted_values) else f
-    return sorted_values[f] + (k - f) * (sorted_values[c] - sorted_values[f])
+    return do_request
 
 
 def main() -> int:
@@ -240,6 +246,8 @@ def main() -> int:
     )
     parser.add_argument("--url", type=str, default=_DEFAULT_URL, help="URL Keycloak")
     parser.add_argument("--realm", type=str, default=_DEFAULT_REALM, help="Realm")
+    parser.add_argument("--realms", type=str, metavar="SPEC", help="Plusieurs realms pondérés : \"a:3,b:1\", \"tenant-{1..100}\" ou \"@fichier\" (remplace --realm)")
+    parser.add_argument("--create-realms", action="store_true", help="Avec --realms et --create-users : créer les realms absents")
     parser.add_argument("--admin-user", type=str, default=_DEFAULT_ADMIN, help="Admin pour créer/supprimer les users")
     parser.add_argument("--admin-password", type=str, default=_DEFAULT_ADMIN_PASS, help="Mot de passe admin")
     parser.add_argument(
@@ -258,35 +266,103 @@ def main() -> int:
         "--accounts-file",
         type=str,
         metavar="PATH",
-        help="Fichier avec une ligne 'username:password' par compte (au lieu de --create-users)",
+        help="Fichier avec une ligne 'username:password' par compte, ou JSONL {username, password} ; .gz accepté (au lieu de --create-users)",
     )
     parser.add_argument("--no-cleanup", action="store_true", help="Ne pas supprimer les users créés après le test")
+    parser.add_argument("--reuse-fixtures", action="store_true", help="Avec --create-users : réutiliser les comptes persistants {prefix}0..N-1 (registre de fixtures), créer seulement les manquants, ne pas supprimer")
+    parser.add_argument("--fixture-prefix", type=str, default=DEFAULT_FIXTURE_PREFIX, help=f"Préfixe des comptes de fixture (défaut: {DEFAULT_FIXTURE_PREFIX})")
+    parser.add_argument("--fixtures-file", type=str, default=DEFAULT_FIXTURES_FILE, metavar="PATH", help="Registre des fixtures (défaut: FIXTURES_FILE ou results/fixtures.json)")
+    parser.add_argument("--cleanup-fixtures", action="store_true", help="Avec --reuse-fixtures ou --realms : supprimer les comptes de la fixture après le test")
     parser.add_argument("--concurrent", type=int, default=10, metavar="N", help="Nombre de threads (mode constant)")
     parser.add_argument("--duration", type=float, default=30.0, metavar="SEC", help="Durée du test (mode constant)")
     parser.add_argument("--timeout", type=float, default=10.0, help="Timeout par requête")
     parser.add_argument("--warmup", type=int, default=3, help="Requêtes de warmup (exclues des stats)")
-    parser.add_argument("--mode", type=str, choices=("constant", "ramp"), default="constant")
+    parser.add_argument("--mode", type=str, choices=("constant", "ramp", "profile", "search"), default="constant")
+    parser.add_argument("--profile", type=str, metavar="PATH", help="Fichier de profil JSON/YAML (paliers), mode profile")
     parser.add_argument("--users", type=int, default=30, metavar="X", help="Nombre de threads (mode ramp)")
     parser.add_argument("--ramp-up", type=float, default=60.0)
     parser.add_argument("--hold", type=float, default=30.0)
     parser.add_argument("--ramp-down", type=float, default=60.0)
+    parser.add_argument("--account-policy", choices=POLICIES, default="round-robin", help="Distribution des comptes aux threads : round-robin global (défaut), random, zipf (utilisateurs chauds), lease (bail exclusif)")
+    parser.add_argument("--zipf-s", type=float, default=1.1, metavar="S", help="Exposant de la loi de Zipf (--account-policy zipf, défaut: 1.1)")
+    parser.add_argument("--account-seed", type=int, metavar="N", help="Graine des tirages de comptes (reproductibilité)")
+    add_search_arguments(parser)
+    parser.add_argument("--connection", choices=CONNECTION_MODES, default="fresh", help="fresh = nouvelle connexion par requête (défaut) ; keep-alive = connexion persistante par thread")
+    parser.add_argument("--timing", action="store_true", help="Décompose chaque requête en phases DNS / connect / TLS / TTFB / transfert")
+    parser.add_argument("--results-dir", type=str, default=DEFAULT_RESULTS_DIR, metavar="DIR", help="Répertoire des artefacts de résultats (défaut: RESULTS_DIR ou results/)")
+    parser.add_argument("--no-save", action="store_true", help="Ne pas écrire l'artefact de résultats")
     args = parser.parse_args()
 
     base_url = args.url.rstrip("/")
     admin_pass = args.admin_password or os.environ.get("KEYCLOAK_ADMIN_PASSWORD", _DEFAULT_ADMIN_PASS)
 
-    accounts: List[Tuple[str, str]] = []
+    stages: List[Stage] = []
+    if args.mode == "profile":
+        if not args.profile:
+            parser.error("--mode profile requiert --profile PATH")
+        try:
+            stages = load_profile(args.profile)
+        except (OSError, ValueError) as e:
+            print(f"Erreur: profil {args.profile} : {e}")
+            return 1
+    elif args.mode == "ramp":
+        stages = ramp_stages(args.users, args.ramp_up, args.hold, args.ramp_down)
+
+    tenants: Optional[TenantSet] = None
+    if args.realms:
+        try:
+            tenants = TenantSet(parse_realm_weights(args.realms), args.account_seed)
+        except (OSError, ValueError) as e:
+            print(f"Erreur: --realms {args.realms} : {e}")
+            return 1
+
+    accounts: Sequence[Tuple[str, str]] = []
     user_ids_to_delete: List[str] = []
 
     if args.accounts_file:
         if not os.path.isfile(args.accounts_file):
             print(f"Erreur: fichier introuvable: {args.accounts_file}")
             return 1
-        accounts = load_accounts_from_file(args.accounts_file)
+        t0 = time.perf_counter()
+        try:
+            accounts = AccountStore(args.accounts_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Erreur: lecture de {args.accounts_file} : {e}")
+            return 1
         if not accounts:
-            print("Erreur: aucun compte dans le fichier (format: username:password par ligne)")
+            print("Erreur: aucun compte dans le fichier (format: username:password par ligne, ou JSONL)")
+            return 1
+        print(f"  Comptes chargés depuis {args.accounts_file} : {len(accounts)} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    elif args.create_users and args.create_users > 0 and tenants:
+        print(f"\n📋 Fixture {args.fixture_prefix}0..{args.create_users - 1} dans {len(tenants.realms)} realms (partialImport)...")
+        try:
+            info = provision_tenants(
+                base_url, admin_token_provider(base_url, args.admin_user, admin_pass), tenants.realms,
+                args.fixture_prefix, args.create_users, args.user_password, args.create_realms,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"  Erreur: provisionnement des realms : {e}")
+            return 1
+        print(f"  ✅ {info['realms_created']} realms créés, {info['added']} comptes ajoutés, "
+              f"{info['skipped']} déjà présents ({info['elapsed']:.1f} s).\n")
+        accounts = FixtureAccounts(args.fixture_prefix, args.create_users, args.user_password)
+    elif args.create_users and args.create_users > 0 and args.reuse_fixtures:
+        print(f"\n📋 Fixture {args.fixture_prefix}0..{args.create_users - 1} (realm={args.realm})...")
+        try:
+            accounts, info = ensure_fixture(
+                base_url, args.realm, args.admin_user, admin_pass,
+                args.create_users, args.user_password, args.fixture_prefix, args.fixtures_file,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"  Erreur: préparation de la fixture : {e}")
             return 1
-        print(f"  Comptes chargés depuis {args.accounts_file} : {len(accounts)}")
+        if info["reused"]:
+            print(f"  ✅ Fixture réutilisée ({info['elapsed']:.1f} s).\n")
+        else:
+            print(f"  ✅ {info['created']} comptes créés, {info['reset']} mots de passe réinitialisés ({info['elapsed']:.1f} s).")
+            if info["failed"]:
+                print(f"  ⚠ {info['failed']} échec(s) : fixture non enregistrée, elle sera revérifiée au prochain run.")
+            print()
     elif args.create_users and args.create_users > 0:
         run_id = str(int(time.time()))
         print(f"\n📋 Création de {args.create_users} utilisateurs de test (run_id={run_id})...")
@@ -307,49 +383,71 @@ def main() -> int:
     print("=" * 60)
     print("  🔥 Test de charge Keycloak (multi-comptes)")
     print(f"     URL        : {base_url}")
-    print(f"     Realm      : {args.realm}")
-    print(f"     Comptes    : {len(accounts)}")
-    if args.mode == "ramp":
+    if tenants:
+        print(f"     Realms     : {len(tenants.realms)} ({args.realms})")
+    else:
+        print(f"     Realm      : {args.realm}")
+    print(f"     Comptes    : {len(accounts)} (politique {args.account_policy})")
+    if args.mode == "search":
+        print(f"     SLO        : p99 ≤ {args.slo_p99}s, erreurs ≤ {args.slo_error_rate * 100:.2f} %, par {args.search_by}")
+    elif args.mode == "profile":
+        print(f"     Profil     : {args.profile} ({len(stages)} paliers, {total_duration(stages):.0f} s)")
+    elif args.mode == "ramp":
         print(f"     Threads    : {args.users} (ramp {args.ramp_up}s, hold {args.hold}s, ramp-down {args.ramp_down}s)")
     else:
         print(f"     Concurrent : {args.concurrent} threads, durée {args.duration}s")
+    print(f"     Connexion  : {args.connection}{' (timing par phase)' if args.timing else ''}")
     print("=" * 60)
 
     if args.warmup > 0:
         print(f"\n⏳ Warmup ({args.warmup} requêtes)...")
         for i in range(args.warmup):
             u, p = accounts[i % len(accounts)]
-            login(base_url, args.realm, u, p, args.timeout)
+            login(base_url, tenants.realms[i % len(tenants.realms)] if tenants else args.realm, u, p, args.timeout)
         print("   OK\n")
 
-    results: List[Tuple[bool, float, Optional[str]]] = []
+    results: List[Result] = []
     results_lock = threading.Lock()
+    marks: List[StageMark] = []
+    scheduler = AccountScheduler(accounts, args.account_policy, args.zipf_s, args.account_seed)
+    if tenants:
+        for realm in tenants.realms:
+            tenants.schedulers[realm] = AccountScheduler(accounts, args.account_policy, args.zipf_s, args.account_seed)
+    extra = {"accounts": len(accounts)}
+    phases = PhaseRecorder() if args.timing else None
+    timed_client = TimedHttpClient(base_url, args.connection == "keep-alive", args.timeout) if args.timing else None
+
+    def do_login(realm: str, username: str, password: str) -> Tuple[bool, float, Optional[str]]:
+        if timed_client:
+            return timed_login(timed_client, phases, realm, username, password)
+        session = thread_session() if args.connection == "keep-alive" else None
+        return login(base_url, realm, username, password, args.timeout, session=session)
+
+    def make_request() -> RequestFn:
+        if tenants:
+            return tenants.request_fn(do_login)
+        return make_account_request(do_login, scheduler, args.realm)
+
     start_wall = time.monotonic()
 
-    if args.mode == "ramp":
-        stop_events = [threading.Event() for _ in range(args.users)]
-        threads = []
-        for i in range(args.users):
-            t = threading.Thread(
-                target=worker_ramp_multi,
-                args=(base_url, args.realm, accounts, results, results_lock, stop_events[i], args.timeout),
-                daemon=True,
-            )
-            threads.append(t)
-        for i in range(args.users):
-            when = start_wall + (i / max(args.users, 1)) * args.ramp_up
-            if when > time.monotonic():
-                time.sleep(when - time.monotonic())
-            threads[i].start()
-        time.sleep(args.hold)
-        ramp_down_start = time.monotonic()
-        for i in range(args.users):
-            when = ramp_down_start + (i / max(args.users, 1)) * args.ramp_down
-            if when > time.monotonic():
-                time.sleep(when - time.monotonic())
-            stop_events[i].set()
-        for t in threads:
-            t.join(timeout=args.timeout + 2)
+    if args.mode == "search":
+        best, steps, marks = run_search(
+            args,
+            lambda _: make_request(),
+            results,
+            results_lock,
+            args.timeout,
+        )
+        extra.update(search_record(args, best, steps))
+    elif stages:
+        marks = run_profile(
+            stages,
+            lambda _: make_request(),
+            results,
+            results_lock,
+            args.timeout,
+            on_stage=announce_stage,
+        )
     else:
         stop = threading.Event()
         deadline = start_wall + args.duration
@@ -357,7 +455,7 @@ def main() -> int:
         for _ in range(args.concurrent):
             t = threading.Thread(
                 target=worker_multi,
-                args=(base_url, args.realm, accounts, deadline, results, results_lock, stop, args.timeout),
+                args=(make_request(), deadline, results, results_lock, stop),
                 daemon=True,
             )
             t.start()
@@ -371,10 +469,10 @@ def main() -> int:
     elapsed_wall = end_wall - start_wall
 
     total = len(results)
-    ok_count = sum(1 for ok, _, _ in results if ok)
-    latencies = [lat for ok, lat, _ in results if ok]
+    ok_count = sum(1 for ok, _, _, _ in results if ok)
+    latencies = [lat for ok, lat, _, _ in results if ok]
     errors = {}
-    for ok, _, err in results:
+    for ok, _, err, _ in results:
         if not ok and err:
             errors[err] = errors.get(err, 0) + 1
 
@@ -389,11 +487,38 @@ def main() -> int:
         lat_sorted = sorted(latencies)
         print(f"     Latence (s)      : min={min(latencies):.3f}  avg={statistics.mean(latencies):.3f}  "
               f"p50={percentile(lat_sorted, 50):.3f}  p95={percentile(lat_sorted, 95):.3f}  p99={percentile(lat_sorted, 99):.3f}")
+    print_stage_report(results, marks)
+    if tenants:
+        summary = realm_summary(tenants.results, elapsed_wall)
+        print_realm_report(summary, tenants.weights)
+        extra["realms"] = {
+            realm: dict(s, weight=tenants.weights[realm], account_scheduler=tenants.schedulers[realm].stats())
+            for realm, s in summary.items()
+        }
+    else:
+        extra["account_scheduler"] = scheduler.stats()
+        print_scheduler_report(extra["account_scheduler"])
+    if phases:
+        phases.print_report()
+        extra["timing"] = phases.histograms()
     if errors:
         print(f"     Erreurs          : {dict(errors)}")
         if errors.get("HTTP 403"):
             print("\n  💡 HTTP 403 : activer « Direct access grants » pour admin-cli (voir docs/admin-keycloak.md)")
     print("=" * 60)
+    if args.mode == "search":
+        print_search_report(best, steps, slo_from_args(args), args.search_by)
+        print("=" * 60)
+
+    if not args.no_save:
+        record = build_run_record(
+            "keycloak_load_test_multi_user", vars(args), results, start_wall, end_wall, marks,
+            keycloak_version=fetch_keycloak_version(base_url, args.admin_user, admin_pass),
+            extra=extra,
+        )
+        path = save_run(record, args.results_dir)
+        if path:
+            print(f"  💾 Résultats : {path}")
 
     if user_ids_to_delete and not args.no_cleanup:
         print("\n🧹 Suppression des utilisateurs de test...")
@@ -401,6 +526,17 @@ def main() -> int:
         for uid in user_ids_to_delete:
             delete_user(base_url, args.realm, token, uid)
         print(f"  ✅ {len(user_ids_to_delete)} utilisateurs supprimés.\n")
+    if tenants and args.create_users and args.cleanup_fixtures:
+        print(f"\n🧹 Suppression de la fixture dans {len(tenants.realms)} realms...")
+        deleted = sum(
+            cleanup_fixtures(base_url, realm, args.admin_user, admin_pass, args.fixture_prefix, args.fixtures_file)
+            for realm in tenants.realms
+        )
+        print(f"  ✅ {deleted} utilisateurs supprimés.\n")
+    elif args.reuse_fixtures and args.cleanup_fixtures:
+        print("\n🧹 Suppression de la fixture...")
+        deleted = cleanup_fixtures(base_url, args.realm, args.admin_user, admin_pass, args.fixture_prefix, args.fixtures_file)
+        print(f"  ✅ {deleted} utilisateurs supprimés.\n")
 
     return 0 if (total > 0 and errors.get("HTTP 401", 0) != total) else 1
 
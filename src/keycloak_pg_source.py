@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Source Postgres de l'exporteur de sessions (EXPORTER_BACKEND=postgres).
+
+Keycloak 25+ persiste les sessions utilisateur (tables offline_user_session / offline_client_session,
+offline_flag = '0' pour les sessions en ligne) et les événements (event_entity) en base. Au lieu de
+parcourir /clients/{uuid}/user-sessions page par page, les métriques sont calculées par quelques
+requêtes d'agrégat indexées :
+
+  - sessions par client, utilisateurs distincts (realm et par client), histogramme des durées ;
+  - événements nouveaux depuis un curseur (event_time), derniers LOGIN avec username / email.
+
+Connexions en lecture seule (default_transaction_read_only, statement_timeout) via un pool
+(psycopg2 ThreadedConnectionPool). Rôle dédié conseillé : scripts/pg-exporter-role.sql.
+
+Usage (vérification contre un Postgres local) :
+  python keycloak_pg_source.py --realm master
+  python keycloak_pg_source.py --all --dsn "host=localhost port=5432 dbname=keycloak user=kc_exporter password=..."
+
+Variables d'environnement : EXPORTER_PG_DSN, sinon POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB et le rôle
+kc_exporter (mot de passe PG_EXPORTER_PASSWORD) ; jamais le propriétaire de la base par défaut.
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from dotenv import load_dotenv
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv(os.path.join(_root, ".env"))
+    load_dotenv()
+except ImportError:
+    pass
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+except ImportError:
+    psycopg2 = None
+
+STATEMENT_TIMEOUT_MS = int(os.environ.get("EXPORTER_PG_STATEMENT_TIMEOUT_MS", "5000"))
+POOL_SIZE = int(os.environ.get("EXPORTER_PG_POOL_SIZE", "4"))
+# Les événements des dernières secondes peuvent être encore en cours de commit : non comptés avant ce délai
+EVENTS_LAG_MS = int(float(os.environ.get("EXPORTER_PG_EVENTS_LAG", "2")) * 1000)
+
+# Sessions en ligne encore valides : ni inactives depuis ssoSessionIdleTimeout, ni plus vieilles que
+# ssoSessionMaxLifespan (les sessions expirées restent en base jusqu'au nettoyage périodique)
+_ACTIVE_SESSIONS = """
+    FROM offline_user_session us
+    JOIN realm r ON r.id = us.realm_id
+    WHERE r.name = %(realm)s
+      AND us.offline_flag = '0'
+      AND us.last_session_refresh >= %(now)s - r.sso_idle_timeout
+      AND us.created_on >= %(now)s - r.sso_max_lifespan
+"""
+
+_CLIENT_SESSIONS = """
+    FROM offline_user_session us
+    JOIN realm r ON r.id = us.realm_id
+    JOIN offline_client_session cs ON cs.user_session_id = us.user_session_id AND cs.offline_flag = us.offline_flag
+    JOIN client c ON c.id = cs.client_id
+    WHERE r.name = %(realm)s
+      AND us.offline_flag = '0'
+      AND us.last_session_refresh >= %(now)s - r.sso_idle_timeout
+      AND us.created_on >= %(now)s - r.sso_max_lifespan
+"""
+
+
+def default_dsn() -> str:
+    """DSN libpq : EXPORTER_PG_DSN, sinon rôle kc_exporter sur POSTGRES_HOST/PORT/DB (comme docker-compose)."""
+    dsn = os.environ.get("EXPORTER_PG_DSN")
+    if dsn:
+        return dsn
+    return (
+        f"host={os.environ.get('POSTGRES_HOST', 'localhost')} port={os.environ.get('POSTGRES_PORT', '5432')} "
+        f"dbname={os.environ.get('POSTGRES_DB', 'keycloak')} user=kc_exporter "
+        f"password={os.environ.get('PG_EXPORTER_PASSWORD', '')}"
+    )
+
+
+def _histogram_select(buckets: tuple) -> str:
+    """Colonnes : nombre de sessions, somme des âges, puis effectifs cumulés par borne."""
+    cols = ["count(*)", "coalesce(sum(%(now)s - us.created_on), 0)"]
+    cols += [f"count(*) FILTER (WHERE %(now)s - us.created_on <= {float(b)!r})" for b in buckets]
+    return ", ".join(cols)
+
+
+def _to_histogram(row: tuple) -> list:
+    """(count, somme, cumulés...) → [effectifs par bucket (non cumulés) + +Inf, somme] (format SessionCrawl)."""
+    total, age_sum, cumulative = int(row[0]), float(row[1]), [int(c) for c in row[2:]]
+    hist, previous = [], 0
+    for c in cumulative:
+        hist.append(c - previous)
+        previous = c
+    hist.append(total - previous)
+    hist.append(age_sum)
+    return hist
+
+
+class PostgresSource:
+    """Requêtes d'agrégat sur la base Keycloak (lecture seule, connexions en pool)."""
+
+    def __init__(self, dsn: Optional[str] = None, pool_size: int = POOL_SIZE, statement_timeout_ms: int = STATEMENT_TIMEOUT_MS) -> None:
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 requis pour EXPORTER_BACKEND=postgres (pip install psycopg2-binary)")
+        self._pool = ThreadedConnectionPool(
+            1,
+            max(1, pool_size),
+            dsn or default_dsn(),
+            application_name="keycloak-session-exporter",
+            options=f"-c default_transaction_read_only=on -c statement_timeout={statement_timeout_ms}",
+        )
+        self.queries = 0
+
+    def _query(self, sql: str, params: dict) -> List[tuple]:
+        conn = self._pool.getconn()
+        broken = False
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                self.queries += 1
+                return cur.fetchall()
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            self._pool.putconn(conn, close=broken)
+
+    def close(self) -> None:
+        self._pool.closeall()
+
+    def realms(self) -> List[str]:
+        return [r[0] for r in self._query("SELECT name FROM realm WHERE enabled ORDER BY name", {})]
+
+    def session_stats(
+        self,
+        realm: str,
+        buckets: tuple,
+        by_client: bool = False,
+        duration_series: int = 0,
+        now: Optional[int] = None,
+    ) -> dict:
+        """
+        {"clients": {clientId: sessions}, "distinct_users": n, "distinct_by_client": {clientId: n},
+         "histograms": {clientId ou "": [...]}, "durations": [(user_id, username, start_ms)], "now_ms": ms}
+        """
+        now = int(now if now is not None else time.time())
+        params = {"realm": realm, "now": now}
+        clients: Dict[str, int] = {}
+        distinct_by_client: Dict[str, int] = {}
+        for client_id, sessions, users in self._query(
+            f"SELECT c.client_id, count(*), count(DISTINCT us.user_id) {_CLIENT_SESSIONS} GROUP BY c.client_id", params
+        ):
+            clients[client_id] = int(sessions)
+            distinct_by_client[client_id] = int(users)
+        distinct_users = int(self._query(f"SELECT count(DISTINCT us.user_id) {_ACTIVE_SESSIONS}", params)[0][0])
+        if by_client:
+            histograms = {
+                row[0]: _to_histogram(row[1:])
+                for row in self._query(
+                    f"SELECT c.client_id, {_histogram_select(buckets)} {_CLIENT_SESSIONS} GROUP BY c.client_id", params
+                )
+            }
+        else:
+            histograms = {"": _to_histogram(self._query(f"SELECT {_histogram_select(buckets)} {_ACTIVE_SESSIONS}", params)[0])}
+        durations = []
+        if duration_series:
+            for user_id, username, created_on in self._query(
+                f"SELECT us.user_id, (SELECT u.username FROM user_entity u WHERE u.id = us.user_id), us.created_on "
+                f"{_ACTIVE_SESSIONS} ORDER BY us.created_on LIMIT %(limit)s",
+                dict(params, limit=duration_series),
+            ):
+                durations.append((user_id, username or user_id[:8], int(created_on) * 1000))
+        return {
+            "clients": clients,
+            "distinct_users": distinct_users,
+            "distinct_by_client": distinct_by_client,
+            "histograms": histograms,
+            "durations": durations,
+            "now_ms": now * 1000,
+        }
+
+    def event_counts(self, realm: str, event_types: tuple, since_ms: int, until_ms: int) -> Dict[Tuple[str, str, str], int]:
+        """Événements des types donnés avec since_ms < event_time <= until_ms, par (type, clientId, erreur)."""
+        rows = self._query(
+            """
+            SELECT e.type, coalesce(e.client_id, ''), coalesce(e.error, ''), count(*)
+            FROM event_entity e
+            JOIN realm r ON r.id = e.realm_id
+            WHERE r.name = %(realm)s AND e.type = ANY(%(types)s)
+              AND e.event_time > %(since)s AND e.event_time <= %(until)s
+            GROUP BY 1, 2, 3
+            """,
+            {"realm": realm, "types": list(event_types), "since": since_ms, "until": until_ms},
+        )
+        return {(t, c, err): int(n) for t, c, err, n in rows}
+
+    def latest_logins(self, realm: str, limit: int) -> List[dict]:
+        """Derniers LOGIN (du plus récent au plus ancien), username / email joints : aucun appel /users."""
+        rows = self._query(
+            """
+            SELECT e.user_id, e.event_time, u.username, u.email
+            FROM event_entity e
+            JOIN realm r ON r.id = e.realm_id
+            LEFT JOIN user_entity u ON u.id = e.user_id
+            WHERE r.name = %(realm)s AND e.type = 'LOGIN'
+            ORDER BY e.event_time DESC
+            LIMIT %(limit)s
+            """,
+            {"realm": realm, "limit": limit},
+        )
+        return [{"userId": uid, "time": int(t), "username": username, "email": email} for uid, t, username, email in rows]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Vérifie la source Postgres de l'exporteur de sessions (temps des requêtes).")
+    parser.add_argument("--dsn", type=str, default=None, help="DSN libpq (défaut : EXPORTER_PG_DSN, sinon rôle kc_exporter)")
+    parser.add_argument("--realm", type=str, default=os.environ.get("KEYCLOAK_REALM", "master"), help="Realm (défaut: KEYCLOAK_REALM ou master)")
+    parser.add_argument("--all", action="store_true", help="Tous les realms actifs")
+    parser.add_argument("--buckets", type=str, default="60,300,900,1800,3600,7200,14400,28800,86400", help="Bornes de l'histogramme des durées (s)")
+    args = parser.parse_args()
+
+    try:
+        source = PostgresSource(args.dsn)
+    except Exception as e:
+        print(f"Erreur: {e}", file=sys.stderr)
+        return 1
+    buckets = tuple(float(b) for b in args.buckets.split(","))
+    realms = source.realms() if args.all else [args.realm]
+    print(f"  {'realm':<24} {'sessions':>9} {'distincts':>9} {'clients':>7} {'événements 1h':>13} {'durée (ms)':>10}")
+    for realm in realms:
+        t0 = time.perf_counter()
+        stats = source.session_stats(realm, buckets)
+        now_ms = int(time.time() * 1000)
+        events = source.event_counts(realm, ("LOGIN", "LOGIN_ERROR", "REFRESH_TOKEN", "LOGOUT"), now_ms - 3600_000, now_ms)
+        source.latest_logins(realm, 25)
+        elapsed = (time.perf_counter() - t0) * 1000
+        sessions = sum(sum(h[:-1]) for h in stats["histograms"].values())
+        print(f"  {realm[:24]:<24} {sessions:>9} {stats['distinct_users']:>9} {len(stats['clients']):>7} "
+              f"{sum(events.values()):>13} {elapsed:>10.1f}")
+    print(f"  {source.queries} requêtes")
+    source.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
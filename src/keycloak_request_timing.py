@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Décomposition du temps de chaque requête : DNS, connexion TCP, handshake TLS, TTFB, transfert.
+
+`requests` ne mesure qu'un temps global : impossible de distinguer le temps CPU de Keycloak du
+coût d'établissement des connexions (TLS en préprod HTTPS). Ce module fournit un client HTTP
+minimal (http.client + socket + ssl, stdlib) qui chronomètre chaque phase, et un agrégateur
+d'histogrammes par phase.
+
+Deux politiques de connexion (--connection) :
+  - fresh      : nouvelle connexion à chaque requête (comportement historique de requests.post) ;
+  - keep-alive : une connexion persistante par thread (DNS / connect / TLS payés une seule fois).
+
+Utilisé par keycloak_load_test.py et keycloak_load_test_multi_user.py (--timing, --connection).
+"""
+
+import http.client
+import socket
+import ssl
+import statistics
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import requests
+
+from keycloak_load_profile import percentile
+from keycloak_run_results import build_histogram
+
+CONNECTION_MODES = ("fresh", "keep-alive")
+PHASES = ("dns", "connect", "tls", "ttfb", "transfer", "total")
+
+
+class PhaseTimings(NamedTuple):
+    dns: float
+    connect: float
+    tls: float
+    ttfb: float
+    transfer: float
+    total: float
+    reused: bool
+
+
+_thread_state = threading.local()
+
+
+def thread_session() -> requests.Session:
+    """Session requests propre au thread courant (connexions keep-alive réutilisées)."""
+    session = getattr(_thread_state, "session", None)
+    if session is None:
+        session = requests.Session()
+        _thread_state.session = session
+    return session
+
+
+class TimedHttpClient:
+    """Client HTTP chronométré par phase ; en keep-alive, une connexion par thread."""
+
+    def __init__(self, base_url: str, keep_alive: bool, timeout: float) -> None:
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if self.https else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self._ssl_context = ssl.create_default_context() if self.https else None
+        self._local = threading.local()
+
+    def _connect(self) -> Tuple[http.client.HTTPConnection, float, float, float]:
+        """Ouvre une connexion ; retourne (connexion, dns, connect, tls) en secondes."""
+        t0 = time.perf_counter()
+        family, socktype, proto, _, addr = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0]
+        t1 = time.perf_counter()
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(self.timeout)
+        # http.client écrit en-têtes et corps séparément : sans TCP_NODELAY, Nagle + ACK retardé ajoutent ~40 ms en keep-alive
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.connect(addr)
+            t2 = time.perf_counter()
+            if self._ssl_context is not None:
+                sock = self._ssl_context.wrap_socket(sock, server_hostname=self.host)
+            t3 = time.perf_counter()
+        except OSError:
+            sock.close()
+            raise
+        # HTTPSConnection en https : port par défaut 443, donc en-tête Host identique à celui de requests
+        # (Keycloak dérive issuer et redirections de Host sans KC_HOSTNAME fixe)
+        if self._ssl_context is not None:
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.sock = sock
+        return conn, t1 - t0, t2 - t1, t3 - t2
+
+    def post_form(self, path: str, data: dict) -> Tuple[int, bytes, PhaseTimings]:
+        """POST application/x-www-form-urlencoded ; retourne (status, body, timings)."""
+        body = urlencode(data)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        for attempt in (0, 1):
+            start = time.perf_counter()
+            conn = getattr(self._local, "conn", None) if self.keep_alive else None
+            reused = conn is not None
+            dns = connect = tls = 0.0
+            if conn is None:
+                conn, dns, connect, tls = self._connect()
+            try:
+                t_send = time.perf_counter()
+                conn.request("POST", self.prefix + path, body=body, headers=headers)
+                resp = conn.getresponse()
+                t_first = time.perf_counter()
+                payload = resp.read()
+                t_end = time.perf_counter()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Connexion keep-alive fermée par le serveur entre deux requêtes : une seule reconnexion
+                conn.close()
+                self._local.conn = None
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                self._local.conn = None
+                raise
+            if self.keep_alive and not resp.will_close:
+                self._local.conn = conn
+            else:
+                conn.close()
+                self._local.conn = None
+            timings = PhaseTimings(dns, connect, tls, t_first - t_send, t_end - t_first, t_end - start, reused)
+            return resp.status, payload, timings
+        raise http.client.RemoteDisconnected("connexion fermée")
+
+
+class PhaseRecorder:
+    """Agrège les timings par phase (thread-safe) pour le rapport et l'artefact de résultats."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[float]] = {p: [] for p in PHASES}
+        self.new_connections = 0
+        self.requests = 0
+
+    def add(self, timings: PhaseTimings) -> None:
+        with self._lock:
+            for phase in PHASES:
+                self._samples[phase].append(getattr(timings, phase))
+            self.requests += 1
+            if not timings.reused:
+                self.new_connections += 1
+
+    def histograms(self) -> dict:
+        with self._lock:
+            return {
+                "phases": {p: build_histogram(v) for p, v in self._samples.items()},
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+            }
+
+    def print_report(self) -> None:
+        with self._lock:
+            if not self.requests:
+                return
+            print(f"     Phases (ms)      : {self.requests} requêtes, {self.new_connections} connexions ouvertes")
+            for phase in PHASES:
+                values = sorted(self._samples[phase])
+                p50, p95, p99 = (percentile(values, p) for p in (50, 95, 99))
+                print(f"       {phase:<9} avg={statistics.mean(values) * 1000:8.2f}  p50={p50 * 1000:8.2f}  "
+                      f"p95={p95 * 1000:8.2f}  p99={p99 * 1000:8.2f}")
+
+
+def timed_login(
+    client: TimedHttpClient,
+    recorder: PhaseRecorder,
+    realm: str,
+    username: str,
+    password: str,
+    client_id: str = "admin-cli",
+) -> Tuple[bool, float, Optional[str]]:
+    """Login password grant chronométré par phase ; même contrat que login() des testeurs."""
+    data = {
+        "client_id": client_id,
+        "username": username,
+        "password": password,
+        "grant_type": "password",
+    }
+    start = time.perf_counter()
+    try:
+        status, _, timings = client.post_form(f"/realms/{realm}/protocol/openid-connect/token", data)
+    except socket.timeout:
+        return False, time.perf_counter() - start, "timeout"
+    except (OSError, http.client.HTTPException) as e:
+        return False, time.perf_counter() - start, str(type(e).__name__)
+    recorder.add(timings)
+    if status == 200:
+        return True, timings.total, None
+    return False, timings.total, f"HTTP {status}"
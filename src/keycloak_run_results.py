@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Stockage des résultats de run et comparaison de régressions.
+
+Chaque run des outils de charge (keycloak_load_test.py, keycloak_load_test_multi_user.py,
+test_keycloak.py) écrit un artefact compact et versionné (JSON gzip) dans RESULTS_DIR (défaut : results/) :
+  - config du run (arguments, sans les mots de passe) ;
+  - empreinte d'environnement (hôte, Python, révision git, version Keycloak si disponible) ;
+  - histogramme de latence (buckets log, ~4 % de précision) et répartition des erreurs ;
+  - série temporelle par intervalle (1 s) : requêtes, erreurs, latence moyenne et p99 ;
+  - bornes des paliers (mode ramp / profile).
+
+Usage :
+  python keycloak_run_results.py show results/keycloak_load_test_20250101T120000.json.gz
+  python keycloak_run_results.py list [--dir results]
+  python keycloak_run_results.py compare BASE.json.gz CANDIDAT.json.gz [AUTRE ...] \\
+      --max-throughput-drop 5 --max-p99-increase 10 --max-error-rate-increase 0.5
+
+`compare` sort avec le code 1 si un candidat régresse au-delà des seuils de façon significative
+(test de Welch sur le débit par intervalle ; pour le p99, test de dépassement de queue : part des
+requêtes au-delà du p99 de référence, comparée entre les deux runs). Mann-Whitney sur les
+histogrammes est affiché à titre indicatif (décalage de toute la distribution).
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from keycloak_load_profile import percentile
+
+SCHEMA_VERSION = 1
+DEFAULT_RESULTS_DIR = os.environ.get(
+    "RESULTS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results"),
+)
+
+# Buckets log : borne haute du bucket k = HIST_MIN_SEC * HIST_RATIO ** k
+HIST_MIN_SEC = 0.0001
+HIST_RATIO = 2 ** (1 / 16)
+
+# Clés d'arguments jamais écrites dans l'artefact
+_SECRET_MARKERS = ("password", "secret", "token")
+
+
+# ── Histogramme ──────────────────────────────────────────────────────────────
+def bucket_index(value: float) -> int:
+    if value <= HIST_MIN_SEC:
+        return 0
+    return int(math.ceil(math.log(value / HIST_MIN_SEC, HIST_RATIO)))
+
+
+def bucket_upper(index: int) -> float:
+    return HIST_MIN_SEC * HIST_RATIO ** index
+
+
+def build_histogram(values: List[float]) -> Dict[str, object]:
+    """Histogramme compact : {"buckets": {index: count}, count, sum, min, max}."""
+    buckets: Dict[int, int] = {}
+    for v in values:
+        k = bucket_index(v)
+        buckets[k] = buckets.get(k, 0) + 1
+    return {
+        "min_sec": HIST_MIN_SEC,
+        "ratio": HIST_RATIO,
+        "buckets": {str(k): c for k, c in sorted(buckets.items())},
+        "count": len(values),
+        "sum": math.fsum(values),
+        "min": min(values) if values else 0.0,
+        "max": max(values) if values else 0.0,
+    }
+
+
+def histogram_percentile(hist: dict, p: float) -> float:
+    """Percentile approché (borne haute du bucket) depuis un histogramme d'artefact."""
+    count = hist.get("count") or 0
+    if count <= 0:
+        return 0.0
+    rank = max(1, int(math.ceil(count * p / 100)))
+    seen = 0
+    for k, c in sorted((int(k), c) for k, c in hist["buckets"].items()):
+        seen += c
+        if seen >= rank:
+            return min(hist["min_sec"] * hist["ratio"] ** k, hist.get("max") or float("inf"))
+    return hist.get("max") or 0.0
+
+
+# ── Construction de l'artefact ───────────────────────────────────────────────
+def build_intervals(results: List[tuple], start: float, end: float, interval: float = 1.0) -> List[dict]:
+    """Série temporelle : une entrée par intervalle (t relatif au début du run)."""
+    nb = max(1, int(math.ceil((end - start) / interval)))
+    slots: List[List[tuple]] = [[] for _ in range(nb)]
+    for r in results:
+        i = min(max(int((r[3] - start) / interval), 0), nb - 1)
+        slots[i].append(r)
+    series = []
+    for i, slot in enumerate(slots):
+        ok_lat = sorted(r[1] for r in slot if r[0])
+        series.append({
+            "t": round(i * interval, 3),
+            "requests": len(slot),
+            "errors": sum(1 for r in slot if not r[0]),
+            "mean": round(statistics.mean(ok_lat), 6) if ok_lat else None,
+            "p99": round(percentile(ok_lat, 99), 6) if ok_lat else None,
+        })
+    return series
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def fetch_keycloak_version(base_url: str, admin_user: str, admin_pass: str) -> Optional[str]:
+    """Version Keycloak via /admin/serverinfo (None si indisponible)."""
+    try:
+        import requests
+        r = requests.post(
+            f"{base_url}/realms/master/protocol/openid-connect/token",
+            data={"client_id": "admin-cli", "username": admin_user, "password": admin_pass, "grant_type": "password"},
+            timeout=10,
+        )
+        r.raise_for_status()
+        info = requests.get(
+            f"{base_url}/admin/serverinfo",
+            headers={"Authorization": f"Bearer {r.json()['access_token']}", "Accept": "application/json"},
+            timeout=10,
+        )
+        info.raise_for_status()
+        return (info.json().get("systemInfo") or {}).get("version")
+    except Exception:
+        return None
+
+
+def environment_fingerprint(keycloak_version: Optional[str] = None) -> dict:
+    return {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "git_revision": _git_revision(),
+        "keycloak_version": keycloak_version,
+    }
+
+
+def sanitize_config(config: dict) -> dict:
+    return {
+        k: v for k, v in config.items()
+        if not any(m in k.lower() for m in _SECRET_MARKERS)
+    }
+
+
+def build_run_record(
+    tool: str,
+    config: dict,
+    results: List[tuple],
+    start: float,
+    end: float,
+    marks: Optional[list] = None,
+    keycloak_version: Optional[str] = None,
+    extra: Optional[dict] = None,
+) -> dict:
+    """
+    Artefact d'un run. results : tuples (succès, latence_sec, erreur, instant_fin monotonic).
+    start / end / marks en temps monotonic (convertis en secondes relatives au début du run).
+    """
+    latencies = [r[1] for r in results if r[0]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r[0] and r[2]:
+            errors[r[2]] = errors.get(r[2], 0) + 1
+    elapsed = max(end - start, 1e-9)
+    total = len(results)
+    record = {
+        "schema_version": SCHEMA_VERSION,
+        "tool": tool,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": sanitize_config(config),
+        "environment": environment_fingerprint(keycloak_version),
+        "summary": {
+            "requests": total,
+            "ok": len(latencies),
+            "error_rate": (total - len(latencies)) / total if total else 0.0,
+            "duration_sec": round(elapsed, 3),
+            "throughput": total / elapsed,
+        },
+        "errors": errors,
+        "histogram": build_histogram(latencies),
+        "intervals": build_intervals(results, start, end),
+        "stages": [
+            {"name": m.name, "start": round(m.start - start, 3), "end": round(m.end - start, 3)}
+            for m in (marks or [])
+        ],
+    }
+    if extra:
+        record["extra"] = extra
+    return record
+
+
+def save_run(record: dict, results_dir: str = DEFAULT_RESULTS_DIR) -> Optional[str]:
+    """
+    Écrit l'artefact (JSON gzip). Retourne le chemin, ou None si l'écriture échoue.
+    Fichier créé en mode exclusif : deux runs terminés dans la même seconde obtiennent _2, _3, ...
+    """
+    stem = f"{record['tool']}_{time.strftime('%Y%m%dT%H%M%S')}"
+    path = os.path.join(results_dir, f"{stem}.json.gz")
+    try:
+        os.makedirs(results_dir, exist_ok=True)
+        for attempt in range(1, 1000):
+            path = os.path.join(results_dir, f"{stem}.json.gz" if attempt == 1 else f"{stem}_{attempt}.json.gz")
+            try:
+                raw = open(path, "xb")
+            except FileExistsError:
+                continue
+            with raw, gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                gz.write(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+            return path
+        raise FileExistsError(f"trop d'artefacts {stem}_*")
+    except OSError as e:
+        print(f"  ⚠ Résultats non enregistrés ({path}) : {e}", file=sys.stderr)
+        return None
+
+
+def load_run(path: str) -> dict:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        record = json.load(f)
+    version = record.get("schema_version")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"{path} : schema_version {version} non supportée (attendu {SCHEMA_VERSION})")
+    return record
+
+
+# ── Comparaison ──────────────────────────────────────────────────────────────
+def _normal_two_sided_p(z: float) -> float:
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def welch_p_value(a: List[float], b: List[float]) -> float:
+    """p-value bilatérale (approximation normale) du test de Welch sur les moyennes."""
+    if len(a) < 2 or len(b) < 2:
+        return 1.0
+    va, vb = statistics.variance(a), statistics.variance(b)
+    se = math.sqrt(va / len(a) + vb / len(b))
+    if se == 0:
+        return 0.0 if statistics.mean(a) != statistics.mean(b) else 1.0
+    return _normal_two_sided_p((statistics.mean(b) - statistics.mean(a)) / se)
+
+
+def mann_whitney_p_value(hist_a: dict, hist_b: dict) -> float:
+    """p-value bilatérale de Mann-Whitney calculée sur deux histogrammes (ex-aequo = même bucket)."""
+    na, nb = hist_a.get("count") or 0, hist_b.get("count") or 0
+    if na == 0 or nb == 0:
+        return 1.0
+    a = {int(k): c for k, c in hist_a["buckets"].items()}
+    b = {int(k): c for k, c in hist_b["buckets"].items()}
+    u = 0.0
+    b_below = 0
+    for k in sorted(set(a) | set(b)):
+        ca, cb = a.get(k, 0), b.get(k, 0)
+        u += ca * (b_below + 0.5 * cb)
+        b_below += cb
+    mean_u = na * nb / 2
+    sd_u = math.sqrt(na * nb * (na + nb + 1) / 12)
+    return _normal_two_sided_p((u - mean_u) / sd_u) if sd_u > 0 else 1.0
+
+
+def tail_exceedance_p_value(hist_a: dict, hist_b: dict, p: float = 99) -> float:
+    """
+    p-value bilatérale d'un test de queue : proportion de latences au-delà du bucket du p-ième
+    percentile de hist_a, dans chaque run (test z de deux proportions). Sensible à une dégradation
+    du p99 même si la médiane ne bouge pas, contrairement à Mann-Whitney.
+    """
+    na, nb = hist_a.get("count") or 0, hist_b.get("count") or 0
+    if na == 0 or nb == 0:
+        return 1.0
+    threshold = bucket_index(histogram_percentile(hist_a, p))
+    xa = sum(c for k, c in hist_a["buckets"].items() if int(k) > threshold)
+    xb = sum(c for k, c in hist_b["buckets"].items() if int(k) > threshold)
+    pooled = (xa + xb) / (na + nb)
+    se = math.sqrt(pooled * (1 - pooled) * (1 / na + 1 / nb))
+    if se == 0:
+        return 1.0
+    return _normal_two_sided_p((xb / nb - xa / na) / se)
+
+
+def _interval_rates(record: dict) -> List[float]:
+    intervals = record.get("intervals") or []
+    # Le dernier intervalle est souvent partiel (arrêt des threads) : exclu s'il y en a d'autres
+    if len(intervals) > 2:
+        intervals = intervals[:-1]
+    return [float(i["requests"]) for i in intervals]
+
+
+def _pct_change(base: float, cand: float) -> float:
+    return (cand - base) / base * 100 if base else 0.0
+
+
+def compare_runs(
+    base: dict,
+    cand: dict,
+    max_throughput_drop: float,
+    max_p99_increase: float,
+    max_error_rate_increase: float,
+    alpha: float,
+) -> Tuple[List[str], List[str]]:
+    """Retourne (lignes du rapport, régressions détectées)."""
+    lines = []
+    regressions = []
+    bs, cs = base["summary"], cand["summary"]
+
+    d_tp = _pct_change(bs["throughput"], cs["throughput"])
+    p_tp = welch_p_value(_interval_rates(base), _interval_rates(cand))
+    lines.append(f"     Débit (req/s)  : {bs['throughput']:10.1f} → {cs['throughput']:10.1f}  ({d_tp:+.1f} %, p={p_tp:.3g})")
+    if -d_tp > max_throughput_drop and p_tp < alpha:
+        regressions.append(f"débit {d_tp:+.1f} % (seuil -{max_throughput_drop} %)")
+
+    p_lat = mann_whitney_p_value(base["histogram"], cand["histogram"])
+    p_tail = tail_exceedance_p_value(base["histogram"], cand["histogram"], 99)
+    for p in (50, 95, 99):
+        b_val = histogram_percentile(base["histogram"], p)
+        c_val = histogram_percentile(cand["histogram"], p)
+        d = _pct_change(b_val, c_val)
+        lines.append(f"     Latence p{p:<3}   : {b_val:10.4f} → {c_val:10.4f}  ({d:+.1f} %" + (f", queue p={p_tail:.3g})" if p == 99 else ")"))
+        if p == 99 and d > max_p99_increase and p_tail < alpha:
+            regressions.append(f"latence p99 {d:+.1f} % (seuil +{max_p99_increase} %)")
+    lines.append(f"     Distribution latence : Mann-Whitney p={p_lat:.3g}")
+
+    d_err = (cs["error_rate"] - bs["error_rate"]) * 100
+    lines.append(f"     Taux d'erreur  : {bs['error_rate'] * 100:9.2f} % → {cs['error_rate'] * 100:9.2f} %  ({d_err:+.2f} pts)")
+    if d_err > max_error_rate_increase:
+        regressions.append(f"taux d'erreur {d_err:+.2f} pts (seuil +{max_error_rate_increase} pts)")
+    return lines, regressions
+
+
+def _load_comparable(path: str) -> Optional[dict]:
+    """Artefact comparable (lisible, histogramme non vide) ; None avec un message sinon."""
+    try:
+        record = load_run(path)
+    except (OSError, ValueError) as e:
+        print(f"  ⚠ {path} : illisible ({e})", file=sys.stderr)
+        return None
+    if not (record.get("histogram") or {}).get("count"):
+        # Ex. keycloak_jwt_benchmark : mesures dans extra, pas de latences par requête
+        print(f"  ⚠ {path} ({record.get('tool')}) : histogramme de latence vide, comparaison impossible", file=sys.stderr)
+        return None
+    return record
+
+
+def _describe(path: str, record: dict) -> str:
+    env = record.get("environment") or {}
+    kc = env.get("keycloak_version") or "?"
+    return f"{os.path.basename(path)} ({record['tool']}, {record['created_at']}, Keycloak {kc})"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Résultats de runs : affichage et comparaison de régressions")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_show = sub.add_parser("show", help="Afficher le résumé d'un artefact")
+    p_show.add_argument("path")
+
+    p_list = sub.add_parser("list", help="Lister les artefacts d'un répertoire")
+    p_list.add_argument("--dir", default=DEFAULT_RESULTS_DIR, help="Répertoire des résultats (défaut: RESULTS_DIR ou results/)")
+
+    p_cmp = sub.add_parser("compare", help="Comparer un run de référence à un ou plusieurs candidats")
+    p_cmp.add_argument("paths", nargs="+", metavar="PATH", help="Référence puis candidats")
+    p_cmp.add_argument("--max-throughput-drop", type=float, default=5.0, metavar="PCT", help="Baisse de débit tolérée en %% (défaut: 5)")
+    p_cmp.add_argument("--max-p99-increase", type=float, default=10.0, metavar="PCT", help="Hausse de p99 tolérée en %% (défaut: 10)")
+    p_cmp.add_argument("--max-error-rate-increase", type=float, default=0.5, metavar="PTS", help="Hausse du taux d'erreur tolérée en points (défaut: 0.5)")
+    p_cmp.add_argument("--alpha", type=float, default=0.05, help="Seuil de significativité (défaut: 0.05)")
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        try:
+            record = load_run(args.path)
+        except (OSError, ValueError) as e:
+            print(f"{args.path} : illisible ({e})", file=sys.stderr)
+            return 2
+        s = record["summary"]
+        h = record["histogram"]
+        print(_describe(args.path, record))
+        print(f"  Requêtes : {s['requests']}  succès : {s['ok']}  erreurs : {s['error_rate'] * 100:.2f} %")
+        print(f"  Durée : {s['duration_sec']:.1f} s  débit : {s['throughput']:.1f} req/s")
+        print(f"  Latence : p50={histogram_percentile(h, 50):.4f}  p95={histogram_percentile(h, 95):.4f}  p99={histogram_percentile(h, 99):.4f}")
+        for st in record.get("stages") or []:
+            print(f"  Palier {st['name']} : {st['start']:.1f}s → {st['end']:.1f}s")
+        return 0
+
+    if args.command == "list":
+        if not os.path.isdir(args.dir):
+            print(f"Aucun résultat ({args.dir} introuvable)")
+            return 0
+        for name in sorted(os.listdir(args.dir)):
+            if not name.endswith((".json", ".json.gz")):
+                continue
+            path = os.path.join(args.dir, name)
+            try:
+                record = load_run(path)
+            except (OSError, ValueError) as e:
+                print(f"  {name} : illisible ({e})")
+                continue
+            s = record["summary"]
+            print(f"  {name}  {s['throughput']:8.1f} req/s  p99={histogram_percentile(record['histogram'], 99):.4f}  err={s['error_rate'] * 100:.2f} %")
+        return 0
+
+    if len(args.paths) < 2:
+        parser.error("compare requiert au moins deux artefacts (référence puis candidat(s))")
+    base = _load_comparable(args.paths[0])
+    if base is None:
+        return 2
+    print("=" * 60)
+    print(f"  Référence : {_describe(args.paths[0], base)}")
+    failed = False
+    unusable = False
+    for path in args.paths[1:]:
+        cand = _load_comparable(path)
+        if cand is None:
+            unusable = True
+            continue
+        print("-" * 60)
+        print(f"  Candidat  : {_describe(path, cand)}")
+        lines, regressions = compare_runs(
+            base, cand, args.max_throughput_drop, args.max_p99_increase, args.max_error_rate_increase, args.alpha
+        )
+        for line in lines:
+            print(line)
+        if regressions:
+            failed = True
+            print(f"  ❌ Régression : {', '.join(regressions)}")
+        else:
+            print("  ✅ Pas de régression significative")
+    print("=" * 60)
+    if unusable:
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,18 +5,54 @@ Exporteur Prometheus pour les sessions Keycloak (API Admin REST).
 Expose :
   - keycloak_sessions_total{client_id="..."} : nombre de sessions actives par client
   - keycloak_distinct_users_connected : nombre de comptes (userId) distincts ayant au moins une session
-  - keycloak_session_duration_seconds{user_id="...", username="..."} : durée en secondes de la session (utilisateurs connectés)
+    (ensemble exact, puis HyperLogLog au-delà de EXPORTER_DISTINCT_EXACT_LIMIT : mémoire bornée,
+    erreur relative EXPORTER_DISTINCT_ERROR) ; par client avec EXPORTER_DISTINCT_BY_CLIENT=1
+  - keycloak_sessions_listed{client_id="..."} : sessions effectivement listées par le parcours des pages
+  - keycloak_active_session_duration_seconds (histogramme _bucket/_sum/_count) : âge de toutes les sessions
+    parcourues, éventuellement par client (EXPORTER_DURATION_BY_CLIENT=1) ; histogramme du realm : une
+    session SSO vue par plusieurs clients n'est comptée qu'une fois
+  - keycloak_session_duration_seconds{user_id="...", username="..."} : durée par session (100 au plus),
+    seulement avec EXPORTER_SESSION_DURATION_SERIES=1
   - keycloak_last_login_timestamp_seconds{user_id="...", username="...", email="..."} : timestamp (epoch s) des dernières connexions (événements LOGIN)
+  - keycloak_events_total{type="...", client_id="...", error="..."} : compteurs d'événements (LOGIN, LOGIN_ERROR,
+    REFRESH_TOKEN, ...) alimentés par un curseur temporel : seuls les événements nouveaux depuis la collecte
+    précédente sont lus (rate() / increase() dans Grafana)
 
 À lancer en service HTTP sur le port 9091 ; Prometheus scrape /metrics.
+La collecte tourne en tâche de fond toutes les EXPORTER_COLLECT_INTERVAL secondes (défaut 15) :
+/metrics sert instantanément le dernier snapshot, avec son âge et un indicateur d'obsolescence
+(EXPORTER_STALE_AFTER, défaut 3 intervalles). EXPORTER_COLLECT_INTERVAL=0 : collecte à chaque scrape.
+Les pages de sessions sont lues en parallèle entre clients (EXPORTER_CRAWL_WORKERS, session HTTP
+partagée) dans un budget de temps par collecte (EXPORTER_COLLECT_BUDGET) : au-delà, les métriques
+sont servies partielles (keycloak_session_exporter_partial 1) plutôt que remplacées par des zéros.
+Plusieurs realms : EXPORTER_REALMS="a,b,c" ou "*" (découverte via /admin/realms), collectés en parallèle
+(EXPORTER_REALM_WORKERS) avec un seul token admin ; chaque série porte le label realm.
+Auto-instrumentation : latence des appels à l'API Admin par endpoint (histogramme), appels par statut
+HTTP, octets reçus, appels et octets de la dernière collecte (keycloak_session_exporter_api_*).
+Serveur HTTP multi-thread (/health jamais bloqué par un scrape) ; les scrapes simultanés partagent
+le même rendu (single-flight) ; réponse gzip si Accept-Encoding le permet, format OpenMetrics si
+Accept: application/openmetrics-text.
+EXPORTER_BACKEND=postgres : mêmes métriques calculées par requêtes d'agrégat sur la base Keycloak 25+
+(sessions persistantes, event_entity) au lieu du parcours REST, voir keycloak_pg_source.py.
+EXPORTER_EVENTS_SOURCE=log : événements lus en continu dans les logs JSON de Keycloak (listener
+jboss-logging, fichier EXPORTER_EVENT_LOG ou "-" pour stdin) au lieu du polling de /events ;
+compteurs à jour à chaque scrape, pics par seconde (keycloak_events_peak_per_second), voir
+keycloak_event_tail.py.
 Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD.
 """
 
+import bisect
+import gzip
+import hashlib
+import math
 import os
 import sys
+import threading
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import List, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
 from urllib.parse import urlparse
 
 try:
@@ -27,7 +63,9 @@ try:
 except ImportError:
     pass
 
-import requests
+from keycloak_admin_utils import api_request, configure_api, fetch_client_session_stats
+from keycloak_event_tail import LAG_BUCKETS as EVENT_LOG_LAG_BUCKETS, EventLogTailer
+from keycloak_pg_source import EVENTS_LAG_MS, POOL_SIZE as PG_POOL_SIZE, PostgresSource
 
 _DEFAULT_PORT = os.environ.get("KEYCLOAK_PORT", "8080")
 DEFAULT_URL = os.environ.get("KEYCLOAK_URL", f"http://localhost:{_DEFAULT_PORT}").rstrip("/")
@@ -37,12 +75,93 @@ DEFAULT_ADMIN_PASS = os.environ.get("KEYCLOAK_ADMIN_PASSWORD", "admin")
 EXPORTER_PORT = int(os.environ.get("EXPORTER_PORT", "9091"))
 USER_SESSIONS_PAGE_SIZE = 500
 MAX_SESSION_DURATION_SERIES = 100  # limite cardinalité
-MAX_LAST_LOGIN_EVENTS = 25
+SESSION_DURATION_SERIES = os.environ.get("EXPORTER_SESSION_DURATION_SERIES", "0") == "1"
+DURATION_BY_CLIENT = os.environ.get("EXPORTER_DURATION_BY_CLIENT", "0") == "1"
+DURATION_BUCKETS = tuple(
+    float(b) for b in os.environ.get("EXPORTER_DURATION_BUCKETS", "60,300,900,1800,3600,7200,14400,28800,86400").split(",")
+)
+# Comptes distincts : ensemble exact jusqu'à EXPORTER_DISTINCT_EXACT_LIMIT userIds, puis HyperLogLog
+DISTINCT_MODE = os.environ.get("EXPORTER_DISTINCT_MODE", "auto").strip().lower()  # auto | exact | hll
+DISTINCT_EXACT_LIMIT = int(os.environ.get("EXPORTER_DISTINCT_EXACT_LIMIT", "10000"))
+DISTINCT_ERROR = float(os.environ.get("EXPORTER_DISTINCT_ERROR", "0.01"))
+DISTINCT_BY_CLIENT = os.environ.get("EXPORTER_DISTINCT_BY_CLIENT", "0") == "1"
+MAX_LAST_LOGIN_EVENTS = int(os.environ.get("EXPORTER_LAST_LOGIN_EVENTS", "25"))
+USER_CACHE_SIZE = int(os.environ.get("EXPORTER_USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = float(os.environ.get("EXPORTER_USER_CACHE_TTL", "300"))
+EVENT_TYPES = tuple(
+    t.strip()
+    for t in os.environ.get(
+        "EXPORTER_EVENT_TYPES", "LOGIN,LOGIN_ERROR,REFRESH_TOKEN,REFRESH_TOKEN_ERROR,CODE_TO_TOKEN,LOGOUT"
+    ).split(",")
+    if t.strip()
+)
+EVENTS_PAGE_SIZE = 500
+EVENTS_MAX_PAGES = int(os.environ.get("EXPORTER_EVENTS_MAX_PAGES", "20"))
+COLLECT_INTERVAL = float(os.environ.get("EXPORTER_COLLECT_INTERVAL", "15"))
+STALE_AFTER = float(os.environ.get("EXPORTER_STALE_AFTER", str(3 * COLLECT_INTERVAL)))
+CRAWL_WORKERS = int(os.environ.get("EXPORTER_CRAWL_WORKERS", "4"))
+REALM_WORKERS = int(os.environ.get("EXPORTER_REALM_WORKERS", "4"))
+API_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COLLECT_BUDGET = float(os.environ.get("EXPORTER_COLLECT_BUDGET", "10"))
+BACKEND = os.environ.get("EXPORTER_BACKEND", "rest").strip().lower()  # rest | postgres
+EVENTS_SOURCE = os.environ.get("EXPORTER_EVENTS_SOURCE", "api").strip().lower()  # api | log
+EVENT_LOG = os.environ.get("EXPORTER_EVENT_LOG", "-")
+EVENT_LOG_FROM_START = os.environ.get("EXPORTER_EVENT_LOG_FROM_START", "0") == "1"
+
+
+class ApiStats:
+    """
+    Auto-instrumentation des appels sortants vers Keycloak : latence (histogramme par endpoint),
+    nombre d'appels par endpoint et statut HTTP, octets reçus. Cumulés depuis le démarrage.
+    """
+
+    def __init__(self, buckets: tuple = API_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, list] = {}  # endpoint -> [buckets..., +Inf, somme]
+        self.requests: Dict[tuple, int] = {}  # (endpoint, statut) -> n
+        self.bytes: Dict[str, int] = {}
+
+    def record(self, endpoint: str, status: str, duration: float, size: int) -> None:
+        with self._lock:
+            hist = self.histograms.get(endpoint)
+            if hist is None:
+                hist = self.histograms[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+            hist[bisect.bisect_left(self.buckets, duration)] += 1
+            hist[-1] += duration
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+
+    def totals(self) -> tuple:
+        """(appels, octets reçus) depuis le démarrage : différence avant / après = charge d'une collecte."""
+        with self._lock:
+            return sum(self.requests.values()), sum(self.bytes.values())
+
+    def metric_lines(self) -> List[str]:
+        with self._lock:
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+            requests_by_status = dict(self.requests)
+            received = dict(self.bytes)
+        lines = histogram_lines("keycloak_session_exporter_api_request_duration_seconds", histograms, "endpoint", self.buckets)
+        lines.append("# TYPE keycloak_session_exporter_api_requests_total counter")
+        for (endpoint, status), count in sorted(requests_by_status.items()):
+            lines.append(f'keycloak_session_exporter_api_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines.append("# TYPE keycloak_session_exporter_api_response_bytes_total counter")
+        for endpoint, size in sorted(received.items()):
+            lines.append(f'keycloak_session_exporter_api_response_bytes_total{{endpoint="{endpoint}"}} {size}')
+        return lines
+
+
+_api_stats = ApiStats()
+# Appels Keycloak (keycloak_admin_utils.api_request) mesurés dans _api_stats ; pool dimensionné pour les parcours parallèles
+configure_api(max(CRAWL_WORKERS, 1) * max(REALM_WORKERS, 1) + 2, _api_stats.record)
 
 
 def get_admin_token(base_url: str, admin_user: str, admin_pass: str) -> Optional[str]:
     try:
-        r = requests.post(
+        r = api_request(
+            "token",
+            "POST",
             f"{base_url}/realms/master/protocol/openid-connect/token",
             data={
                 "client_id": "admin-cli",
@@ -63,49 +182,51 @@ def get_admin_token(base_url: str, admin_user: str, admin_pass: str) -> Optional
         return None
 
 
-def fetch_client_session_stats(base_url: str, realm: str, token: str):
-    """Retourne soit un dict {client_id: count} (format Keycloak récent), soit une list de {id, clientId, active} (ancien)."""
+def fetch_clients(base_url: str, realm: str, token: str) -> Optional[List[dict]]:
+    """Liste des clients du realm (id, clientId) pour résoudre clientId -> UUID."""
     try:
-        r = requests.get(
-            f"{base_url}/admin/realms/{realm}/client-session-stats",
+        r = api_request(
+            "clients",
+            "GET",
+            f"{base_url}/admin/realms/{realm}/clients",
             headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
             timeout=15,
         )
         r.raise_for_status()
-        data = r.json()
-        return data
-    except Exception as e:
-        err = getattr(e, "response", None)
-        if err is not None:
-            print(f"keycloak_session_exporter: fetch_client_session_stats {err.status_code} {err.text[:200]}", file=sys.stderr)
-        else:
-            print(f"keycloak_session_exporter: fetch_client_session_stats error: {e}", file=sys.stderr)
+        return r.json()
+    except Exception:
         return None
 
 
-def fetch_clients(base_url: str, realm: str, token: str) -> Optional[List[dict]]:
-    """Liste des clients du realm (id, clientId) pour résoudre clientId -> UUID."""
+def fetch_realms(base_url: str, token: str) -> Optional[List[str]]:
+    """Noms des realms actifs visibles par l'admin (découverte, EXPORTER_REALMS=*)."""
     try:
-        r = requests.get(
-            f"{base_url}/admin/realms/{realm}/clients",
+        r = api_request(
+            "realms",
+            "GET",
+            f"{base_url}/admin/realms",
+            params={"briefRepresentation": "true"},
             headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
             timeout=15,
         )
         r.raise_for_status()
-        return r.json()
-    except Exception:
+        return [realm["realm"] for realm in r.json() if realm.get("realm") and realm.get("enabled", True)]
+    except Exception as e:
+        print(f"keycloak_session_exporter: fetch_realms error: {e}", file=sys.stderr)
         return None
 
 
 def fetch_user_sessions_page(
-    base_url: str, realm: str, client_uuid: str, token: str, first: int, max_count: int
+    base_url: str, realm: str, client_uuid: str, token: str, first: int, max_count: int, timeout: float = 15
 ) -> Optional[List[dict]]:
     try:
-        r = requests.get(
+        r = api_request(
+            "user-sessions",
+            "GET",
             f"{base_url}/admin/realms/{realm}/clients/{client_uuid}/user-sessions",
             params={"first": first, "max": max_count},
             headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
-            timeout=15,
+            timeout=timeout,
         )
         r.raise_for_status()
         return r.json()
@@ -113,16 +234,28 @@ def fetch_user_sessions_page(
         return None
 
 
-def fetch_events(
-    base_url: str, realm: str, token: str, event_type: str = "LOGIN", max_events: int = 20
+def fetch_events_page(
+    base_url: str,
+    realm: str,
+    token: str,
+    event_types: tuple,
+    first: int,
+    max_events: int,
+    date_from: Optional[str] = None,
+    timeout: float = 15,
 ) -> Optional[List[dict]]:
-    """Derniers événements (ex. LOGIN). Tri décroissant par time."""
+    """Page d'événements des types donnés, du plus récent au plus ancien (dateFrom : yyyy-MM-dd)."""
+    params = {"type": list(event_types), "first": first, "max": max_events}
+    if date_from:
+        params["dateFrom"] = date_from
     try:
-        r = requests.get(
+        r = api_request(
+            "events",
+            "GET",
             f"{base_url}/admin/realms/{realm}/events",
-            params={"type": event_type, "max": max_events, "orderBy": "time", "sortOrder": "desc"},
+            params=params,
             headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
-            timeout=15,
+            timeout=timeout,
         )
         r.raise_for_status()
         return r.json()
@@ -133,7 +266,9 @@ def fetch_events(
 def fetch_user(base_url: str, realm: str, token: str, user_id: str) -> Optional[dict]:
     """Détails d'un utilisateur (username, email)."""
     try:
-        r = requests.get(
+        r = api_request(
+            "users",
+            "GET",
             f"{base_url}/admin/realms/{realm}/users/{user_id}",
             headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
             timeout=5,
@@ -144,78 +279,437 @@ def fetch_user(base_url: str, realm: str, token: str, user_id: str) -> Optional[
         return None
 
 
-def collect_distinct_user_ids(
-    base_url: str,
-    realm: str,
-    token: str,
-    client_id_to_uuid: dict,
-    client_id_to_count: dict,
-) -> set:
-    """client_id_to_count: {clientId: count}. client_id_to_uuid: {clientId: uuid}."""
-    user_ids = set()
-    for client_id, count in client_id_to_count.items():
-        if (count or 0) <= 0:
+class UserCache:
+    """Cache borné (LRU + TTL) des détails utilisateur (username, email) pour l'enrichissement des logins."""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # (realm, user_id) -> (expire_monotonic, user)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, realm: str, user_id: str) -> Optional[dict]:
+        key = (realm, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, realm: str, user_id: str, user: dict) -> None:
+        with self._lock:
+            self._entries[(realm, user_id)] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end((realm, user_id))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def metric_lines(self) -> List[str]:
+        with self._lock:
+            return [
+                "# TYPE keycloak_session_exporter_user_cache_hits_total counter",
+                f"keycloak_session_exporter_user_cache_hits_total {self.hits}",
+                "# TYPE keycloak_session_exporter_user_cache_misses_total counter",
+                f"keycloak_session_exporter_user_cache_misses_total {self.misses}",
+                f"keycloak_session_exporter_user_cache_size {len(self._entries)}",
+            ]
+
+
+_user_cache = UserCache()
+
+
+def resolve_users(base_url: str, realm: str, token: str, events: List[dict], deadline: float) -> tuple:
+    """
+    {user_id: {"username", "email"}} pour les événements : cache (username et email), sinon username des
+    détails de l'événement (sans appel, email vide), sinon GET /users/{id} en parallèle pour les seuls
+    manquants. Retourne (users, sautés).
+    """
+    users = {}
+    misses = set()
+    for evt in events:
+        user_id = evt.get("userId")
+        if not user_id or user_id in users or user_id in misses:
+            continue
+        cached = _user_cache.get(realm, user_id)
+        if cached is not None:
+            users[user_id] = cached
             continue
-        client_uuid = client_id_to_uuid.get(client_id)
-        if not client_uuid:
+        username = (evt.get("details") or {}).get("username")
+        if username:
+            users[user_id] = {"username": username, "email": ""}
             continue
+        misses.add(user_id)
+    if not misses:
+        return users, 0
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return users, len(misses)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(CRAWL_WORKERS, len(misses))), thread_name_prefix="users")
+    futures = {pool.submit(fetch_user, base_url, realm, token, user_id): user_id for user_id in misses}
+    done, pending = wait(futures, timeout=remaining)
+    pool.shutdown(wait=False, cancel_futures=True)
+    for future in done:
+        user = future.result()
+        if user:
+            entry = {"username": user.get("username") or "", "email": user.get("email") or ""}
+            _user_cache.put(realm, futures[future], entry)
+            users[futures[future]] = entry
+    return users, len(pending)
+
+
+class EventTracker:
+    """
+    Curseur temporel sur /events d'un realm : chaque collecte ne lit que les événements postérieurs au
+    curseur (pages triées du plus récent au plus ancien, arrêt au curseur) et incrémente des compteurs
+    monotones par (type, client, erreur). Les derniers LOGIN sont conservés pour le gauge des dernières
+    connexions. À la première collecte, le curseur est positionné sans compter l'historique.
+    """
+
+    def __init__(self, realm: str) -> None:
+        self.realm = realm
+        self.cursor_ms: Optional[int] = None
+        self._cursor_keys: set = set()  # événements déjà comptés à l'instant du curseur
+        self.counts: Dict[tuple, int] = {}
+        self.recent_logins: deque = deque(maxlen=MAX_LAST_LOGIN_EVENTS)
+        self.gaps = 0
+        self.pages = 0
+
+    @staticmethod
+    def _key(evt: dict):
+        return evt.get("id") or (evt.get("time"), evt.get("type"), evt.get("userId"), evt.get("sessionId"), evt.get("clientId"))
+
+    def _is_seen(self, evt: dict) -> bool:
+        t = int(evt.get("time") or 0)
+        return t < self.cursor_ms or (t == self.cursor_ms and self._key(evt) in self._cursor_keys)
+
+    def _advance(self, events: List[dict]) -> None:
+        newest = max(int(e.get("time") or 0) for e in events)
+        keys = {self._key(e) for e in events if int(e.get("time") or 0) == newest}
+        if newest == self.cursor_ms:
+            self._cursor_keys |= keys
+        elif self.cursor_ms is None or newest > self.cursor_ms:
+            self.cursor_ms = newest
+            self._cursor_keys = keys
+
+    def _record(self, events: List[dict]) -> None:
+        # events du plus récent au plus ancien : les LOGIN sont ajoutés du plus ancien au plus récent
+        for evt in reversed(events):
+            key = (evt.get("type") or "", evt.get("clientId") or "", evt.get("error") or "")
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if evt.get("type") == "LOGIN":
+                self.recent_logins.append(evt)
+
+    def poll(self, base_url: str, token: str, deadline: float) -> bool:
+        """Lit les nouveaux événements ; False si la lecture est incomplète (erreur, budget, plafond de pages)."""
+        self.pages = 0
+        if self.cursor_ms is None:
+            page = fetch_events_page(base_url, self.realm, token, EVENT_TYPES, 0, EVENTS_PAGE_SIZE)
+            if page is None:
+                return False
+            self.pages = 1
+            logins = [e for e in page if e.get("type") == "LOGIN"]
+            self.recent_logins.extend(reversed(logins[:MAX_LAST_LOGIN_EVENTS]))
+            self.cursor_ms = 0
+            if page:
+                self._advance(page)
+            return True
+
+        date_from = time.strftime("%Y-%m-%d", time.gmtime(self.cursor_ms / 1000)) if self.cursor_ms else None
+        new: List[dict] = []
         first = 0
-        while True:
-            page = fetch_user_sessions_page(
-                base_url, realm, client_uuid, token, first, USER_SESSIONS_PAGE_SIZE
+        complete = False
+        while self.pages < EVENTS_MAX_PAGES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            page = fetch_events_page(
+                base_url, self.realm, token, EVENT_TYPES, first, EVENTS_PAGE_SIZE, date_from, timeout=min(15, remaining)
             )
-            if not page:
+            if page is None:
                 break
-            for sess in page:
-                uid = sess.get("userId")
-                if uid:
-                    user_ids.add(uid)
-            if len(page) < USER_SESSIONS_PAGE_SIZE:
+            self.pages += 1
+            reached = False
+            for evt in page:
+                if self._is_seen(evt):
+                    reached = True
+                    break
+                new.append(evt)
+            if reached or len(page) < EVENTS_PAGE_SIZE:
+                complete = True
                 break
-            first += USER_SESSIONS_PAGE_SIZE
-    return user_ids
+            first += EVENTS_PAGE_SIZE
+        if new:
+            # Lecture interrompue avant le curseur : les événements intermédiaires sont perdus (trou compté)
+            self._record(new)
+            self._advance(new)
+        if not complete and new:
+            self.gaps += 1
+        return complete
+
+    def add_counts(self, counts: Dict[tuple, int], cursor_ms: int) -> None:
+        """Compteurs déjà agrégés jusqu'à cursor_ms (source Postgres) ; le premier appel ne fait que positionner le curseur."""
+        if self.cursor_ms is not None:
+            for key, count in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + count
+        self.cursor_ms = cursor_ms
+        self.pages = 1
+
+    def latest_logins(self) -> List[dict]:
+        """Derniers LOGIN, du plus récent au plus ancien."""
+        return list(reversed(self.recent_logins))
+
+    def metric_lines(self) -> List[str]:
+        lines = ["# TYPE keycloak_events_total counter"]
+        for (event_type, client_id, error), count in sorted(self.counts.items()):
+            lines.append(
+                f'keycloak_events_total{{type="{escape_prometheus_label(event_type)}",'
+                f'client_id="{escape_prometheus_label(client_id)}",error="{escape_prometheus_label(error)}"}} {count}'
+            )
+        lines.append(f"keycloak_session_exporter_event_pages {self.pages}")
+        lines.append("# TYPE keycloak_session_exporter_event_gaps_total counter")
+        lines.append(f"keycloak_session_exporter_event_gaps_total {self.gaps}")
+        return lines
+
+
+_event_trackers: Dict[str, EventTracker] = {}
+
+
+def event_tracker(realm: str) -> EventTracker:
+    if realm not in _event_trackers:
+        _event_trackers[realm] = EventTracker(realm)
+    return _event_trackers[realm]
+
+
+class HyperLogLog:
+    """
+    Estimateur HyperLogLog (hash 64 bits, 2^precision registres d'un octet) : mémoire fixe quel que
+    soit le nombre d'éléments, erreur relative typique 1.04 / sqrt(2^precision).
+    """
+
+    def __init__(self, precision: int) -> None:
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @staticmethod
+    def precision_for(error: float) -> int:
+        """Plus petite précision (4..18) dont l'erreur type est <= error."""
+        return min(18, max(4, math.ceil(math.log2((1.04 / max(error, 1e-4)) ** 2))))
+
+    @property
+    def error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value: str) -> None:
+        x = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        idx = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # correction petites cardinalités (linear counting)
+        return int(round(estimate))
+
+
+class DistinctCounter:
+    """
+    Comptage de userIds distincts : ensemble exact tant que la population est petite, bascule en
+    HyperLogLog au-delà de `exact_limit` (mode "auto") ; "exact" et "hll" forcent l'un ou l'autre.
+    """
+
+    def __init__(self, mode: str = DISTINCT_MODE, exact_limit: int = DISTINCT_EXACT_LIMIT, error: float = DISTINCT_ERROR) -> None:
+        self.mode = mode
+        self.exact_limit = exact_limit
+        self.error = error
+        self._exact: Optional[set] = set() if mode != "hll" else None
+        self._hll: Optional[HyperLogLog] = None if mode != "hll" else HyperLogLog(HyperLogLog.precision_for(error))
 
+    @property
+    def approximate(self) -> bool:
+        return self._hll is not None
 
-def collect_sessions_with_duration(
+    def add(self, value: str) -> None:
+        if self._hll is not None:
+            self._hll.add(value)
+            return
+        self._exact.add(value)
+        if self.mode == "auto" and len(self._exact) > self.exact_limit:
+            self._hll = HyperLogLog(HyperLogLog.precision_for(self.error))
+            for v in self._exact:
+                self._hll.add(v)
+            self._exact = None
+
+    def count(self) -> int:
+        return self._hll.count() if self._hll is not None else len(self._exact)
+
+    def error_bound(self) -> float:
+        """Erreur relative type de l'estimation (0 en mode exact)."""
+        return self._hll.error if self._hll is not None else 0.0
+
+
+class SessionCrawl:
+    """
+    Résultat d'un parcours unique des pages /clients/{uuid}/user-sessions : toutes les métriques
+    dérivées (comptes distincts, histogramme des durées, sessions listées par client) sont alimentées
+    par le même flux.
+    """
+
+    def __init__(self, now_ms: Optional[int] = None) -> None:
+        self.now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        self.users = DistinctCounter()
+        self.users_by_client: Dict[str, DistinctCounter] = {}  # seulement avec EXPORTER_DISTINCT_BY_CLIENT=1
+        self.durations: List[tuple] = []  # au plus MAX_SESSION_DURATION_SERIES (user_id, username, start_ms)
+        # Histogramme des durées : {client_id ou "": [compteurs par bucket (non cumulés) + +Inf, somme]}
+        self.histograms: Dict[str, list] = {}
+        self.client_counts: dict = {}
+        self.pages = 0
+        self.incomplete: set = set()  # clients non parcourus entièrement (erreur, budget dépassé)
+        self._seen: set = set()
+        # Histogramme du realm : hash des ids de sessions déjà observées (une session SSO apparaît dans
+        # les pages de chaque client qu'elle utilise) ; inutile par client
+        self._observed: Optional[set] = None if DURATION_BY_CLIENT else set()
+        self._lock = threading.Lock()
+
+    def add_page(self, client_id: str, page: List[dict]) -> None:
+        with self._lock:
+            self._add_page(client_id, page)
+
+    def mark_incomplete(self, client_id: str) -> None:
+        with self._lock:
+            self.incomplete.add(client_id)
+
+    def snapshot(self) -> tuple:
+        """(comptes distincts, sessions listées par client, durées, clients incomplets, histogrammes) figés :
+        les pages arrivées après l'échéance ne modifient plus le résultat rendu."""
+        with self._lock:
+            return (
+                self.users.count(),
+                dict(self.client_counts),
+                list(self.durations),
+                sorted(self.incomplete),
+                {k: list(v) for k, v in self.histograms.items()},
+            )
+
+    def distinct_lines(self) -> List[str]:
+        """Comptes distincts par client (optionnel) et mode de comptage (exact / approché)."""
+        with self._lock:
+            lines = []
+            for client_id, counter in sorted(self.users_by_client.items()):
+                label = escape_prometheus_label(client_id)
+                lines.append(f'keycloak_distinct_users_connected_by_client{{client_id="{label}"}} {counter.count()}')
+            lines.append(f"keycloak_session_exporter_distinct_approximate {int(self.users.approximate)}")
+            lines.append(f"keycloak_session_exporter_distinct_error_bound {self.users.error_bound():.4f}")
+            return lines
+
+    def _observe(self, client_id: str, duration_sec: float) -> None:
+        hist = self.histograms.get(client_id)
+        if hist is None:
+            hist = self.histograms[client_id] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+        hist[bisect.bisect_left(DURATION_BUCKETS, duration_sec)] += 1
+        hist[-1] += duration_sec
+
+    def _add_page(self, client_id: str, page: List[dict]) -> None:
+        self.pages += 1
+        self.client_counts[client_id] = self.client_counts.get(client_id, 0) + len(page)
+        for sess in page:
+            uid = sess.get("userId")
+            if not uid:
+                continue
+            self.users.add(uid)
+            if DISTINCT_BY_CLIENT:
+                counter = self.users_by_client.get(client_id)
+                if counter is None:
+                    counter = self.users_by_client[client_id] = DistinctCounter()
+                counter.add(uid)
+            start_ms = sess.get("start")
+            if start_ms is None:
+                continue
+            duration_sec = max(0.0, (self.now_ms - int(start_ms)) / 1000.0)
+            if self._observed is None:
+                self._observe(client_id, duration_sec)
+            else:
+                session_key = hash(sess.get("id") or (uid, start_ms))
+                if session_key not in self._observed:
+                    self._observed.add(session_key)
+                    self._observe("", duration_sec)
+            if not SESSION_DURATION_SERIES or len(self.durations) >= MAX_SESSION_DURATION_SERIES:
+                continue
+            key = (uid, start_ms)
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            username = (sess.get("username") or "").strip() or uid[:8]
+            self.durations.append((uid, _sanitize_label(username), int(start_ms)))
+
+
+def _crawl_client(
+    base_url: str, realm: str, token: str, client_id: str, client_uuid: str, crawl: SessionCrawl, deadline: float
+) -> None:
+    """Pages d'un client, séquentiellement, jusqu'à la dernière page ou l'échéance."""
+    first = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            crawl.mark_incomplete(client_id)
+            return
+        page = fetch_user_sessions_page(
+            base_url, realm, client_uuid, token, first, USER_SESSIONS_PAGE_SIZE, timeout=min(15, remaining)
+        )
+        if page is None:
+            crawl.mark_incomplete(client_id)
+            return
+        if page:
+            crawl.add_page(client_id, page)
+        if len(page) < USER_SESSIONS_PAGE_SIZE:
+            return
+        first += USER_SESSIONS_PAGE_SIZE
+
+
+def crawl_sessions(
     base_url: str,
     realm: str,
     token: str,
     client_id_to_uuid: dict,
     client_id_to_count: dict,
-) -> List[tuple]:
-    """Retourne au plus MAX_SESSION_DURATION_SERIES (user_id, username, start_ms). start en ms depuis epoch."""
-    result = []
-    seen = set()
-    for client_id, count in client_id_to_count.items():
-        if (count or 0) <= 0 or len(result) >= MAX_SESSION_DURATION_SERIES:
-            continue
-        client_uuid = client_id_to_uuid.get(client_id)
-        if not client_uuid:
-            continue
-        first = 0
-        while len(result) < MAX_SESSION_DURATION_SERIES:
-            page = fetch_user_sessions_page(
-                base_url, realm, client_uuid, token, first, USER_SESSIONS_PAGE_SIZE
-            )
-            if not page:
-                break
-            for sess in page:
-                if len(result) >= MAX_SESSION_DURATION_SERIES:
-                    break
-                uid = sess.get("userId")
-                start_ms = sess.get("start")
-                if not uid or start_ms is None:
-                    continue
-                key = (uid, start_ms)
-                if key in seen:
-                    continue
-                seen.add(key)
-                username = (sess.get("username") or "").strip() or uid[:8]
-                result.append((uid, _sanitize_label(username), int(start_ms)))
-            if len(page) < USER_SESSIONS_PAGE_SIZE:
-                break
-            first += USER_SESSIONS_PAGE_SIZE
-    return result
+    deadline: Optional[float] = None,
+    workers: int = CRAWL_WORKERS,
+) -> SessionCrawl:
+    """
+    Parcourt une seule fois les pages de sessions de chaque client actif, jusqu'à `workers` clients
+    en parallèle. Les clients non terminés à l'échéance (monotonic) sont marqués incomplets.
+    """
+    crawl = SessionCrawl()
+    deadline = deadline if deadline is not None else time.monotonic() + COLLECT_BUDGET
+    targets = [
+        (client_id, client_id_to_uuid[client_id])
+        for client_id, count in client_id_to_count.items()
+        if (count or 0) > 0 and client_id_to_uuid.get(client_id)
+    ]
+    if not targets:
+        return crawl
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets))), thread_name_prefix="crawl")
+    futures = {
+        pool.submit(_crawl_client, base_url, realm, token, client_id, client_uuid, crawl, deadline): client_id
+        for client_id, client_uuid in targets
+    }
+    _, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    for future in pending:
+        crawl.mark_incomplete(futures[future])
+    # Les requêtes en cours se terminent d'elles-mêmes (timeout borné par l'échéance)
+    pool.shutdown(wait=False, cancel_futures=True)
+    return crawl
 
 
 def _sanitize_label(s: str, max_len: int = 80) -> str:
@@ -260,6 +754,63 @@ def escape_prometheus_label(s: str) -> str:
     return s.replace("\\", "\\\\").replace('"', '\\"')
 
 
+def histogram_lines(
+    name: str, histograms: Dict[str, list], label: Optional[str] = None, buckets: tuple = DURATION_BUCKETS
+) -> List[str]:
+    """Séries _bucket (cumulées) / _sum / _count ; histograms : {valeur du label: [buckets..., +Inf, somme]}."""
+    lines = [f"# TYPE {name} histogram"]
+    if not histograms:
+        histograms = {"": [0] * (len(buckets) + 1) + [0.0]}
+    for key, hist in sorted(histograms.items()):
+        base = f'{label}="{escape_prometheus_label(key)}",' if label else ""
+        cumulative = 0
+        for le, count in zip([f"{b:g}" for b in buckets] + ["+Inf"], hist[:-1]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{base}le="{le}"}} {cumulative}')
+        selector = f"{{{base.rstrip(',')}}}" if base else ""
+        lines.append(f"{name}_sum{selector} {hist[-1]:.3f}")
+        lines.append(f"{name}_count{selector} {cumulative}")
+    return lines
+
+
+def _with_realm(line: str, realm: str) -> str:
+    """Ajoute le label realm à une ligne d'échantillon Prometheus."""
+    sample, value = line.rsplit(" ", 1)
+    label = f'realm="{escape_prometheus_label(realm)}"'
+    if "{" in sample:
+        name, rest = sample.split("{", 1)
+        return f"{name}{{{label},{rest} {value}"
+    return f"{sample}{{{label}}} {value}"
+
+
+def merge_realm_lines(lines_by_realm: Dict[str, List[str]]) -> List[str]:
+    """
+    Fusionne les lignes de plusieurs realms : label realm sur chaque échantillon et regroupement par
+    famille de métriques (une seule ligne # TYPE, échantillons contigus, comme l'exige le format texte).
+    """
+    types: Dict[str, str] = {}
+    families: Dict[str, List[str]] = {}
+    for realm, lines in lines_by_realm.items():
+        for line in lines:
+            if line.startswith("# TYPE "):
+                name = line.split()[2]
+                types[name] = line
+                families.setdefault(name, [])
+                continue
+            name = line.split("{", 1)[0].split(" ", 1)[0]
+            family = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in types:
+                    family = name[: -len(suffix)]
+            families.setdefault(family, []).append(_with_realm(line, realm))
+    merged = []
+    for family, samples in families.items():
+        if family in types:
+            merged.append(types[family])
+        merged.extend(samples)
+    return merged
+
+
 def _fallback_metrics() -> str:
     """Métriques de secours en cas d'erreur (pour que Prometheus reçoive toujours des séries)."""
     return (
@@ -269,92 +820,503 @@ def _fallback_metrics() -> str:
     )
 
 
-def render_metrics(
+def _sessions_total_lines(client_id_to_count: dict) -> List[str]:
+    if not client_id_to_count:
+        return ['keycloak_sessions_total{client_id="none"} 0']
+    return [
+        f'keycloak_sessions_total{{client_id="{escape_prometheus_label(client_id)}"}} {count}'
+        for client_id, count in client_id_to_count.items()
+    ]
+
+
+def _duration_series_lines(durations: List[tuple], now_ms: int) -> List[str]:
+    """Durée par session (EXPORTER_SESSION_DURATION_SERIES=1) : [(user_id, username, start_ms)]."""
+    lines = []
+    for user_id, username, start_ms in durations:
+        duration_sec = max(0, (now_ms - start_ms) / 1000.0)
+        uid_label = escape_prometheus_label(_sanitize_label(user_id, 36))
+        un_label = escape_prometheus_label(_sanitize_label(username))
+        lines.append(
+            f'keycloak_session_duration_seconds{{user_id="{uid_label}",username="{un_label}"}} {duration_sec:.1f}'
+        )
+    return lines
+
+
+def _last_login_lines(events: List[dict], users: Dict[str, dict]) -> List[str]:
+    """Dernières connexions (événements LOGIN) enrichies du username / email."""
+    lines = []
+    for evt in events:
+        evt_time = evt.get("time")
+        user_id = evt.get("userId")
+        if evt_time is None or not user_id:
+            continue
+        ts_sec = int(evt_time) / 1000
+        user = users.get(user_id)
+        username = "unknown"
+        email = ""
+        if user:
+            username = _sanitize_label(user.get("username") or user_id[:8])
+            email = _sanitize_label(user.get("email") or "", 60)
+        uid_label = escape_prometheus_label(_sanitize_label(user_id, 36))
+        un_label = escape_prometheus_label(username)
+        em_label = escape_prometheus_label(email)
+        lines.append(
+            f'keycloak_last_login_timestamp_seconds{{user_id="{uid_label}",username="{un_label}",email="{em_label}"}} {ts_sec}'
+        )
+    return lines
+
+
+def collect_realm_lines(base_url: str, realm: str, token: str, deadline: float) -> Optional[List[str]]:
+    """Lignes de métriques d'un realm (sans label realm) ; None si les stats de sessions sont indisponibles."""
+    stats = fetch_client_session_stats(base_url, realm, token)
+    if stats is None:
+        return None
+
+    clients_list = fetch_clients(base_url, realm, token)
+    client_id_to_count, client_id_to_uuid = _normalize_session_stats(stats, clients_list)
+
+    lines = _sessions_total_lines(client_id_to_count)
+
+    crawl = crawl_sessions(base_url, realm, token, client_id_to_uuid, client_id_to_count, deadline)
+    crawl_users, crawl_counts, crawl_durations, incomplete, histograms = crawl.snapshot()
+    lines.append(f"keycloak_distinct_users_connected {crawl_users}")
+    for client_id, listed in crawl_counts.items():
+        label = escape_prometheus_label(client_id)
+        lines.append(f'keycloak_sessions_listed{{client_id="{label}"}} {listed}')
+    lines.extend(crawl.distinct_lines())
+    lines.append(f"keycloak_session_exporter_session_pages {crawl.pages}")
+
+    # Histogramme des durées de session (toutes les sessions parcourues)
+    lines.extend(histogram_lines("keycloak_active_session_duration_seconds", histograms, "client_id" if DURATION_BY_CLIENT else None))
+
+    # Durée de session par utilisateur (connectés), optionnelle
+    lines.extend(_duration_series_lines(crawl_durations, crawl.now_ms))
+
+    # Dernières connexions (événements LOGIN) avec enrichissement user (username, email) ;
+    # avec EXPORTER_EVENTS_SOURCE=log, événements et dernières connexions viennent des logs (event_log_lines)
+    events_complete = True
+    events: List[dict] = []
+    lookups_skipped = 0
+    if EVENTS_SOURCE != "log":
+        tracker = event_tracker(realm)
+        events_complete = tracker.poll(base_url, token, deadline)
+        lines.extend(tracker.metric_lines())
+        events = tracker.latest_logins()
+    if events:
+        users, lookups_skipped = resolve_users(base_url, realm, token, events, deadline)
+        lines.extend(_last_login_lines(events, users))
+
+    # Collecte partielle (budget dépassé, pages en erreur) : signalée plutôt que remplacée par des zéros
+    lines.append(f"keycloak_session_exporter_partial {int(bool(incomplete) or lookups_skipped > 0 or not events_complete)}")
+    lines.append(f"keycloak_session_exporter_clients_incomplete {len(incomplete)}")
+    lines.append(f"keycloak_session_exporter_user_lookups_skipped {lookups_skipped}")
+    if incomplete:
+        print(f"keycloak_session_exporter: {realm} : collecte partielle, clients incomplets : {', '.join(incomplete[:10])}", file=sys.stderr)
+    return lines
+
+
+_pg_source: Optional[PostgresSource] = None
+_pg_lock = threading.Lock()
+
+
+def pg_source() -> PostgresSource:
+    """Source Postgres partagée (pool dimensionné pour EXPORTER_REALM_WORKERS realms en parallèle)."""
+    global _pg_source
+    with _pg_lock:
+        if _pg_source is None:
+            _pg_source = PostgresSource(pool_size=max(PG_POOL_SIZE, REALM_WORKERS))
+        return _pg_source
+
+
+def _pg_call(endpoint: str, fn, *args):
+    """Requête Postgres mesurée comme un appel API (endpoint "pg:...", statut ok / error)."""
+    start = time.perf_counter()
+    status = "error"
+    try:
+        result = fn(*args)
+        status = "ok"
+        return result
+    finally:
+        _api_stats.record(f"pg:{endpoint}", status, time.perf_counter() - start, 0)
+
+
+def collect_realm_lines_pg(source: PostgresSource, realm: str) -> Optional[List[str]]:
+    """Mêmes métriques que collect_realm_lines, calculées par requêtes d'agrégat sur la base Keycloak."""
+    try:
+        stats = _pg_call(
+            "sessions", source.session_stats, realm, DURATION_BUCKETS, DURATION_BY_CLIENT,
+            MAX_SESSION_DURATION_SERIES if SESSION_DURATION_SERIES else 0,
+        )
+    except Exception as e:
+        print(f"keycloak_session_exporter: {realm} : postgres error: {e}", file=sys.stderr)
+        return None
+
+    lines = _sessions_total_lines(stats["clients"])
+    lines.append(f"keycloak_distinct_users_connected {stats['distinct_users']}")
+    if DISTINCT_BY_CLIENT:
+        for client_id, count in sorted(stats["distinct_by_client"].items()):
+            label = escape_prometheus_label(client_id)
+            lines.append(f'keycloak_distinct_users_connected_by_client{{client_id="{label}"}} {count}')
+    lines.append("keycloak_session_exporter_distinct_approximate 0")
+    lines.append("keycloak_session_exporter_distinct_error_bound 0.0000")
+    lines.extend(histogram_lines("keycloak_active_session_duration_seconds", stats["histograms"], "client_id" if DURATION_BY_CLIENT else None))
+    lines.extend(_duration_series_lines(stats["durations"], stats["now_ms"]))
+
+    # Événements : fenêtre ]curseur, maintenant - EXPORTER_PG_EVENTS_LAG] (transactions en cours de commit exclues) ;
+    # avec EXPORTER_EVENTS_SOURCE=log, ils viennent des logs (event_log_lines)
+    events_complete = True
+    if EVENTS_SOURCE != "log":
+        tracker = event_tracker(realm)
+        until_ms = int(time.time() * 1000) - EVENTS_LAG_MS
+        try:
+            counts = {}
+            if tracker.cursor_ms is not None:
+                counts = _pg_call("events", source.event_counts, realm, EVENT_TYPES, tracker.cursor_ms, until_ms)
+            tracker.add_counts(counts, until_ms)
+            logins = _pg_call("logins", source.latest_logins, realm, MAX_LAST_LOGIN_EVENTS)
+        except Exception as e:
+            print(f"keycloak_session_exporter: {realm} : postgres events error: {e}", file=sys.stderr)
+            events_complete = False
+            logins = []
+        lines.extend(tracker.metric_lines())
+        lines.extend(_last_login_lines(logins, {evt["userId"]: evt for evt in logins}))
+
+    lines.append(f"keycloak_session_exporter_partial {int(not events_complete)}")
+    lines.append("keycloak_session_exporter_clients_incomplete 0")
+    lines.append("keycloak_session_exporter_user_lookups_skipped 0")
+    return lines
+
+
+_event_log: Optional[EventLogTailer] = None
+
+
+def start_event_log() -> EventLogTailer:
+    """Démarre la lecture des logs Keycloak (EXPORTER_EVENTS_SOURCE=log) ; une seule instance."""
+    global _event_log
+    if _event_log is None:
+        _event_log = EventLogTailer(EVENT_LOG, from_start=EVENT_LOG_FROM_START)
+        _event_log.start()
+    return _event_log
+
+
+def event_log_lines() -> List[str]:
+    """
+    Séries issues des logs, rendues à chaque scrape (pas de snapshot) : compteurs d'événements et
+    dernières connexions avec label realm, pics par seconde, retard de lecture, état du lecteur.
+    """
+    if _event_log is None:
+        return []
+    snap = _event_log.snapshot()
+    lines = ["# TYPE keycloak_events_total counter"]
+    for (realm, event_type, client_id, error), count in sorted(snap["counts"].items()):
+        lines.append(
+            f'keycloak_events_total{{realm="{escape_prometheus_label(realm)}",type="{escape_prometheus_label(event_type)}",'
+            f'client_id="{escape_prometheus_label(client_id)}",error="{escape_prometheus_label(error)}"}} {count}'
+        )
+    # Un type déjà vu sans événement dans la fenêtre : pic à 0 (la série ne reste pas figée)
+    seen_types = {(realm, event_type) for realm, event_type, _, _ in snap["counts"]}
+    for realm, event_type in sorted(seen_types | set(snap["peaks"])):
+        peak = snap["peaks"].get((realm, event_type), 0)
+        lines.append(
+            f'keycloak_events_peak_per_second{{realm="{escape_prometheus_label(realm)}",'
+            f'type="{escape_prometheus_label(event_type)}"}} {peak}'
+        )
+    lines.extend(histogram_lines("keycloak_event_log_lag_seconds", {"": snap["lag"]}, buckets=EVENT_LOG_LAG_BUCKETS))
+    for realm, logins in sorted(snap["logins"].items()):
+        users = {evt["userId"]: {"username": evt["username"]} for evt in logins if evt["username"]}
+        lines.extend(_with_realm(line, realm) for line in _last_login_lines(logins, users))
+    lines.append(f"keycloak_session_exporter_event_log_up {int(snap['open'])}")
+    lines.append("# TYPE keycloak_session_exporter_event_log_lines_total counter")
+    lines.append(f"keycloak_session_exporter_event_log_lines_total {snap['lines']}")
+    lines.append("# TYPE keycloak_session_exporter_event_log_events_total counter")
+    lines.append(f"keycloak_session_exporter_event_log_events_total {snap['events']}")
+    lines.append("# TYPE keycloak_session_exporter_event_log_series_overflow_total counter")
+    lines.append(f"keycloak_session_exporter_event_log_series_overflow_total {snap['overflow']}")
+    return lines
+
+
+def resolve_realms(base_url: str, token: str, realms: str) -> Optional[List[str]]:
+    """Spécification EXPORTER_REALMS : liste "a,b,c" ou "*" (tous les realms, redécouverts à chaque collecte)."""
+    if realms.strip() == "*":
+        return fetch_realms(base_url, token)
+    return [r.strip() for r in realms.split(",") if r.strip()]
+
+
+def collect_metric_lines(
     base_url: str,
-    realm: str,
+    realms: str,
     admin_user: str,
     admin_pass: str,
-) -> str:
-    """Retourne le texte Prometheus (toujours valide)."""
-    try:
+) -> Optional[List[str]]:
+    """
+    Lignes de métriques Keycloak (sans keycloak_session_exporter_up), label realm sur chaque série ;
+    None si le token, la liste des realms ou les stats de tous les realms sont indisponibles.
+    Un seul token admin pour tous les realms ; au plus EXPORTER_REALM_WORKERS realms collectés en
+    parallèle, tous dans le même budget de temps.
+    """
+    deadline = time.monotonic() + COLLECT_BUDGET
+    calls_before, bytes_before = _api_stats.totals()
+    if BACKEND == "postgres":
+        source = pg_source()
+        realm_list = _pg_call("realms", source.realms) if realms.strip() == "*" else resolve_realms(base_url, "", realms)
+
+        def realm_lines(realm: str) -> Optional[List[str]]:
+            return collect_realm_lines_pg(source, realm)
+    else:
         token = get_admin_token(base_url, admin_user, admin_pass)
         if not token:
-            return _fallback_metrics()
+            return None
+        realm_list = resolve_realms(base_url, token, realms)
 
-        stats = fetch_client_session_stats(base_url, realm, token)
-        if stats is None:
-            return _fallback_metrics()
+        def realm_lines(realm: str) -> Optional[List[str]]:
+            return collect_realm_lines(base_url, realm, token, deadline)
+    if not realm_list:
+        return None
 
-        clients_list = fetch_clients(base_url, realm, token)
-        client_id_to_count, client_id_to_uuid = _normalize_session_stats(stats, clients_list)
+    def collect_realm(realm: str) -> tuple:
+        start = time.monotonic()
+        try:
+            lines = realm_lines(realm)
+        except Exception as e:
+            print(f"keycloak_session_exporter: {realm} : error: {e}", file=sys.stderr)
+            lines = None
+        return realm, lines, time.monotonic() - start
 
-        lines = ["keycloak_session_exporter_up 1"]
-        if not client_id_to_count:
-            lines.append('keycloak_sessions_total{client_id="none"} 0')
-        for client_id, count in client_id_to_count.items():
-            label = escape_prometheus_label(client_id)
-            lines.append(f'keycloak_sessions_total{{client_id="{label}"}} {count}')
+    with ThreadPoolExecutor(max_workers=max(1, min(REALM_WORKERS, len(realm_list))), thread_name_prefix="realm") as pool:
+        outcomes = list(pool.map(collect_realm, realm_list))
 
-        distinct = collect_distinct_user_ids(
-            base_url, realm, token, client_id_to_uuid, client_id_to_count
-        )
-        lines.append(f"keycloak_distinct_users_connected {len(distinct)}")
+    collected = {realm: lines for realm, lines, _ in outcomes if lines is not None}
+    if not collected:
+        return None
+    lines = merge_realm_lines(collected)
+    for realm, lines_for_realm, _ in outcomes:
+        lines.append(f'keycloak_session_exporter_realm_up{{realm="{escape_prometheus_label(realm)}"}} {int(lines_for_realm is not None)}')
+    for realm, _, duration in outcomes:
+        lines.append(f'keycloak_session_exporter_realm_collect_duration_seconds{{realm="{escape_prometheus_label(realm)}"}} {duration:.3f}')
+    lines.append(f"keycloak_session_exporter_realms {len(realm_list)}")
+    lines.extend(_user_cache.metric_lines())
+    calls, received = _api_stats.totals()
+    lines.append(f"keycloak_session_exporter_collect_api_requests {calls - calls_before}")
+    lines.append(f"keycloak_session_exporter_collect_response_bytes {received - bytes_before}")
+    return lines
 
-        # Durée de session par utilisateur (connectés)
-        now_ms = int(time.time() * 1000)
-        sessions_with_start = collect_sessions_with_duration(
-            base_url, realm, token, client_id_to_uuid, client_id_to_count
-        )
-        for user_id, username, start_ms in sessions_with_start:
-            duration_sec = max(0, (now_ms - start_ms) / 1000.0)
-            uid_label = escape_prometheus_label(_sanitize_label(user_id, 36))
-            un_label = escape_prometheus_label(username)
-            lines.append(
-                f'keycloak_session_duration_seconds{{user_id="{uid_label}",username="{un_label}"}} {duration_sec:.1f}'
-            )
 
-        # Dernières connexions (événements LOGIN) avec enrichissement user (username, email)
-        events = fetch_events(base_url, realm, token, "LOGIN", MAX_LAST_LOGIN_EVENTS)
-        if events:
-            for evt in events:
-                evt_time = evt.get("time")
-                user_id = evt.get("userId")
-                if evt_time is None or not user_id:
-                    continue
-                ts_sec = int(evt_time) / 1000
-                user = fetch_user(base_url, realm, token, user_id)
-                username = "unknown"
-                email = ""
-                if user:
-                    username = _sanitize_label(user.get("username") or user_id[:8])
-                    email = _sanitize_label(user.get("email") or "", 60)
-                uid_label = escape_prometheus_label(_sanitize_label(user_id, 36))
-                un_label = escape_prometheus_label(username)
-                em_label = escape_prometheus_label(email)
-                lines.append(
-                    f'keycloak_last_login_timestamp_seconds{{user_id="{uid_label}",username="{un_label}",email="{em_label}"}} {ts_sec}'
-                )
-
-        return "\n".join(lines) + "\n"
+def render_metrics(
+    base_url: str,
+    realms: str,
+    admin_user: str,
+    admin_pass: str,
+) -> str:
+    """Retourne le texte Prometheus (toujours valide) ; collecte synchrone."""
+    try:
+        lines = collect_metric_lines(base_url, realms, admin_user, admin_pass)
     except Exception as e:
         print(f"keycloak_session_exporter: error: {e}", file=sys.stderr)
-        return _fallback_metrics()
+        lines = None
+    body = _fallback_metrics() if lines is None else "\n".join(["keycloak_session_exporter_up 1"] + lines) + "\n"
+    # Appels sortants et événements des logs : toujours à jour, y compris quand la collecte échoue
+    return body + "\n".join(_api_stats.metric_lines() + event_log_lines()) + "\n"
+
+
+class MetricsCollector:
+    """
+    Collecte en tâche de fond ; /metrics sert le dernier snapshot réussi sans appeler Keycloak.
+    En cas d'échec, le snapshot précédent est conservé (exporter_up 0, âge croissant).
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        realms: str,
+        admin_user: str,
+        admin_pass: str,
+        interval: float = COLLECT_INTERVAL,
+        stale_after: float = STALE_AFTER,
+    ) -> None:
+        self.base_url = base_url
+        self.realms = realms
+        self.admin_user = admin_user
+        self.admin_pass = admin_pass
+        self.interval = interval
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lines: Optional[List[str]] = None
+        self._up = False
+        self._last_success = 0.0
+        self._duration = 0.0
+        self._collections = {"success": 0, "error": 0}
+
+    def collect_once(self) -> bool:
+        start = time.monotonic()
+        try:
+            lines = collect_metric_lines(self.base_url, self.realms, self.admin_user, self.admin_pass)
+        except Exception as e:
+            print(f"keycloak_session_exporter: error: {e}", file=sys.stderr)
+            lines = None
+        with self._lock:
+            self._duration = time.monotonic() - start
+            self._up = lines is not None
+            self._collections["success" if self._up else "error"] += 1
+            if lines is not None:
+                self._lines = lines
+                self._last_success = time.time()
+        return lines is not None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.collect_once()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="collector", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def render(self) -> str:
+        with self._lock:
+            lines = self._lines
+            up = self._up
+            last_success = self._last_success
+            duration = self._duration
+            collections = dict(self._collections)
+        body = _fallback_metrics() if lines is None else "\n".join([f"keycloak_session_exporter_up {int(up)}"] + lines) + "\n"
+        age = time.time() - last_success if last_success else -1
+        meta = [
+            f"keycloak_session_exporter_collect_duration_seconds {duration:.3f}",
+            f"keycloak_session_exporter_last_success_timestamp_seconds {last_success:.3f}",
+            f"keycloak_session_exporter_snapshot_age_seconds {age:.3f}",
+            f"keycloak_session_exporter_snapshot_stale {int(not last_success or age > self.stale_after)}",
+        ]
+        meta.append("# TYPE keycloak_session_exporter_collections_total counter")
+        for result, count in collections.items():
+            meta.append(f'keycloak_session_exporter_collections_total{{result="{result}"}} {count}')
+        meta.extend(_api_stats.metric_lines())
+        meta.extend(event_log_lines())
+        return body + "\n".join(meta) + "\n"
+
+
+def _exporter_config() -> tuple:
+    """URL, realms (EXPORTER_REALMS, sinon KEYCLOAK_REALM), admin_user, admin_pass depuis l'environnement."""
+    return (
+        os.environ.get("KEYCLOAK_URL", DEFAULT_URL).rstrip("/"),
+        os.environ.get("EXPORTER_REALMS") or os.environ.get("KEYCLOAK_REALM", DEFAULT_REALM),
+        os.environ.get("KEYCLOAK_ADMIN_USER", DEFAULT_ADMIN),
+        os.environ.get("KEYCLOAK_ADMIN_PASSWORD", DEFAULT_ADMIN_PASS),
+    )
+
+
+class SingleFlight:
+    """
+    Regroupe les appels concurrents : un seul exécute la fonction, les autres attendent et reçoivent
+    le même résultat (scrapes simultanés de deux Prometheus en HA, collecte synchrone).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._inflight: Optional[tuple] = None  # (Event, {"result" | "error": ...})
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, fn):
+        with self._lock:
+            self.calls += 1
+            leader = self._inflight is None
+            if leader:
+                self._inflight = (threading.Event(), {})
+            else:
+                self.coalesced += 1
+            done, outcome = self._inflight
+        if not leader:
+            done.wait()
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["result"]
+        try:
+            outcome["result"] = fn()
+            return outcome["result"]
+        except Exception as e:
+            outcome["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight = None
+            done.set()
+
+    def metric_lines(self) -> List[str]:
+        with self._lock:
+            return [
+                "# TYPE keycloak_session_exporter_scrapes_total counter",
+                f"keycloak_session_exporter_scrapes_total {self.calls}",
+                "# TYPE keycloak_session_exporter_scrapes_coalesced_total counter",
+                f"keycloak_session_exporter_scrapes_coalesced_total {self.coalesced}",
+            ]
+
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def to_openmetrics(body: str) -> str:
+    """
+    Format texte Prometheus → OpenMetrics : famille des compteurs sans suffixe _total dans # TYPE,
+    terminaison # EOF.
+    """
+    lines = []
+    for line in body.splitlines():
+        if not line:
+            continue
+        if line.startswith("# TYPE ") and line.endswith(" counter"):
+            name = line.split()[2]
+            if name.endswith("_total"):
+                line = f"# TYPE {name[: -len('_total')]} counter"
+        lines.append(line)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def _accepts(header: Optional[str], value: str) -> bool:
+    """Négociation simplifiée : `value` présent dans l'en-tête sans q=0."""
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip().lower() == value and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            return True
+    return False
 
 
 class MetricsHandler(BaseHTTPRequestHandler):
+    collector: Optional[MetricsCollector] = None
+    scrapes = SingleFlight()
+
+    def _metrics_body(self) -> str:
+        if self.collector is not None:
+            return self.collector.render()
+        return render_metrics(*_exporter_config())
+
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path == "/metrics":
-            base = os.environ.get("KEYCLOAK_URL", DEFAULT_URL).rstrip("/")
-            realm = os.environ.get("KEYCLOAK_REALM", DEFAULT_REALM)
-            admin_user = os.environ.get("KEYCLOAK_ADMIN_USER", DEFAULT_ADMIN)
-            admin_pass = os.environ.get("KEYCLOAK_ADMIN_PASSWORD", DEFAULT_ADMIN_PASS)
-            body = render_metrics(base, realm, admin_user, admin_pass)
+            body = self.scrapes.do(self._metrics_body) + "\n".join(self.scrapes.metric_lines()) + "\n"
+            content_type = TEXT_CONTENT_TYPE
+            if _accepts(self.headers.get("Accept"), "application/openmetrics-text"):
+                body = to_openmetrics(body)
+                content_type = OPENMETRICS_CONTENT_TYPE
+            payload = body.encode("utf-8")
+            gzipped = _accepts(self.headers.get("Accept-Encoding"), "gzip")
+            if gzipped:
+                payload = gzip.compress(payload, compresslevel=6)
             self.send_response(200)
-            self.send_header("Content-Type", "text/plain; charset=utf-8")
-            self.send_header("Content-Length", str(len(body.encode("utf-8"))))
+            self.send_header("Content-Type", content_type)
+            if gzipped:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Vary", "Accept, Accept-Encoding")
+            self.send_header("Content-Length", str(len(payload)))
             self.end_headers()
-            self.wfile.write(body.encode("utf-8"))
+            self.wfile.write(payload)
         elif parsed.path in ("/", "/health"):
             self.send_response(200)
             self.send_header("Content-Type", "text/plain")
@@ -370,11 +1332,21 @@ class MetricsHandler(BaseHTTPRequestHandler):
 
 def main():
     port = int(os.environ.get("EXPORTER_PORT", str(EXPORTER_PORT)))
-    server = HTTPServer(("0.0.0.0", port), MetricsHandler)
-    print(f"Keycloak session exporter listening on 0.0.0.0:{port}", file=sys.stderr)
+    if EVENTS_SOURCE == "log":
+        start_event_log()
+        print(f"Keycloak session exporter: événements lus dans {'stdin' if EVENT_LOG == '-' else EVENT_LOG}", file=sys.stderr)
+    if COLLECT_INTERVAL > 0:
+        MetricsHandler.collector = MetricsCollector(*_exporter_config())
+        MetricsHandler.collector.start()
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    server.daemon_threads = True
+    print(f"Keycloak session exporter listening on 0.0.0.0:{port}"
+          + (f" (collecte toutes les {COLLECT_INTERVAL:g} s)" if COLLECT_INTERVAL > 0 else ""), file=sys.stderr)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
+        if MetricsHandler.collector is not None:
+            MetricsHandler.collector.stop()
         server.shutdown()
         sys.exit(0)
 
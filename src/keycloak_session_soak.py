@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Soak test du cycle de vie des sessions Keycloak : croissance des sessions côté serveur sur la durée.
+
+Locust ne déconnecte ses utilisateurs qu'en on_stop et les scripts de login jamais : les sessions
+s'accumulent jusqu'à expiration (incidents de croissance du cache user-sessions en production).
+Ce mode modélise des sessions complètes à un nombre cible de sessions simultanées :
+
+  login → maintien --session-lifetime s (refresh_token toutes les --refresh-interval s)
+        → logout (proportion --logout-ratio) ou abandon (la session expire côté serveur)
+        → nouvelle session.
+
+Un échantillonneur relève toutes les --sample-interval s :
+  - les sessions actives du realm (GET /admin/realms/{realm}/client-session-stats) ;
+  - les séries de Keycloak sur le port de management 9000 (/metrics) filtrées par --metrics-filter
+    (entrées des caches de sessions, heap JVM par défaut) ;
+  - la latence login / refresh / logout de la fenêtre.
+
+Le rapport donne la dérive par heure (régression linéaire) du nombre de sessions serveur et des
+latences, et l'écart entre sessions ouvertes côté client et sessions actives côté serveur.
+
+Usage :
+  python keycloak_session_soak.py --sessions 200 --duration 3600 --session-lifetime 300 --refresh-interval 60
+  python keycloak_session_soak.py --accounts-file users.txt --sessions 1000 --logout-ratio 0.5 --duration 14400
+
+Variables d'environnement : KEYCLOAK_URL, KEYCLOAK_REALM, KEYCLOAK_ADMIN_USER, KEYCLOAK_ADMIN_PASSWORD,
+KEYCLOAK_METRICS_URL (défaut : hôte de KEYCLOAK_URL, port KEYCLOAK_MANAGEMENT_PORT ou 9000, /metrics).
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from keycloak_accounts import AccountStore
+from keycloak_admin_utils import (
+    DEFAULT_ADMIN,
+    DEFAULT_ADMIN_PASS,
+    DEFAULT_REALM,
+    DEFAULT_URL,
+    admin_token_provider,
+    fetch_client_session_stats,
+)
+from keycloak_load_profile import Result, percentile
+from keycloak_run_results import DEFAULT_RESULTS_DIR, build_run_record, fetch_keycloak_version, save_run
+
+try:
+    from dotenv import load_dotenv
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv(os.path.join(_root, ".env"))
+    load_dotenv()
+except ImportError:
+    pass
+
+_MANAGEMENT_PORT = os.environ.get("KEYCLOAK_MANAGEMENT_PORT", "9000")
+
+# Séries suivies par défaut sur :9000/metrics (caches Infinispan de sessions, heap JVM)
+DEFAULT_METRICS_FILTER = (
+    r'^vendor_statistics_(approximate_)?entries\{.*cache="(sessions|clientSessions|offlineSessions|offlineClientSessions)"'
+    r'|^jvm_memory_used_bytes\{.*area="heap"'
+)
+OPERATIONS = ("login", "refresh", "logout")
+_METRIC_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*(?:\{[^}]*\})?)\s+(\S+)")
+
+
+def default_metrics_url(base_url: str) -> str:
+    parts = urlsplit(base_url)
+    return os.environ.get("KEYCLOAK_METRICS_URL", f"{parts.scheme}://{parts.hostname}:{_MANAGEMENT_PORT}/metrics")
+
+
+def token_request(base_url: str, realm: str, data: dict, timeout: float) -> Tuple[bool, float, Optional[str], Optional[dict]]:
+    """POST sur l'endpoint token ; retourne (succès, latence, erreur, réponse JSON)."""
+    start = time.perf_counter()
+    try:
+        r = requests.post(f"{base_url}/realms/{realm}/protocol/openid-connect/token", data=data, timeout=timeout)
+        elapsed = time.perf_counter() - start
+        if r.status_code == 200:
+            return True, elapsed, None, r.json()
+        return False, elapsed, f"HTTP {r.status_code}", None
+    except requests.exceptions.Timeout:
+        return False, time.perf_counter() - start, "timeout", None
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return False, time.perf_counter() - start, str(type(e).__name__), None
+
+
+def logout(base_url: str, realm: str, client_id: str, refresh_token: str, timeout: float) -> Tuple[bool, float, Optional[str]]:
+    """Déconnexion côté serveur (endpoint logout OIDC avec le refresh token)."""
+    start = time.perf_counter()
+    try:
+        r = requests.post(
+            f"{base_url}/realms/{realm}/protocol/openid-connect/logout",
+            data={"client_id": client_id, "refresh_token": refresh_token},
+            timeout=timeout,
+        )
+        elapsed = time.perf_counter() - start
+        if r.status_code in (200, 204):
+            return True, elapsed, None
+        return False, elapsed, f"HTTP {r.status_code}"
+    except requests.exceptions.Timeout:
+        return False, time.perf_counter() - start, "timeout"
+    except requests.exceptions.RequestException as e:
+        return False, time.perf_counter() - start, str(type(e).__name__)
+
+
+class SoakState:
+    """Résultats par opération et nombre de sessions ouvertes côté client (thread-safe)."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.results: Dict[str, List[Result]] = {op: [] for op in OPERATIONS}
+        self.open_sessions = 0
+        self.abandoned = 0
+
+    def record(self, op: str, ok: bool, lat: float, err: Optional[str]) -> None:
+        with self.lock:
+            self.results[op].append((ok, lat, err, time.monotonic()))
+
+
+def session_worker(
+    args,
+    base_url: str,
+    accounts: Sequence[Tuple[str, str]],
+    state: SoakState,
+    stop: threading.Event,
+    seed: int,
+) -> None:
+    """Un utilisateur virtuel : enchaîne des sessions complètes jusqu'à stop."""
+    rng = random.Random(seed)
+    # Démarrages étalés pour ne pas synchroniser login / refresh / logout de toutes les sessions
+    if stop.wait(rng.uniform(0, min(args.session_lifetime, 30.0))):
+        return
+    while not stop.is_set():
+        username, password = accounts[rng.randrange(len(accounts))]
+        ok, lat, err, body = token_request(
+            base_url, args.realm,
+            {"client_id": args.client_id, "username": username, "password": password, "grant_type": "password"},
+            args.timeout,
+        )
+        state.record("login", ok, lat, err)
+        if not ok:
+            stop.wait(1.0)
+            continue
+        with state.lock:
+            state.open_sessions += 1
+        refresh_token = body.get("refresh_token")
+        lifetime = args.session_lifetime * rng.uniform(1 - args.lifetime_jitter, 1 + args.lifetime_jitter)
+        end = time.monotonic() + lifetime
+        while not stop.is_set() and refresh_token:
+            wait = min(args.refresh_interval, end - time.monotonic())
+            if wait <= 0 or stop.wait(wait):
+                break
+            if time.monotonic() >= end:
+                break
+            ok, lat, err, body = token_request(
+                base_url, args.realm,
+                {"client_id": args.client_id, "grant_type": "refresh_token", "refresh_token": refresh_token},
+                args.timeout,
+            )
+            state.record("refresh", ok, lat, err)
+            if not ok:
+                break
+            refresh_token = body.get("refresh_token", refresh_token)
+        if refresh_token and rng.random() < args.logout_ratio:
+            ok, lat, err = logout(base_url, args.realm, args.client_id, refresh_token, args.timeout)
+            state.record("logout", ok, lat, err)
+        else:
+            with state.lock:
+                state.abandoned += 1
+        with state.lock:
+            state.open_sessions -= 1
+
+
+def server_active_sessions(stats) -> Optional[int]:
+    """Somme des sessions actives de client-session-stats (format dict récent ou liste ancienne)."""
+    if stats is None:
+        return None
+    if isinstance(stats, dict):
+        return sum(int(v or 0) for v in stats.values())
+    return sum(int(c.get("active") or 0) for c in stats if isinstance(c, dict))
+
+
+def scrape_metrics(url: str, pattern: re.Pattern) -> Dict[str, float]:
+    """Séries Prometheus (texte) de `url` dont la ligne correspond à `pattern`."""
+    try:
+        r = requests.get(url, timeout=10)
+        r.raise_for_status()
+    except requests.exceptions.RequestException:
+        return {}
+    out = {}
+    for line in r.text.splitlines():
+        if not line or line.startswith("#") or not pattern.search(line):
+            continue
+        m = _METRIC_LINE.match(line)
+        if m:
+            try:
+                out[m.group(1)] = float(m.group(2))
+            except ValueError:
+                pass
+    return out
+
+
+def _window_p(results: List[Result], since: float, p: float) -> Optional[float]:
+    lat = sorted(r[1] for r in results if r[0] and r[3] >= since)
+    if not lat:
+        return None
+    return percentile(lat, p)
+
+
+def take_sample(args, base_url: str, token, state: SoakState, start: float, since: float, pattern: re.Pattern) -> dict:
+    server = None
+    try:
+        server = server_active_sessions(fetch_client_session_stats(base_url, args.realm, token()))
+    except requests.exceptions.RequestException:
+        pass
+    with state.lock:
+        sample = {
+            "t": round(time.monotonic() - start, 1),
+            "client_sessions": state.open_sessions,
+            "abandoned": state.abandoned,
+            "server_sessions": server,
+        }
+        for op in OPERATIONS:
+            sample[f"{op}_p50"] = _window_p(state.results[op], since, 50)
+            sample[f"{op}_p99"] = _window_p(state.results[op], since, 99)
+    sample["metrics"] = scrape_metrics(args.metrics_url, pattern) if args.metrics_url else {}
+    return sample
+
+
+def slope_per_hour(points: List[Tuple[float, float]]) -> Optional[float]:
+    """Pente (unités / heure) de la régression linéaire des points (t_sec, valeur)."""
+    if len(points) < 3:
+        return None
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    mx, my = statistics.mean(xs), statistics.mean(ys)
+    var = sum((x - mx) ** 2 for x in xs)
+    if var == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var * 3600
+
+
+def compute_drift(samples: List[dict], warmup: float) -> dict:
+    """Dérive par heure après la montée (warmup) : sessions serveur, latences, séries :9000."""
+    steady = [s for s in samples if s["t"] >= warmup]
+    drift = {}
+    for key in ("server_sessions", "client_sessions", "login_p50", "login_p99", "refresh_p99"):
+        drift[key] = slope_per_hour([(s["t"], s[key]) for s in steady if s.get(key) is not None])
+    series = sorted({name for s in steady for name in s["metrics"]})
+    drift["metrics"] = {name: slope_per_hour([(s["t"], s["metrics"][name]) for s in steady if name in s["metrics"]]) for name in series}
+    return drift
+
+
+def _fmt(v: Optional[float], unit: str = "", scale: float = 1.0, digits: int = 1) -> str:
+    return "n/a" if v is None else f"{v * scale:+.{digits}f}{unit}"
+
+
+def print_sample(sample: dict) -> None:
+    server = sample["server_sessions"] if sample["server_sessions"] is not None else "n/a"
+    p99 = f"{sample['login_p99']:.3f}" if sample["login_p99"] is not None else "n/a"
+    print(f"   [{sample['t']:>8.0f}s] sessions client={sample['client_sessions']:>6}  serveur={server:>6}  "
+          f"abandonnées={sample['abandoned']:>6}  login p99={p99}")
+
+
+def print_soak_report(state: SoakState, samples: List[dict], drift: dict, elapsed: float) -> None:
+    print("  📊 Résultats (soak sessions)")
+    print("-" * 40)
+    print(f"     Durée réelle     : {elapsed:.0f} s")
+    for op in OPERATIONS:
+        res = state.results[op]
+        ok_lat = sorted(r[1] for r in res if r[0])
+        errors = sum(1 for r in res if not r[0])
+        line = f"     {op:<16} : {len(res)} req, {errors} erreurs"
+        if ok_lat:
+            line += f", avg={statistics.mean(ok_lat):.3f}  p99={percentile(ok_lat, 99):.3f}"
+        print(line)
+    print(f"     Sessions abandonnées (expiration serveur) : {state.abandoned}")
+    last = samples[-1] if samples else None
+    if last and last["server_sessions"] is not None:
+        print(f"     Sessions finales : client={last['client_sessions']}  serveur={last['server_sessions']}")
+    print("     Dérive / heure (après montée) :")
+    print(f"       sessions serveur : {_fmt(drift.get('server_sessions'))}")
+    print(f"       login p50 / p99  : {_fmt(drift.get('login_p50'), ' ms', 1000)} / {_fmt(drift.get('login_p99'), ' ms', 1000)}")
+    print(f"       refresh p99      : {_fmt(drift.get('refresh_p99'), ' ms', 1000)}")
+    for name, slope in sorted(drift.get("metrics", {}).items()):
+        print(f"       {name[:70]:<70} : {_fmt(slope)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Soak test du cycle de vie des sessions (croissance des sessions serveur).")
+    parser.add_argument("--url", type=str, default=DEFAULT_URL, help="URL Keycloak")
+    parser.add_argument("--realm", type=str, default=DEFAULT_REALM, help="Realm")
+    parser.add_argument("--admin-user", type=str, default=DEFAULT_ADMIN, help="Admin (client-session-stats)")
+    parser.add_argument("--admin-password", type=str, default=DEFAULT_ADMIN_PASS, help="Mot de passe admin")
+    parser.add_argument("--user", type=str, default=DEFAULT_ADMIN, help="Compte unique pour les sessions (sans --accounts-file)")
+    parser.add_argument("--password", type=str, default=DEFAULT_ADMIN_PASS, help="Mot de passe du compte unique")
+    parser.add_argument("--accounts-file", type=str, metavar="PATH", help="Comptes 'username:password' (ou JSONL, .gz) tirés au hasard")
+    parser.add_argument("--client-id", type=str, default="admin-cli", help="Client OIDC (direct access grants, défaut: admin-cli)")
+    parser.add_argument("--sessions", type=int, default=100, metavar="N", help="Sessions simultanées visées (un thread par session)")
+    parser.add_argument("--duration", type=float, default=3600.0, metavar="SEC", help="Durée du soak (défaut: 3600)")
+    parser.add_argument("--session-lifetime", type=float, default=300.0, metavar="SEC", help="Durée de maintien d'une session (défaut: 300)")
+    parser.add_argument("--lifetime-jitter", type=float, default=0.2, metavar="RATIO", help="Variation aléatoire de la durée de session ±RATIO (défaut: 0.2)")
+    parser.add_argument("--refresh-interval", type=float, default=60.0, metavar="SEC", help="Intervalle de refresh_token pendant la session (défaut: 60)")
+    parser.add_argument("--logout-ratio", type=float, default=1.0, metavar="RATIO", help="Part des sessions terminées par logout ; les autres expirent côté serveur (défaut: 1)")
+    parser.add_argument("--sample-interval", type=float, default=30.0, metavar="SEC", help="Intervalle d'échantillonnage des sessions / métriques (défaut: 30)")
+    parser.add_argument("--metrics-url", type=str, default=None, help="Métriques Keycloak :9000 (défaut: KEYCLOAK_METRICS_URL ou http://<hôte>:9000/metrics ; '' pour désactiver)")
+    parser.add_argument("--metrics-filter", type=str, default=DEFAULT_METRICS_FILTER, help="Regex des séries :9000 suivies")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout par requête")
+    parser.add_argument("--results-dir", type=str, default=DEFAULT_RESULTS_DIR, metavar="DIR", help="Répertoire des artefacts de résultats (défaut: RESULTS_DIR ou results/)")
+    parser.add_argument("--no-save", action="store_true", help="Ne pas écrire l'artefact de résultats")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    if args.metrics_url is None:
+        args.metrics_url = default_metrics_url(base_url)
+    pattern = re.compile(args.metrics_filter)
+
+    if args.accounts_file:
+        try:
+            accounts: Sequence[Tuple[str, str]] = AccountStore(args.accounts_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Erreur: lecture de {args.accounts_file} : {e}")
+            return 1
+        if not accounts:
+            print("Erreur: aucun compte dans le fichier")
+            return 1
+    else:
+        accounts = [(args.user, args.password)]
+
+    print("=" * 60)
+    print("  🔁 Soak test des sessions Keycloak")
+    print(f"     URL        : {base_url}")
+    print(f"     Realm      : {args.realm}")
+    print(f"     Comptes    : {len(accounts)}")
+    print(f"     Sessions   : {args.sessions} simultanées, durée {args.session_lifetime:.0f}s ±{args.lifetime_jitter * 100:.0f} %, "
+          f"refresh {args.refresh_interval:g}s, logout {args.logout_ratio * 100:.0f} %")
+    print(f"     Durée      : {args.duration:.0f} s (échantillon toutes les {args.sample_interval:.0f} s)")
+    print(f"     Métriques  : {args.metrics_url or 'désactivées'}")
+    print("=" * 60)
+
+    token = admin_token_provider(base_url, args.admin_user, args.admin_password)
+    try:
+        token()
+    except requests.exceptions.RequestException as e:
+        print(f"Erreur: token admin : {e}")
+        return 1
+
+    state = SoakState()
+    stop = threading.Event()
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=session_worker, args=(args, base_url, accounts, state, stop, i), daemon=True)
+        for i in range(args.sessions)
+    ]
+    for t in threads:
+        t.start()
+
+    samples: List[dict] = []
+    deadline = start + args.duration
+    last_sample = start
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(min(args.sample_interval, max(deadline - time.monotonic(), 0)))
+            sample = take_sample(args, base_url, token, state, start, last_sample, pattern)
+            last_sample = time.monotonic()
+            samples.append(sample)
+            print_sample(sample)
+    except KeyboardInterrupt:
+        print("\n  Interruption : arrêt des sessions...")
+    stop.set()
+    for t in threads:
+        t.join(timeout=args.timeout * 2 + 2)
+    end = time.monotonic()
+
+    # Montée exclue de la dérive : durée de vie d'une session (les sessions ouvertes se stabilisent)
+    drift = compute_drift(samples, min(args.session_lifetime, args.duration / 2))
+    print("=" * 60)
+    print_soak_report(state, samples, drift, end - start)
+    print("=" * 60)
+
+    if not args.no_save:
+        record = build_run_record(
+            "keycloak_session_soak", vars(args), state.results["login"], start, end,
+            keycloak_version=fetch_keycloak_version(base_url, args.admin_user, args.admin_password),
+            extra={
+                "operations": {
+                    op: {"requests": len(res), "errors": sum(1 for r in res if not r[0])}
+                    for op, res in state.results.items()
+                },
+                "abandoned_sessions": state.abandoned,
+                "samples": samples,
+                "drift_per_hour": drift,
+            },
+        )
+        path = save_run(record, args.results_dir)
+        if path:
+            print(f"  💾 Résultats : {path}")
+    return 0 if state.results["login"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Charge multi-realm (multi-tenant) : répartition pondérée du trafic entre plusieurs realms.
+
+Le déploiement cible héberge des centaines de realms : caches par realm et coût de résolution du
+realm comptent. Utilisé par keycloak_load_test_multi_user.py et test_keycloak.py (--realms) :
+
+  - spécification des realms et poids : "tenant-a:3,tenant-b:1,tenant-c" (poids 1 par défaut),
+    plages "tenant-{1..200}" (chaque realm de la plage reçoit le poids), ou "@fichier" (une
+    entrée par ligne) ;
+  - provisionnement en masse par realm via partialImport (lots de 500, ifResourceExists=SKIP :
+    idempotent, les comptes existants sont conservés) ;
+  - tirage pondéré du realm à chaque requête, stats par realm et agrégées.
+"""
+
+import bisect
+import itertools
+import random
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from keycloak_accounts import AccountScheduler
+from keycloak_load_profile import Result, percentile
+
+PARTIAL_IMPORT_CHUNK = 500
+PROVISION_WORKERS = 4
+_RANGE = re.compile(r"\{(\d+)\.\.(\d+)\}")
+
+
+def _expand(name: str) -> List[str]:
+    m = _RANGE.search(name)
+    if not m:
+        return [name]
+    lo, hi = int(m.group(1)), int(m.group(2))
+    out = []
+    for i in range(lo, hi + 1):
+        out.extend(_expand(name[:m.start()] + str(i) + name[m.end():]))
+    return out
+
+
+def parse_realm_weights(spec: str) -> List[Tuple[str, float]]:
+    """"a:3,b:1,tenant-{1..10}" ou "@fichier" → [(realm, poids)] (ordre conservé, doublons fusionnés)."""
+    if spec.startswith("@"):
+        with open(spec[1:], "r", encoding="utf-8") as f:
+            entries = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    else:
+        entries = [e.strip() for e in spec.split(",") if e.strip()]
+    weights: Dict[str, float] = {}
+    for entry in entries:
+        name, _, weight = entry.partition(":")
+        w = float(weight) if weight else 1.0
+        if w <= 0:
+            raise ValueError(f"poids invalide pour {name} : {weight}")
+        for realm in _expand(name.strip()):
+            weights[realm] = weights.get(realm, 0.0) + w
+    if not weights:
+        raise ValueError("aucun realm")
+    return list(weights.items())
+
+
+def split_by_weight(total: int, realms: List[Tuple[str, float]]) -> Dict[str, int]:
+    """Répartit `total` entre les realms proportionnellement aux poids (plus forts restes)."""
+    wsum = sum(w for _, w in realms)
+    exact = [(r, total * w / wsum) for r, w in realms]
+    counts = {r: int(x) for r, x in exact}
+    rest = total - sum(counts.values())
+    for r, _ in sorted(exact, key=lambda e: e[1] - int(e[1]), reverse=True)[:rest]:
+        counts[r] += 1
+    return counts
+
+
+def _headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json", "Accept": "application/json"}
+
+
+def existing_realms(base_url: str, token: str) -> set:
+    r = requests.get(f"{base_url}/admin/realms", params={"briefRepresentation": "true"}, headers=_headers(token), timeout=60)
+    r.raise_for_status()
+    return {realm.get("realm") for realm in r.json()}
+
+
+def create_missing_realms(base_url: str, token: Callable[[], str], realms: List[str]) -> List[str]:
+    """Crée les realms absents ; retourne la liste des realms créés."""
+    present = existing_realms(base_url, token())
+    created = []
+    for realm in realms:
+        if realm in present:
+            continue
+        r = requests.post(f"{base_url}/admin/realms", json={"realm": realm, "enabled": True}, headers=_headers(token()), timeout=60)
+        if r.status_code == 201:
+            created.append(realm)
+        elif r.status_code != 409:
+            r.raise_for_status()
+    return created
+
+
+def user_representation(username: str, password: Optional[str] = None, email_verified: bool = True) -> dict:
+    user = {
+        "username": username,
+        "email": f"{username}@test.local",
+        "enabled": True,
+        "emailVerified": email_verified,
+    }
+    if password is not None:
+        user["credentials"] = [{"type": "password", "value": password, "temporary": False}]
+    return user
+
+
+def bulk_provision_users(base_url: str, token: Callable[[], str], realm: str, users: List[dict]) -> Tuple[Dict[str, str], int, int]:
+    """
+    Import en masse (partialImport, SKIP si existant). Retourne ({username: id}, ajoutés, ignorés).
+    """
+    ids: Dict[str, str] = {}
+    added = skipped = 0
+    for i in range(0, len(users), PARTIAL_IMPORT_CHUNK):
+        r = requests.post(
+            f"{base_url}/admin/realms/{realm}/partialImport",
+            json={"ifResourceExists": "SKIP", "users": users[i:i + PARTIAL_IMPORT_CHUNK]},
+            headers=_headers(token()),
+            timeout=300,
+        )
+        r.raise_for_status()
+        body = r.json()
+        added += int(body.get("added", 0))
+        skipped += int(body.get("skipped", 0))
+        for res in body.get("results", []):
+            if res.get("resourceType") == "USER" and res.get("id"):
+                ids[res.get("resourceName")] = res["id"]
+    return ids, added, skipped
+
+
+def provision_tenants(
+    base_url: str,
+    token: Callable[[], str],
+    realms: List[str],
+    prefix: str,
+    count: int,
+    password: str,
+    create_realms: bool = False,
+) -> dict:
+    """
+    Comptes {prefix}0..count-1 dans chaque realm (partialImport, realms traités en parallèle).
+    Les comptes déjà présents sont ignorés : leur mot de passe n'est pas modifié.
+    """
+    t0 = time.perf_counter()
+    created = create_missing_realms(base_url, token, realms) if create_realms else []
+    users = [user_representation(f"{prefix}{i}", password) for i in range(count)]
+    with ThreadPoolExecutor(max_workers=PROVISION_WORKERS) as pool:
+        outcomes = list(pool.map(lambda realm: bulk_provision_users(base_url, token, realm, users), realms))
+    return {
+        "realms_created": len(created),
+        "added": sum(o[1] for o in outcomes),
+        "skipped": sum(o[2] for o in outcomes),
+        "elapsed": time.perf_counter() - t0,
+    }
+
+
+class TenantSet:
+    """Realms pondérés : tirage du realm par requête, ordonnanceur de comptes par realm, stats par realm."""
+
+    def __init__(self, realms: List[Tuple[str, float]], seed: Optional[int] = None) -> None:
+        self.weights = dict(realms)
+        self.realms = [r for r, _ in realms]
+        self._cdf = list(itertools.accumulate(w for _, w in realms))
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.results: Dict[str, List[Result]] = {r: [] for r in self.realms}
+        self.schedulers: Dict[str, AccountScheduler] = {}
+
+    def pick(self) -> str:
+        with self._lock:
+            x = self._rng.random() * self._cdf[-1]
+        return self.realms[min(bisect.bisect_right(self._cdf, x), len(self.realms) - 1)]
+
+    def record(self, realm: str, ok: bool, lat: float, err: Optional[str]) -> None:
+        with self._lock:
+            self.results[realm].append((ok, lat, err, time.monotonic()))
+
+    def request_fn(self, do_login: Callable[[str, str, str], Tuple[bool, float, Optional[str]]]):
+        """Fonction de requête (moteur de paliers / workers) : realm tiré au poids, compte de ce realm."""
+
+        def do_request() -> Tuple[bool, float, Optional[str]]:
+            realm = self.pick()
+            with self.schedulers[realm].checkout() as (user, pwd):
+                ok, lat, err = do_login(realm, user, pwd)
+            self.record(realm, ok, lat, err)
+            return ok, lat, err
+
+        return do_request
+
+
+def realm_summary(results_by_realm: Dict[str, List[Result]], elapsed: float) -> Dict[str, dict]:
+    """Stats par realm (rapport et artefact de résultats)."""
+    out = {}
+    for realm, res in results_by_realm.items():
+        ok_lat = sorted(r[1] for r in res if r[0])
+        out[realm] = {
+            "requests": len(res),
+            "throughput": len(res) / max(elapsed, 1e-9),
+            "error_rate": (len(res) - len(ok_lat)) / len(res) if res else 0.0,
+            "avg": statistics.mean(ok_lat) if ok_lat else None,
+            "p50": percentile(ok_lat, 50) if ok_lat else None,
+            "p99": percentile(ok_lat, 99) if ok_lat else None,
+        }
+    return out
+
+
+def print_realm_report(summary: Dict[str, dict], weights: Dict[str, float], limit: int = 50) -> None:
+    """Tableau par realm (les `limit` realms les plus sollicités) et dispersion entre realms."""
+    total = sum(s["requests"] for s in summary.values()) or 1
+    wsum = sum(weights.values()) or 1
+    print(f"     Realms           : {len(summary)}")
+    print(f"       {'realm':<24} {'poids':>6} {'part':>7} {'req/s':>8} {'p50':>7} {'p99':>7} {'err %':>6}")
+    rows = sorted(summary.items(), key=lambda kv: kv[1]["requests"], reverse=True)
+    for realm, s in rows[:limit]:
+        p50 = f"{s['p50']:.3f}" if s["p50"] is not None else "n/a"
+        p99 = f"{s['p99']:.3f}" if s["p99"] is not None else "n/a"
+        print(f"       {realm[:24]:<24} {weights.get(realm, 0) / wsum * 100:5.1f}% {s['requests'] / total * 100:6.1f}% "
+              f"{s['throughput']:8.1f} {p50:>7} {p99:>7} {s['error_rate'] * 100:6.2f}")
+    if len(rows) > limit:
+        print(f"       ... {len(rows) - limit} autres realms (voir l'artefact de résultats)")
+    p99s = [s["p99"] for s in summary.values() if s["p99"] is not None]
+    if len(p99s) >= 2:
+        print(f"     p99 entre realms : min={min(p99s):.3f}  médiane={statistics.median(p99s):.3f}  max={max(p99s):.3f}")
@@ -8,6 +8,11 @@ Stratégies d'envoi (--strategy) :
   full         Débit max, sans pause (défaut).
   batch-pause  Lots de N mails puis pause : ex. 5k mails + 30s → --strategy batch-pause --send-batch-size 5000 --pause 30
   rate         Débit constant (mails/s) : ex. 100 mails/s = 360k/h, 3M ≈ 8h20 → --strategy rate --rate 100
+  search       Débit max soutenable sous SLO (p99, erreurs) par paliers + dichotomie → --strategy search --slo-p99 1
+
+Multi-realm (--realms "a:3,b:1", "tenant-{1..100}" ou "@fichier") : les --nb utilisateurs sont
+répartis entre les realms selon les poids et créés en masse (partialImport, keycloak_tenants.py) ;
+les envois sont entrelacés, le rapport est donné par realm et agrégé.
 
 Usage local (défaut) :
   python test_keycloak.py [--nb N] [--skip-create] [--skip-cleanup]
@@ -16,16 +21,35 @@ Usage préprod avec débit limité :
   export KEYCLOAK_URL=https://auth-preprod.example.com
   export KEYCLOAK_ADMIN_PASSWORD=...
   python test_keycloak.py --url "$KEYCLOAK_URL" --nb 10000 --strategy rate --rate 100
+
+Usage multi-realm :
+  python test_keycloak.py --realms "tenant-{1..50}" --create-realms --nb 5000 --strategy rate --rate 50
 """
 
 import argparse
 import concurrent.futures
+import itertools
 import os
+import random
+import threading
 import time
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import requests
 
+from keycloak_admin_utils import admin_token_provider
+from keycloak_capacity_search import add_search_arguments, print_search_report, run_search, search_record, slo_from_args
+from keycloak_run_results import DEFAULT_RESULTS_DIR, build_run_record, fetch_keycloak_version, save_run
+from keycloak_tenants import (
+    bulk_provision_users,
+    create_missing_realms,
+    parse_realm_weights,
+    print_realm_report,
+    realm_summary,
+    split_by_weight,
+    user_representation,
+)
+
 # Charger .env si présent (optionnel : pip install python-dotenv)
 # Charge depuis la racine du projet (parent de src/) pour que .env soit trouvé depuis make ou src/
 try:
@@ -57,6 +81,7 @@ BATCH_SIZE     = _env_int("BATCH_SIZE", 500)  # Rafraîchit le token tous les X
 STRATEGY_FULL         = "full"          # Envoi max sans pause
 STRATEGY_BATCH_PAUSE  = "batch-pause"   # Lots + pause entre chaque lot
 STRATEGY_RATE         = "rate"          # Débit constant (mails/sec)
+STRATEGY_SEARCH       = "search"        # Recherche du débit max sous SLO (keycloak_capacity_search)
 # ──────────────────────────────────────────────────────────────────────────────
 
 
@@ -122,6 +147,37 @@ def send_verification_email(base_url: str, realm: str, token: str, user_id: str)
     return r.status_code
 
 
+def timed_send_verification_email(
+    base_url: str, realm: str, token: str, user_id: str
+) -> Tuple[bool, float, Optional[str], float]:
+    """Envoi chronométré : (succès, latence_sec, erreur, instant_fin monotonic) pour l'artefact de résultats."""
+    start = time.perf_counter()
+    try:
+        status = send_verification_email(base_url, realm, token, user_id)
+        err = None if status in (200, 204) else f"HTTP {status}"
+    except requests.exceptions.Timeout:
+        err = "timeout"
+    except requests.exceptions.RequestException as e:
+        err = str(type(e).__name__)
+    return err is None, time.perf_counter() - start, err, time.monotonic()
+
+
+def _timed_send_target(
+    base_url: str, realm: str, token: str, target
+) -> Tuple[str, Tuple[bool, float, Optional[str], float]]:
+    """Cible = user_id (realm par défaut) ou (realm, user_id) en multi-realm. Retourne (realm, résultat)."""
+    target_realm, uid = target if isinstance(target, tuple) else (realm, target)
+    return target_realm, timed_send_verification_email(base_url, target_realm, token, uid)
+
+
+def _collect(outcome: tuple, results: list, realm_results: Optional[Dict[str, list]]) -> tuple:
+    target_realm, res = outcome
+    results.append(res)
+    if realm_results is not None:
+        realm_results.setdefault(target_realm, []).append(res)
+    return res
+
+
 def delete_user(base_url: str, realm: str, token: str, user_id: str) -> None:
     requests.delete(
         f"{base_url}/admin/realms/{realm}/users/{user_id}",
@@ -155,6 +211,31 @@ def create_users(base_url: str, realm: str, admin_user: str, admin_pass: str, nb
     return user_ids
 
 
+def create_tenant_users(
+    base_url: str, realms: List[Tuple[str, float]], admin_user: str, admin_pass: str, nb: int, create_realms: bool
+) -> list:
+    """nb users répartis entre les realms selon les poids (partialImport). Retourne [(realm, user_id)] entrelacés."""
+    run_id = str(int(time.time()))
+    print(f"\n📋 Création de {nb} utilisateurs fictifs dans {len(realms)} realms (run_id={run_id})...")
+    token = admin_token_provider(base_url, admin_user, admin_pass)
+    start = time.time()
+    if create_realms:
+        created = create_missing_realms(base_url, token, [r for r, _ in realms])
+        print(f"  ✔ {len(created)} realms créés")
+    targets = []
+    offset = 0
+    for realm, count in split_by_weight(nb, realms).items():
+        users = [user_representation(f"testuser_{offset + i}_{run_id}", email_verified=False) for i in range(count)]
+        offset += count
+        ids, _, _ = bulk_provision_users(base_url, token, realm, users)
+        targets.extend((realm, uid) for uid in ids.values())
+    # Entrelacement : chaque lot / palier d'envoi respecte la répartition des poids
+    random.Random(run_id).shuffle(targets)
+    elapsed = time.time() - start
+    print(f"  ✅ {len(targets)} utilisateurs créés en {elapsed:.1f}s ({len(targets) / max(elapsed, 1e-9):.0f} users/s)\n")
+    return targets
+
+
 # ── Étape 2 : Envoi des mails ──────────────────────────────────────────────────
 def _send_chunk(
     base_url: str,
@@ -162,16 +243,18 @@ def _send_chunk(
     token: str,
     executor: concurrent.futures.ThreadPoolExecutor,
     user_ids_chunk: list,
+    results: list,
+    realm_results: Optional[Dict[str, list]] = None,
 ) -> tuple:
-    """Envoie un lot d'emails, retourne (sent, errors)."""
+    """Envoie un lot d'emails, retourne (sent, errors). Chaque envoi est ajouté à results."""
     sent, errors = 0, 0
     futures = [
-        executor.submit(send_verification_email, base_url, realm, token, uid)
+        executor.submit(_timed_send_target, base_url, realm, token, uid)
         for uid in user_ids_chunk
     ]
     for future in concurrent.futures.as_completed(futures):
-        status = future.result()
-        if status in (200, 204):
+        res = _collect(future.result(), results, realm_results)
+        if res[0]:
             sent += 1
         else:
             errors += 1
@@ -189,7 +272,12 @@ def send_emails(
     send_batch_size: int = 5000,
     rate_per_sec: Optional[float] = None,
     rate_batch: int = 100,
-) -> None:
+    realm_results: Optional[Dict[str, list]] = None,
+) -> Tuple[list, float, float]:
+    """
+    Envoie les mails ; retourne (résultats par envoi, début, fin) en temps monotonic.
+    user_ids : ids (realm) ou (realm, id) en multi-realm ; realm_results reçoit alors les résultats par realm.
+    """
     total = len(user_ids)
     if strategy == STRATEGY_FULL:
         strategy_desc = "débit max (sans pause)"
@@ -206,19 +294,21 @@ def send_emails(
 
     token = get_token(base_url, admin_user, admin_pass)
     start = time.time()
+    start_mono = time.monotonic()
     sent, errors = 0, 0
     completed = 0
+    results: List[Tuple[bool, float, Optional[str], float]] = []
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         if strategy == STRATEGY_FULL:
             # Envoi max : tout en parallèle
             future_to_uid = {
-                executor.submit(send_verification_email, base_url, realm, token, uid): uid
+                executor.submit(_timed_send_target, base_url, realm, token, uid): uid
                 for uid in user_ids
             }
             for i, future in enumerate(concurrent.futures.as_completed(future_to_uid)):
-                status = future.result()
-                if status in (200, 204):
+                res = _collect(future.result(), results, realm_results)
+                if res[0]:
                     sent += 1
                 else:
                     errors += 1
@@ -235,7 +325,7 @@ def send_emails(
                 chunk = user_ids[chunk_start : chunk_start + send_batch_size]
                 if not chunk:
                     break
-                s, e = _send_chunk(base_url, realm, token, executor, chunk)
+                s, e = _send_chunk(base_url, realm, token, executor, chunk, results, realm_results)
                 sent += s
                 errors += e
                 completed += len(chunk)
@@ -254,7 +344,7 @@ def send_emails(
                 if not chunk:
                     break
                 batch_start = time.time()
-                s, e = _send_chunk(base_url, realm, token, executor, chunk)
+                s, e = _send_chunk(base_url, realm, token, executor, chunk, results, realm_results)
                 sent += s
                 errors += e
                 completed += len(chunk)
@@ -282,6 +372,44 @@ def send_emails(
     print(f"     • Erreurs       : {errors}")
     print(f"     • Durée totale  : {_format_duration(elapsed)} ({elapsed:.1f}s)")
     print(f"     • Débit moyen   : {rate:.1f} mails/s")
+    return results, start_mono, time.monotonic()
+
+
+# ── Étape 2 bis : Recherche de capacité (strategy search) ────────────────────
+def search_email_capacity(
+    base_url: str,
+    realm: str,
+    admin_user: str,
+    admin_pass: str,
+    user_ids: list,
+    args,
+    realm_results: Optional[Dict[str, list]] = None,
+) -> Tuple[list, float, float, dict]:
+    """Paliers d'envoi sur les users créés (renvois cycliques). Retourne (résultats, début, fin, extra artefact)."""
+    if not user_ids:
+        raise ValueError("aucun utilisateur créé : recherche de capacité impossible")
+    print(f"📨 Recherche de capacité d'envoi ({len(user_ids)} users, par {args.search_by})...")
+    token = admin_token_provider(base_url, admin_user, admin_pass)
+    next_index = itertools.count()
+    results: List[Tuple[bool, float, Optional[str], float]] = []
+    results_lock = threading.Lock()
+
+    def request_factory(_: int):
+        def do_request():
+            uid = user_ids[next(next_index) % len(user_ids)]
+            target_realm, res = _timed_send_target(base_url, realm, token(), uid)
+            if realm_results is not None:
+                with results_lock:
+                    realm_results.setdefault(target_realm, []).append(res)
+            return res[:3]
+        return do_request
+
+    start = time.monotonic()
+    best, steps, _ = run_search(args, request_factory, results, results_lock, timeout=10)
+    end = time.monotonic()
+    print()
+    print_search_report(best, steps, slo_from_args(args), args.search_by)
+    return results, start, end, search_record(args, best, steps)
 
 
 # ── Étape 3 : Nettoyage ────────────────────────────────────────────────────────
@@ -291,9 +419,10 @@ def cleanup(base_url: str, realm: str, admin_user: str, admin_pass: str, user_id
     start = time.time()
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        targets = [uid if isinstance(uid, tuple) else (realm, uid) for uid in user_ids]
         futures = [
-            executor.submit(delete_user, base_url, realm, token, uid)
-            for uid in user_ids
+            executor.submit(delete_user, base_url, target_realm, token, uid)
+            for target_realm, uid in targets
         ]
         for i, _ in enumerate(concurrent.futures.as_completed(futures)):
             if i % BATCH_SIZE == 0 and i > 0:
@@ -319,15 +448,18 @@ if __name__ == "__main__":
     )
     parser.add_argument("--url",     type=str, default=None, help="URL Keycloak (sinon KEYCLOAK_URL ou localhost:8080)")
     parser.add_argument("--realm",   type=str, default=None, help="Realm cible (sinon KEYCLOAK_REALM ou master)")
+    parser.add_argument("--realms",  type=str, default=None, metavar="SPEC", help="Plusieurs realms pondérés : \"a:3,b:1\", \"tenant-{1..100}\" ou \"@fichier\" (remplace --realm)")
+    parser.add_argument("--create-realms", action="store_true", help="Avec --realms : créer les realms absents (conservés après le test)")
     parser.add_argument("--user",    type=str, default=None, help="Admin username (sinon KEYCLOAK_ADMIN_USER ou admin)")
     parser.add_argument("--nb",      type=int, default=NB_USERS, help="Nombre de mails à envoyer")
     # Stratégie d'envoi
     parser.add_argument(
         "--strategy",
         type=str,
-        choices=[STRATEGY_FULL, STRATEGY_BATCH_PAUSE, STRATEGY_RATE],
+        choices=[STRATEGY_FULL, STRATEGY_BATCH_PAUSE, STRATEGY_RATE, STRATEGY_SEARCH],
         default=STRATEGY_FULL,
-        help="Stratégie: full (débit max), batch-pause (lots + pause), rate (débit constant mails/s)",
+        help="Stratégie: full (débit max), batch-pause (lots + pause), rate (débit constant mails/s), "
+             "search (débit max sous SLO)",
     )
     parser.add_argument(
         "--pause",
@@ -357,8 +489,11 @@ if __name__ == "__main__":
         metavar="N",
         help="Avec --strategy rate: taille du micro-lot pour le throttling (défaut: 100)",
     )
+    add_search_arguments(parser, default_by="rate")
     parser.add_argument("--skip-create",  action="store_true", help="Ne pas recréer les utilisateurs")
     parser.add_argument("--skip-cleanup", action="store_true", help="Ne pas supprimer les utilisateurs après")
+    parser.add_argument("--results-dir", type=str, default=DEFAULT_RESULTS_DIR, metavar="DIR", help="Répertoire des artefacts de résultats (défaut: RESULTS_DIR ou results/)")
+    parser.add_argument("--no-save", action="store_true", help="Ne pas écrire l'artefact de résultats")
     args = parser.parse_args()
 
     base_url, realm, admin_user, admin_pass = _config_from_env_and_args()
@@ -373,17 +508,28 @@ if __name__ == "__main__":
 
     if args.strategy == STRATEGY_RATE and (args.rate is None or args.rate <= 0):
         parser.error("--strategy rate requiert --rate N (mails/sec, ex: --rate 100)")
+    tenant_realms = None
+    if args.realms:
+        try:
+            tenant_realms = parse_realm_weights(args.realms)
+        except (OSError, ValueError) as e:
+            parser.error(f"--realms {args.realms} : {e}")
 
     strategy_line = f"Stratégie : {args.strategy}"
     if args.strategy == STRATEGY_BATCH_PAUSE:
         strategy_line += f" (lot={args.send_batch_size}, pause={args.pause}s)"
     elif args.strategy == STRATEGY_RATE:
         strategy_line += f" ({args.rate:.0f} mails/s)"
+    elif args.strategy == STRATEGY_SEARCH:
+        strategy_line += f" (p99 ≤ {args.slo_p99}s, erreurs ≤ {args.slo_error_rate * 100:.2f} %)"
 
     print("=" * 55)
     print("  🚀 Test envoi mails Keycloak")
     print(f"     URL      : {base_url}")
-    print(f"     Realm    : {realm}")
+    if tenant_realms:
+        print(f"     Realms   : {len(tenant_realms)} ({args.realms})")
+    else:
+        print(f"     Realm    : {realm}")
     print(f"     User     : {admin_user}")
     print(f"     Nb mails : {args.nb}")
     print(f"     {strategy_line}")
@@ -392,19 +538,49 @@ if __name__ == "__main__":
 
     total_start = time.time()
 
-    user_ids = create_users(base_url, realm, admin_user, admin_pass, args.nb)
-    send_emails(
-        base_url,
-        realm,
-        admin_user,
-        admin_pass,
-        user_ids,
-        strategy=args.strategy,
-        pause_sec=args.pause,
-        send_batch_size=args.send_batch_size,
-        rate_per_sec=args.rate,
-        rate_batch=args.rate_batch,
-    )
+    realm_results = None
+    if tenant_realms:
+        user_ids = create_tenant_users(base_url, tenant_realms, admin_user, admin_pass, args.nb, args.create_realms)
+        realm_results = {r: [] for r, _ in tenant_realms}
+    else:
+        user_ids = create_users(base_url, realm, admin_user, admin_pass, args.nb)
+    search_extra = None
+    if args.strategy == STRATEGY_SEARCH:
+        send_results, send_start, send_end, search_extra = search_email_capacity(
+            base_url, realm, admin_user, admin_pass, user_ids, args, realm_results
+        )
+    else:
+        send_results, send_start, send_end = send_emails(
+            base_url,
+            realm,
+            admin_user,
+            admin_pass,
+            user_ids,
+            strategy=args.strategy,
+            pause_sec=args.pause,
+            send_batch_size=args.send_batch_size,
+            rate_per_sec=args.rate,
+            rate_batch=args.rate_batch,
+            realm_results=realm_results,
+        )
+
+    extra = dict(search_extra or {}, users_created=len(user_ids))
+    if realm_results is not None:
+        print()
+        summary = realm_summary(realm_results, send_end - send_start)
+        weights = dict(tenant_realms)
+        print_realm_report(summary, weights)
+        extra["realms"] = {r: dict(s, weight=weights[r]) for r, s in summary.items()}
+
+    if not args.no_save:
+        record = build_run_record(
+            "test_keycloak", dict(vars(args), realm=realm, url=base_url), send_results, send_start, send_end,
+            keycloak_version=fetch_keycloak_version(base_url, admin_user, admin_pass),
+            extra=extra,
+        )
+        path = save_run(record, args.results_dir)
+        if path:
+            print(f"  💾 Résultats : {path}")
 
     if not args.skip_cleanup:
         cleanup(base_url, realm, admin_user, admin_pass, user_ids)